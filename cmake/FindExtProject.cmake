@@ -30,11 +30,173 @@ function(color_message text)
 
 endfunction()
 
+# Remove least recently used objects of the artifact cache except keep until
+# the cache fits max_size (bytes or with K, M, G, T suffix), the same as
+# ArtifactCache.prune() in opt/artifact_cache.py. Call with the cache locked.
+function(prune_artifacts cache_dir max_size keep)
+    string(TOUPPER "${max_size}" max_size)
+    if(NOT max_size MATCHES "^([0-9]+)([KMGT]?)B?$")
+        message(WARNING "Unsupported artifact cache size ${max_size}")
+        return()
+    endif()
+    set(LIMIT ${CMAKE_MATCH_1})
+    if(CMAKE_MATCH_2)
+        set(UNITS K M G T)
+        list(FIND UNITS ${CMAKE_MATCH_2} POWER)
+        foreach(I RANGE ${POWER})
+            math(EXPR LIMIT "${LIMIT} * 1024")
+        endforeach()
+    endif()
+
+    # Object mtime is the last access time, zero padded to sort as strings
+    file(GLOB OBJECTS ${cache_dir}/objects/*/*)
+    set(ENTRIES)
+    set(TOTAL 0)
+    foreach(OBJECT ${OBJECTS})
+        file(SIZE ${OBJECT} SIZE)
+        file(TIMESTAMP ${OBJECT} MTIME "%s" UTC)
+        string(LENGTH ${MTIME} MTIME_LENGTH)
+        math(EXPR PAD_LENGTH "12 - ${MTIME_LENGTH}")
+        string(REPEAT 0 ${PAD_LENGTH} PAD)
+        math(EXPR TOTAL "${TOTAL} + ${SIZE}")
+        list(APPEND ENTRIES "${PAD}${MTIME}|${SIZE}|${OBJECT}")
+    endforeach()
+    if(TOTAL LESS_EQUAL LIMIT)
+        return()
+    endif()
+
+    list(SORT ENTRIES)
+    foreach(ENTRY ${ENTRIES})
+        if(TOTAL LESS_EQUAL LIMIT)
+            break()
+        endif()
+        string(REPLACE "|" ";" FIELDS ${ENTRY})
+        list(GET FIELDS 1 SIZE)
+        list(GET FIELDS 2 OBJECT)
+        get_filename_component(OBJECT_HASH ${OBJECT} NAME)
+        if(OBJECT_HASH STREQUAL keep)
+            continue()
+        endif()
+        file(REMOVE ${OBJECT})
+        math(EXPR TOTAL "${TOTAL} - ${SIZE}")
+    endforeach()
+
+    # Drop urls pointing to removed objects
+    file(GLOB URL_FILES ${cache_dir}/urls/*)
+    foreach(URL_FILE ${URL_FILES})
+        if(URL_FILE MATCHES "\\.tmp$")
+            continue()
+        endif()
+        file(READ ${URL_FILE} OBJECT_HASH)
+        string(STRIP "${OBJECT_HASH}" OBJECT_HASH)
+        string(SUBSTRING ${OBJECT_HASH} 0 2 OBJECT_PREFIX)
+        if(NOT EXISTS ${cache_dir}/objects/${OBJECT_PREFIX}/${OBJECT_HASH})
+            file(REMOVE ${URL_FILE})
+        endif()
+    endforeach()
+endfunction()
+
+# Get file from the shared artifact cache (ARTIFACT_CACHE_DIR variable or
+# BORSCH_ARTIFACT_CACHE environment variable), download and store it on miss.
+# The layout is the same as in opt/artifact_cache.py. After a download the
+# cache is pruned to ARTIFACT_CACHE_MAX_SIZE (or BORSCH_ARTIFACT_CACHE_SIZE
+# environment variable) if set. If the download fails, path is not created.
+function(download_artifact url path)
+    if(NOT ARTIFACT_CACHE_DIR AND DEFINED ENV{BORSCH_ARTIFACT_CACHE})
+        set(ARTIFACT_CACHE_DIR $ENV{BORSCH_ARTIFACT_CACHE})
+    endif()
+    if(NOT ARTIFACT_CACHE_MAX_SIZE AND DEFINED ENV{BORSCH_ARTIFACT_CACHE_SIZE})
+        set(ARTIFACT_CACHE_MAX_SIZE $ENV{BORSCH_ARTIFACT_CACHE_SIZE})
+    endif()
+    if(NOT ARTIFACT_CACHE_DIR)
+        file(DOWNLOAD ${url} ${path} TLS_VERIFY OFF STATUS DOWNLOAD_STATUS)
+        list(GET DOWNLOAD_STATUS 0 DOWNLOAD_CODE)
+        if(NOT DOWNLOAD_CODE EQUAL 0)
+            file(REMOVE ${path})
+            message(WARNING "Download ${url} failed: ${DOWNLOAD_STATUS}")
+        endif()
+        return()
+    endif()
+
+    string(SHA1 URL_HASH ${url})
+    set(URL_FILE ${ARTIFACT_CACHE_DIR}/urls/${URL_HASH})
+    set(LOCK_FILE ${ARTIFACT_CACHE_DIR}/cache.lock)
+    file(MAKE_DIRECTORY ${ARTIFACT_CACHE_DIR}/urls ${ARTIFACT_CACHE_DIR}/tmp)
+
+    file(LOCK ${LOCK_FILE} TIMEOUT 600)
+    if(EXISTS ${URL_FILE})
+        file(READ ${URL_FILE} OBJECT_HASH)
+        string(STRIP "${OBJECT_HASH}" OBJECT_HASH)
+        string(SUBSTRING ${OBJECT_HASH} 0 2 OBJECT_PREFIX)
+        set(OBJECT_FILE ${ARTIFACT_CACHE_DIR}/objects/${OBJECT_PREFIX}/${OBJECT_HASH})
+        if(EXISTS ${OBJECT_FILE})
+            file(TOUCH ${OBJECT_FILE})
+            execute_process(COMMAND ${CMAKE_COMMAND} -E copy ${OBJECT_FILE} ${path})
+            file(LOCK ${LOCK_FILE} RELEASE)
+            color_message("Use cached ${url}")
+            return()
+        endif()
+    endif()
+    file(LOCK ${LOCK_FILE} RELEASE)
+
+    # Download outside of the lock so other builds are not blocked
+    string(RANDOM LENGTH 16 TMP_NAME)
+    set(TMP_FILE ${ARTIFACT_CACHE_DIR}/tmp/${TMP_NAME})
+    file(DOWNLOAD ${url} ${TMP_FILE} TLS_VERIFY OFF STATUS DOWNLOAD_STATUS)
+    list(GET DOWNLOAD_STATUS 0 DOWNLOAD_CODE)
+    if(NOT DOWNLOAD_CODE EQUAL 0)
+        file(REMOVE ${TMP_FILE})
+        message(WARNING "Download ${url} failed: ${DOWNLOAD_STATUS}")
+        return()
+    endif()
+
+    file(SHA256 ${TMP_FILE} OBJECT_HASH)
+    string(SUBSTRING ${OBJECT_HASH} 0 2 OBJECT_PREFIX)
+    set(OBJECT_FILE ${ARTIFACT_CACHE_DIR}/objects/${OBJECT_PREFIX}/${OBJECT_HASH})
+    execute_process(COMMAND ${CMAKE_COMMAND} -E copy ${TMP_FILE} ${path})
+
+    file(LOCK ${LOCK_FILE} TIMEOUT 600)
+    file(MAKE_DIRECTORY ${ARTIFACT_CACHE_DIR}/objects/${OBJECT_PREFIX})
+    if(EXISTS ${OBJECT_FILE})
+        file(REMOVE ${TMP_FILE})
+        file(TOUCH ${OBJECT_FILE})
+    else()
+        file(RENAME ${TMP_FILE} ${OBJECT_FILE})
+    endif()
+    file(WRITE ${URL_FILE}.tmp ${OBJECT_HASH})
+    file(RENAME ${URL_FILE}.tmp ${URL_FILE})
+    if(ARTIFACT_CACHE_MAX_SIZE)
+        prune_artifacts(${ARTIFACT_CACHE_DIR} ${ARTIFACT_CACHE_MAX_SIZE} ${OBJECT_HASH})
+    endif()
+    file(LOCK ${LOCK_FILE} RELEASE)
+endfunction()
+
 function(get_binary_package url repo repo_type repo_id exact_version is_static download_url name)
     include(${CMAKE_CURRENT_FUNCTION_LIST_DIR}/helper.cmake)
     get_compiler_version(COMPILER)
     get_prefix(STATIC_PREFIX ${is_static})
 
+    # Use assets resolved by opt/release_resolver.py instead of parsing JSON.
+    if(NOT BORSCH_RESOLVED_ASSETS AND DEFINED ENV{BORSCH_RESOLVED_ASSETS})
+        set(BORSCH_RESOLVED_ASSETS $ENV{BORSCH_RESOLVED_ASSETS})
+    endif()
+    if(BORSCH_RESOLVED_ASSETS AND EXISTS ${BORSCH_RESOLVED_ASSETS})
+        include(${BORSCH_RESOLVED_ASSETS})
+        if(exact_version)
+            set(RESOLVED_KEY BORSCH_RESOLVED_${repo}_${exact_version})
+        else()
+            set(RESOLVED_KEY BORSCH_RESOLVED_${repo}_latest)
+        endif()
+        set(ASSET_KEY ${RESOLVED_KEY}_${STATIC_PREFIX}${COMPILER})
+        if(DEFINED ${RESOLVED_KEY} AND DEFINED ${ASSET_KEY}_URL)
+            color_message("Found binary package ${${ASSET_KEY}_NAME}")
+            set(${download_url} ${${ASSET_KEY}_URL} PARENT_SCOPE)
+            set(${name} ${${ASSET_KEY}_NAME} PARENT_SCOPE)
+            return()
+        endif()
+        # Not resolved, ask the server below
+    endif()
+
     if(repo_type STREQUAL "github") # TODO: Add gitlab here.
         if(NOT EXISTS ${CMAKE_BINARY_DIR}/${repo}_latest.json)
             if(exact_version)
@@ -213,18 +375,34 @@ function(find_extproject name)
         set(IS_STATIC YES)
     endif()
 
-    # Try to get prebuilt binary package
-    get_binary_package(${repo_bin_url} ${repo_bin} ${repo_bin_type} ${repo_bin_id} ${TEST_VERSION} ${IS_STATIC} BINARY_URL BINARY_NAME)
+    # Packages built in the same run are installed by opt/crosscompile.py
+    # into BORSCH_STAGING_PREFIX/<repository name>, use them before binary
+    # packages which may be not uploaded yet.
+    if(NOT BORSCH_STAGING_PREFIX AND DEFINED ENV{BORSCH_STAGING_PREFIX})
+        set(BORSCH_STAGING_PREFIX $ENV{BORSCH_STAGING_PREFIX})
+    endif()
+    get_filename_component(STAGED_NAME ${repo} NAME)
+    unset(BINARY_ROOT)
+    if(BORSCH_STAGING_PREFIX AND EXISTS ${BORSCH_STAGING_PREFIX}/${STAGED_NAME})
+        color_message("Found staged package ${BORSCH_STAGING_PREFIX}/${STAGED_NAME}")
+        set(BINARY_ROOT ${BORSCH_STAGING_PREFIX}/${STAGED_NAME})
+    else()
+        # Try to get prebuilt binary package
+        get_binary_package(${repo_bin_url} ${repo_bin} ${repo_bin_type} ${repo_bin_id} ${TEST_VERSION} ${IS_STATIC} BINARY_URL BINARY_NAME)
+    endif()
 
     if(BINARY_URL)
         # Download binary build files
         if(NOT EXISTS ${CMAKE_BINARY_DIR}/${name}.zip)
-            file(DOWNLOAD
-                ${BINARY_URL}
-                ${CMAKE_BINARY_DIR}/${name}.zip
-                TLS_VERIFY OFF
-            )
+            download_artifact(${BINARY_URL} ${CMAKE_BINARY_DIR}/${name}.zip)
         endif()
+        if(NOT EXISTS ${CMAKE_BINARY_DIR}/${name}.zip)
+            # Build from sources as if there was no binary package
+            unset(BINARY_URL)
+        endif()
+    endif()
+
+    if(BINARY_URL)
 
         # Extract files
         execute_process(
@@ -234,6 +412,10 @@ function(find_extproject name)
             COMMAND ${CMAKE_COMMAND} -E tar xfz ${CMAKE_BINARY_DIR}/${name}.zip
             WORKING_DIRECTORY ${EXT_INSTALL_DIR}
         )
+        set(BINARY_ROOT ${EXT_INSTALL_DIR}/${BINARY_NAME})
+    endif()
+
+    if(BINARY_ROOT)
         # Execute find_package and send version, libraries, includes upper cmake script.
         # The CMake folder in root folder is prefered
         string(TOUPPER ${name} UPPER_NAME)
@@ -241,24 +423,24 @@ function(find_extproject name)
         if(CMAKE_CROSSCOMPILING)
             if(find_extproject_NAMES)
                 foreach(PNAME ${find_extproject_NAMES})
-                    if(EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${PNAME}/CMake)
-                        set(${name}_DIR ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${PNAME}/CMake)
+                    if(EXISTS ${BINARY_ROOT}/share/${PNAME}/CMake)
+                        set(${name}_DIR ${BINARY_ROOT}/share/${PNAME}/CMake)
                         break()
                     endif()
                 endforeach()
             else()
-                if(EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${name}/CMake)
-                    set(${name}_DIR ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${name}/CMake)
-                elseif(EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${UPPER_NAME}/CMake)
-                    set(${name}_DIR ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${UPPER_NAME}/CMake)
-                elseif(EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${LOWER_NAME}/CMake)
-                    set(${name}_DIR ${EXT_INSTALL_DIR}/${BINARY_NAME}/share/${LOWER_NAME}/CMake)
+                if(EXISTS ${BINARY_ROOT}/share/${name}/CMake)
+                    set(${name}_DIR ${BINARY_ROOT}/share/${name}/CMake)
+                elseif(EXISTS ${BINARY_ROOT}/share/${UPPER_NAME}/CMake)
+                    set(${name}_DIR ${BINARY_ROOT}/share/${UPPER_NAME}/CMake)
+                elseif(EXISTS ${BINARY_ROOT}/share/${LOWER_NAME}/CMake)
+                    set(${name}_DIR ${BINARY_ROOT}/share/${LOWER_NAME}/CMake)
                 endif()
             endif()
-        elseif(OSX_FRAMEWORK AND NOT EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/CMake AND EXISTS ${EXT_INSTALL_DIR}/${BINARY_NAME}/Library/Frameworks)
-            set(CMAKE_PREFIX_PATH ${EXT_INSTALL_DIR}/${BINARY_NAME}/Library/Frameworks)
+        elseif(OSX_FRAMEWORK AND NOT EXISTS ${BINARY_ROOT}/CMake AND EXISTS ${BINARY_ROOT}/Library/Frameworks)
+            set(CMAKE_PREFIX_PATH ${BINARY_ROOT}/Library/Frameworks)
         else()
-            set(CMAKE_PREFIX_PATH ${EXT_INSTALL_DIR}/${BINARY_NAME})
+            set(CMAKE_PREFIX_PATH ${BINARY_ROOT})
         endif()
 
         if(find_extproject_COMPONENTS)
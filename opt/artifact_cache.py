@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Shared content-addressed cache of binary packages
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+# Cache layout, also used by download_artifact() in cmake/FindExtProject.cmake:
+#   objects/<sha256[:2]>/<sha256>  archive content, mtime is the last access time
+#   urls/<sha1(url)>               sha256 of the archive downloaded from url
+#   cache.lock                     lock file (POSIX record lock as file(LOCK))
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import common
+try:
+    import urllib.request as urllib2
+except ImportError:
+    import urllib2
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+
+def default_cache_dir():
+    if 'BORSCH_ARTIFACT_CACHE' in os.environ:
+        return os.environ['BORSCH_ARTIFACT_CACHE']
+    return os.path.join(os.path.expanduser('~'), '.cache', 'borsch', 'artifacts')
+
+
+def default_max_size():
+    return os.environ.get('BORSCH_ARTIFACT_CACHE_SIZE')
+
+
+def parse_size(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class CacheLock:
+    '''Exclusive lock shared with CMake file(LOCK) and other processes'''
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, 'cache.lock')
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        if sys.platform == 'win32':
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    pass
+        else:
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if sys.platform == 'win32':
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.lockf(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class ArtifactCache:
+    '''Objects are pruned to max_size bytes after each add if it is set'''
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        for name in ('objects', 'urls', 'tmp'):
+            path = os.path.join(cache_dir, name)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+
+    def url_path(self, url):
+        return os.path.join(self.cache_dir, 'urls', hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def lookup(self, url):
+        '''Return cached object path for url and mark it as used or None'''
+        with CacheLock(self.cache_dir):
+            url_path = self.url_path(url)
+            if not os.path.exists(url_path):
+                return None
+            with open(url_path) as f:
+                object_path = self.object_path(f.read().strip())
+            if not os.path.exists(object_path):
+                return None
+            os.utime(object_path, None)
+            return object_path
+
+    def add(self, file_path, url=None):
+        '''Put file into cache, return its digest'''
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        object_path = self.object_path(digest)
+        # Copy outside of lock, the rename under lock is atomic
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, 'tmp'))
+        os.close(fd)
+        shutil.copyfile(file_path, tmp_path)
+        with CacheLock(self.cache_dir):
+            if not os.path.exists(os.path.dirname(object_path)):
+                os.makedirs(os.path.dirname(object_path))
+            if os.path.exists(object_path):
+                os.remove(tmp_path)
+                os.utime(object_path, None)
+            else:
+                os.replace(tmp_path, object_path)
+            if url is not None:
+                self.write_url(url, digest)
+        if self.max_size is not None:
+            self.prune(self.max_size, digest)
+        return digest
+
+    def write_url(self, url, digest):
+        url_path = self.url_path(url)
+        with open(url_path + '.tmp', 'w') as f:
+            f.write(digest)
+        os.replace(url_path + '.tmp', url_path)
+
+    def fetch(self, url, output=None):
+        '''Return cached path for url, download it on miss'''
+        object_path = self.lookup(url)
+        if object_path is None:
+            common.color_print('Download ' + url, False, 'LBLUE')
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.cache_dir, 'tmp'))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    response = urllib2.urlopen(url)
+                    shutil.copyfileobj(response, f, 1024 * 1024)
+                object_path = self.object_path(self.add(tmp_path, url))
+            finally:
+                os.remove(tmp_path)
+        if output is not None:
+            shutil.copyfile(object_path, output)
+        return object_path
+
+    def entries(self):
+        '''Return list of (digest, size, last access time, urls count)'''
+        urls = {}
+        urls_dir = os.path.join(self.cache_dir, 'urls')
+        for entry in os.scandir(urls_dir):
+            if entry.name.endswith('.tmp'):
+                continue
+            with open(entry.path) as f:
+                digest = f.read().strip()
+            urls[digest] = urls.get(digest, 0) + 1
+        out = []
+        objects_dir = os.path.join(self.cache_dir, 'objects')
+        for sub_dir in os.scandir(objects_dir):
+            for entry in os.scandir(sub_dir.path):
+                stat = entry.stat()
+                out.append((entry.name, stat.st_size, stat.st_mtime, urls.get(entry.name, 0)))
+        return out
+
+    def prune(self, max_size, keep=None):
+        '''Remove least recently used objects except keep until cache fits max_size'''
+        removed = []
+        with CacheLock(self.cache_dir):
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            total = sum(entry[1] for entry in entries)
+            for digest, size, _, _ in entries:
+                if total <= max_size:
+                    break
+                if digest == keep:
+                    continue
+                os.remove(self.object_path(digest))
+                removed.append(digest)
+                total -= size
+            # Drop urls pointing to removed objects
+            urls_dir = os.path.join(self.cache_dir, 'urls')
+            for entry in os.scandir(urls_dir):
+                if entry.name.endswith('.tmp'):
+                    continue
+                with open(entry.path) as f:
+                    digest = f.read().strip()
+                if not os.path.exists(self.object_path(digest)):
+                    os.remove(entry.path)
+        return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NextGIS Borsch tools. Shared binary packages cache')
+    parser.add_argument('-v', '--version', action='version', version='NextGIS Borsch artifact_cache version 1.0')
+    parser.add_argument('--cache_dir', dest='cache_dir', default=default_cache_dir(), help='cache directory, default is $BORSCH_ARTIFACT_CACHE')
+    parser.add_argument('--cache_size', dest='cache_size', default=default_max_size(), help='prune cache to this size after each added file, i.e. 20G, default is $BORSCH_ARTIFACT_CACHE_SIZE')
+
+    subparsers = parser.add_subparsers(help='command help', dest='command')
+    parser_populate = subparsers.add_parser('populate', help='download urls into cache')
+    parser_populate.add_argument('urls', nargs='+', help='binary package urls')
+    parser_populate.add_argument('--max_size', dest='max_size', default=None, help='prune cache to this size, overrides --cache_size')
+    parser_add = subparsers.add_parser('add', help='put local file into cache')
+    parser_add.add_argument('file', help='file path')
+    parser_add.add_argument('--url', dest='url', default=None, help='url the file is downloaded from')
+    parser_fetch = subparsers.add_parser('fetch', help='copy url content from cache, download on miss')
+    parser_fetch.add_argument('url', help='binary package url')
+    parser_fetch.add_argument('--output', dest='output', required=True, help='output file path')
+    subparsers.add_parser('list', help='print cache content')
+    parser_prune = subparsers.add_parser('prune', help='remove least recently used files')
+    parser_prune.add_argument('--max_size', dest='max_size', required=True, help='cache size limit, i.e. 20G')
+
+    args = parser.parse_args()
+    cache = ArtifactCache(args.cache_dir, None if args.cache_size is None else parse_size(args.cache_size))
+
+    if args.command == 'populate':
+        if args.max_size is not None:
+            cache.max_size = parse_size(args.max_size)
+        for url in args.urls:
+            common.color_print('{} -> {}'.format(url, cache.fetch(url)), False, 'LGREEN')
+    elif args.command == 'add':
+        common.color_print(cache.add(args.file, args.url), False, 'LGREEN')
+    elif args.command == 'fetch':
+        cache.fetch(args.url, args.output)
+    elif args.command == 'list':
+        total = 0
+        for digest, size, atime, urls in sorted(cache.entries(), key=lambda entry: -entry[2]):
+            total += size
+            common.log('{}  {:>12}  {}  {} url(s)'.format(digest, size, time.strftime('%Y-%m-%d %H:%M', time.localtime(atime)), urls))
+        common.color_print('Total: {} bytes'.format(total), True, 'LGREEN')
+    elif args.command == 'prune':
+        removed = cache.prune(parse_size(args.max_size))
+        common.color_print('Removed {} file(s)'.format(len(removed)), True, 'LGREEN')
+    else:
+        common.exit('Unsupported command')
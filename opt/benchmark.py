@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Benchmarks of the opt tools on synthetic trees and a mock server
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    exit('Python 3.7 or newer is required')
+import common
+import compare
+import installer
+import list_dirs
+import mappings
+import release_resolver
+import repka_release
+import tools
+
+extensions = ['cpp', 'h', 'c', 'txt', 'png', 'cmake', 'py']
+ext2keep_variants = ['*', 'cpp,h', 'c,txt,CMakeLists.txt', 'img[0-5].png,cmake', 'py,*.in']
+benchmark_names = ['list_dirs', 'organize_plan', 'organize_copy', 'compare', 'compare_cached',
+                   'install', 'install_noop', 'publish', 'resolve']
+
+
+def generate_tree(root, files, dirs, max_file_size, seed):
+    '''Create a source tree and folders.csv selecting files from every directory'''
+    rnd = random.Random(seed)
+    src = os.path.join(root, 'src')
+    dir_list = ['']
+    for i in range(dirs):
+        parent = rnd.choice(dir_list)
+        dir_list.append(os.path.join(parent, 'dir{}'.format(i)) if parent else 'dir{}'.format(i))
+    for rel_dir in dir_list:
+        os.makedirs(os.path.join(src, rel_dir), exist_ok=True)
+    for i in range(files):
+        rel_dir = rnd.choice(dir_list)
+        if i % 50 == 0:
+            name = 'CMakeLists.txt' if i % 100 == 0 else 'img{}.png'.format(i % 7)
+        else:
+            name = 'file{}.{}'.format(i, rnd.choice(extensions))
+        size = rnd.randint(0, max_file_size)
+        with open(os.path.join(src, rel_dir, name), 'wb') as f:
+            f.write(rnd.getrandbits(8 * size).to_bytes(size, 'little') if size else b'')
+    opt_dir = os.path.join(root, 'dst', 'opt')
+    os.makedirs(opt_dir, exist_ok=True)
+    with open(os.path.join(opt_dir, tools.organize_file), 'w') as f:
+        for i, rel_dir in enumerate(dir_list):
+            f.write('{},{},,"{}"\n'.format(rel_dir, os.path.join('out', rel_dir), ext2keep_variants[i % len(ext2keep_variants)]))
+    return src, os.path.join(opt_dir, tools.organize_file)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    '''Subset of repka and GitHub API used by repka_release and release_resolver'''
+    protocol_version = 'HTTP/1.1'
+    server_version = 'BorschMock/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        left = length
+        while left > 0:
+            left -= len(self.rfile.read(min(left, 1024 * 1024)))
+        return length
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlsplit(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        if url.path == '/api/packet':
+            packets = [{'id': i, 'name': name} for i, name in enumerate(state['packets'])]
+            if 'filter' in query:
+                packets = [packet for packet in packets if packet['name'] == query['filter']]
+            return self.reply(packets)
+        if url.path == '/api/release':
+            with state['lock']:
+                return self.reply([release for release in state['releases'].values() if release['packet'] == int(query['packet'])])
+        if url.path.startswith('/api/repo/'):
+            return self.reply({'files': [{'id': i, 'name': name} for i, name in enumerate(state['assets'](query['packet_name']))]})
+        match = re.match(r'^/repos/(.+)/releases$', url.path)
+        if match:
+            assets = [{'id': i, 'name': name, 'browser_download_url': 'http://mock/' + name}
+                      for i, name in enumerate(state['assets'](match.group(1)))]
+            return self.reply([{'draft': False, 'prerelease': False, 'assets': assets}])
+        self.reply({}, 404)
+
+    def do_POST(self):
+        state = self.server.state
+        if self.path == '/api/upload':
+            self.read_body()
+            with state['lock']:
+                state['uploads'] += 1
+                uid = 'upload{}'.format(state['uploads'])
+            return self.reply({'file': uid, 'name': uid + '.zip'})
+        if self.path == '/api/release':
+            data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            with state['lock']:
+                release_id = len(state['releases']) + 1
+                state['releases'][release_id] = dict(data, id=release_id)
+            return self.reply({'id': release_id})
+        self.reply({}, 404)
+
+    def do_PUT(self):
+        state = self.server.state
+        match = re.match(r'^/api/release/(\d+)$', self.path)
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        if match is None:
+            return self.reply({}, 404)
+        with state['lock']:
+            state['releases'][int(match.group(1))] = data
+        self.reply({'message': 'ok'})
+
+
+def start_server(packets, compilers):
+    def assets(name):
+        name = name.split('/')[-1]
+        out = []
+        for compiler in compilers:
+            out.extend(['{}-1.0.0-{}{}.zip'.format(name, prefix, compiler)
+                        for prefix in ('', 'static-', 'static-android-arm64-v8a-', 'static-ios-arm64-')])
+        return out
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.state = {'lock': threading.Lock(), 'packets': packets, 'releases': {}, 'uploads': 0, 'assets': assets}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_builds(root, count, size, seed):
+    '''Git repositories with a packet remote and a build dir with version.str and archive'''
+    rnd = random.Random(seed)
+    manifest = []
+    for i in range(count):
+        name = 'lib_bench{}'.format(i)
+        repo_path = os.path.join(root, name)
+        build_path = os.path.join(repo_path, 'build')
+        os.makedirs(build_path)
+        subprocess.check_call(['git', 'init', '-q', repo_path])
+        subprocess.check_call(['git', 'config', 'remote.origin.url', 'https://example.com/{}.git'.format(name)], cwd=repo_path)
+        archive = '{}-1.0.0-static-android-arm64-v8a-Clang-17.0'.format(name)
+        with open(os.path.join(build_path, 'version.str'), 'w') as f:
+            f.write('1.0.0\n{}\n{}\n'.format(int(time.time()), archive))
+        with zipfile.ZipFile(os.path.join(build_path, archive + '.zip'), 'w', zipfile.ZIP_STORED) as z:
+            z.writestr('data.bin', rnd.getrandbits(8 * size).to_bytes(size, 'little'))
+        manifest.append((repo_path, build_path))
+    return manifest
+
+
+@contextlib.contextmanager
+def quiet():
+    '''Drop the tools output'''
+    common.flush()
+    common.setup('plain', io.StringIO())
+    try:
+        yield
+    finally:
+        common.setup()
+
+
+def measure(func, repeat, prepare=None):
+    '''Return the best of repeat runs in seconds'''
+    times = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def remove(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def run_benchmarks(work_dir, config, selected, repeat):
+    results = {}
+    tree_key = hashlib.sha1(json.dumps([config['files'], config['dirs'], config['max_file_size'], config['seed']]).encode()).hexdigest()[:12]
+    tree_dir = os.path.join(work_dir, 'tree_' + tree_key)
+    if not os.path.exists(os.path.join(tree_dir, 'ready')):
+        remove(tree_dir)
+        common.color_print('Generate tree of {} files in {} directories'.format(config['files'], config['dirs']), False, 'LBLUE')
+        generate_tree(tree_dir, config['files'], config['dirs'], config['max_file_size'], config['seed'])
+        open(os.path.join(tree_dir, 'ready'), 'w').close()
+    src = os.path.join(tree_dir, 'src')
+    csv_path = os.path.join(tree_dir, 'dst', 'opt', tools.organize_file)
+    out_dir = os.path.join(tree_dir, 'dst')
+    jobs = config['jobs']
+
+    if 'list_dirs' in selected:
+        results['list_dirs'] = measure(lambda: sum(1 for _ in list_dirs.walk(src)), repeat)
+
+    plan = {}
+
+    def make_plan():
+        plan.clear()
+        for mapping in mappings.parse(csv_path):
+            tools.plan_dir(os.path.join(src, mapping.old), os.path.join(out_dir, mapping.new), mapping, plan)
+
+    if 'organize_plan' in selected:
+        results['organize_plan'] = measure(make_plan, repeat)
+    make_plan()
+
+    def clean_out():
+        remove(os.path.join(out_dir, 'out'))
+        for dest_name in plan:
+            os.makedirs(os.path.dirname(dest_name), exist_ok=True)
+
+    if 'organize_copy' in selected:
+        results['organize_copy'] = measure(lambda: tools.copy_files(plan, jobs), repeat, clean_out)
+    if not os.path.exists(os.path.join(out_dir, 'out')):
+        clean_out()
+        tools.copy_files(plan, jobs)
+
+    pairs = [(src_name, dest_name) for dest_name, (src_name, _) in plan.items()]
+    if 'compare' in selected:
+        results['compare'] = measure(lambda: compare.compare_files(pairs, jobs), repeat)
+    if 'compare_cached' in selected:
+        cache_path = os.path.join(work_dir, 'hash_cache.json')
+        compare.compare_files(pairs, jobs, compare.HashCache(cache_path))
+        results['compare_cached'] = measure(lambda: compare.compare_files(pairs, jobs, compare.HashCache(cache_path)), repeat)
+
+    packages = [(entry.name, entry.path) for entry in os.scandir(src) if entry.is_dir()]
+    install_dir = os.path.join(work_dir, 'install')
+
+    def install():
+        engine = installer.Installer(install_dir, 'copy', jobs)
+        engine.install(packages)
+        engine.close()
+
+    if 'install' in selected:
+        results['install'] = measure(install, repeat, lambda: remove(install_dir))
+    if 'install_noop' in selected:
+        if not os.path.exists(install_dir):
+            install()
+        results['install_noop'] = measure(install, repeat)
+
+    if 'publish' in selected or 'resolve' in selected:
+        names = ['lib_bench{}'.format(i) for i in range(config['packages'])]
+        server = start_server(names, ['GNU-13.2', 'Clang-17.0', 'AppleClang-15.0', 'MSVC-19.38-64bit'])
+        endpoint = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            if 'publish' in selected:
+                builds_dir = os.path.join(work_dir, 'builds')
+                remove(builds_dir)
+                manifest = create_builds(builds_dir, config['packages'], config['archive_size'], config['seed'])
+                repka_release.repka_endpoint = endpoint
+                repka_release.clients.clear()
+
+                def publish():
+                    with quiet():
+                        failed = repka_release.ReleasePublisher(None, None, jobs or 4).publish(manifest)
+                    if failed:
+                        raise RuntimeError('publish failed: {}'.format(failed[0][1]))
+                results['publish'] = measure(publish, repeat)
+            if 'resolve' in selected:
+                modules = dict((name, {'type': 'repka' if i % 2 else 'github', 'url': endpoint, 'id': '2'}) for i, name in enumerate(names))
+
+                def resolve():
+                    _, errors = release_resolver.Resolver(jobs or 8).resolve(modules)
+                    if errors:
+                        raise RuntimeError('resolve failed: {}'.format(errors))
+                results['resolve'] = measure(resolve, repeat)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def read_history(path):
+    out = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    out.append(json.loads(line))
+    return out
+
+
+def get_baseline(history, config, name, runs):
+    values = [item['results'][name] for item in history if item['config'] == config and name in item['results']][-runs:]
+    if not values:
+        return None
+    values.sort()
+    return values[len(values) // 2]
+
+
+def get_head():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NextGIS Borsch tools. Benchmark opt tools')
+    parser.add_argument('-v', '--version', action='version', version='NextGIS Borsch benchmark version 1.0')
+    parser.add_argument('--work_dir', dest='work_dir', default=os.path.join(tempfile.gettempdir(), 'borsch_benchmark'), help='directory for generated trees, kept between runs')
+    parser.add_argument('--results', dest='results', default='benchmark_results.jsonl', help='results history file')
+    parser.add_argument('--only', dest='only', default=None, help='benchmarks separated by comma: ' + ','.join(benchmark_names))
+    parser.add_argument('--files', dest='files', type=int, default=20000, help='files in the generated tree')
+    parser.add_argument('--dirs', dest='dirs', type=int, default=500, help='directories in the generated tree')
+    parser.add_argument('--max_file_size', dest='max_file_size', type=int, default=32 * 1024, help='maximum generated file size')
+    parser.add_argument('--packages', dest='packages', type=int, default=20, help='packages for release client benchmarks')
+    parser.add_argument('--archive_size', dest='archive_size', type=int, default=1024 * 1024, help='archive size for publish benchmark')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=None, help='threads passed to the tools')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='random seed of the generated data')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='runs of every benchmark, the best is taken')
+    parser.add_argument('--threshold', dest='threshold', type=float, default=0.2, help='fail if slower than baseline by this fraction')
+    parser.add_argument('--min_delta', dest='min_delta', type=float, default=0.01, help='ignore slowdowns shorter than this many seconds')
+    parser.add_argument('--baseline_runs', dest='baseline_runs', type=int, default=5, help='baseline is the median of this many previous runs with the same config')
+    parser.add_argument('--label', dest='label', default=None, help='label stored with results')
+    parser.add_argument('--no_save', dest='no_save', action='store_true', default=False, help='do not add results to history')
+    args = parser.parse_args()
+
+    selected = args.only.split(',') if args.only else benchmark_names
+    unknown = [name for name in selected if name not in benchmark_names]
+    if unknown:
+        common.exit('Unknown benchmarks: ' + ', '.join(unknown))
+    config = {'files': args.files, 'dirs': args.dirs, 'max_file_size': args.max_file_size, 'packages': args.packages,
+              'archive_size': args.archive_size, 'jobs': args.jobs, 'seed': args.seed, 'platform': sys.platform}
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    history = read_history(args.results)
+    results = run_benchmarks(args.work_dir, config, selected, args.repeat)
+
+    regressions = []
+    for name in benchmark_names:
+        if name not in results:
+            continue
+        baseline = get_baseline(history, config, name, args.baseline_runs)
+        line = '{:<16} {:>10.3f} s'.format(name, results[name])
+        color = 'LGREEN'
+        if baseline is not None:
+            change = (results[name] - baseline) / baseline if baseline > 0 else 0.0
+            line += '   baseline {:>8.3f} s  {:+.1%}'.format(baseline, change)
+            if change > args.threshold and results[name] - baseline > args.min_delta:
+                regressions.append(name)
+                color = 'LRED'
+        common.color_print(line, False, color)
+
+    if not args.no_save:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'label': args.label, 'commit': get_head(),
+                                'config': config, 'results': results}, sort_keys=True) + '\n')
+    if regressions:
+        common.exit('Regression over {:.0%} in: {}'.format(args.threshold, ', '.join(regressions)))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Timing and resource usage trace of build steps
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+# Every step is written as one JSON line as soon as it finishes and as a
+# complete ("ph": "X") event of Chrome trace format at the end, which can
+# be opened in chrome://tracing or https://ui.perfetto.dev.
+
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+lock = threading.Lock()
+local = threading.local()
+jsonl_file = None
+chrome_path = None
+events = []
+lanes = {}
+start_time = time.time()
+
+
+def enable(prefix):
+    '''Write <prefix>.jsonl and <prefix>.json (Chrome trace format)'''
+    global jsonl_file, chrome_path, start_time
+    jsonl_file = open(prefix + '.jsonl', 'a')
+    chrome_path = prefix + '.json'
+    start_time = time.time()
+    # Scripts stop with exit() on errors
+    atexit.register(close)
+
+
+def is_enabled():
+    return jsonl_file is not None
+
+
+def close():
+    global jsonl_file
+    if jsonl_file is None:
+        return
+    with lock:
+        jsonl_file.close()
+        jsonl_file = None
+        with open(chrome_path + '.tmp', 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(chrome_path + '.tmp', chrome_path)
+
+
+@contextmanager
+def task(package, **fields):
+    '''Attribute steps of the current thread to the package'''
+    previous = getattr(local, 'task', None)
+    local.task = dict(fields, package=package)
+    try:
+        yield
+    finally:
+        local.task = previous
+
+
+def step_name(args):
+    '''configure, build, install or cpack for cmake calls, program name otherwise'''
+    program = os.path.basename(args[0])
+    if program == 'cmake':
+        if '--install' in args or 'install' in args:
+            return 'install'
+        if '--build' in args:
+            return 'build'
+        return 'configure'
+    return program
+
+
+def record(name, category, start, end, fields):
+    if jsonl_file is None:
+        return
+    fields = dict(getattr(local, 'task', None) or {}, **fields)
+    event = dict(fields, name=name, category=category, start=start, wall=end - start)
+    thread_id = threading.get_ident()
+    with lock:
+        if jsonl_file is None:
+            return
+        jsonl_file.write(json.dumps(event, sort_keys=True) + '\n')
+        jsonl_file.flush()
+        # Each thread is a lane in the timeline
+        lane = lanes.setdefault(thread_id, len(lanes) + 1)
+        title = name if 'package' not in fields else '{} {}'.format(fields['package'], name)
+        events.append({'name': title, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': lane,
+                       'ts': int((start - start_time) * 1000000), 'dur': int((end - start) * 1000000),
+                       'args': fields})
+
+
+@contextmanager
+def span(name, category='step', **fields):
+    '''Trace wall time of the code block'''
+    start = time.time()
+    status = {'ok': True}
+    try:
+        yield fields
+    except BaseException:
+        status['ok'] = False
+        raise
+    finally:
+        record(name, category, start, time.time(), dict(fields, **status))
+
+
+def log_size(log):
+    if log is None:
+        return None
+    try:
+        log.flush()
+        return os.fstat(log.fileno()).st_size
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def exit_code(status):
+    '''os.waitstatus_to_exitcode() of Python 3.9+, killed processes get -signal like Popen.returncode'''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def call(args, cwd=None, stdout=None, stderr=subprocess.STDOUT, env=None, pass_fds=()):
+    '''
+    subprocess.call which traces wall and CPU time, peak RSS (KB), exit code
+    and the log growth of the child. Resource usage comes from wait4 of the
+    exact child, so parallel builds do not mix. Windows gets wall time only.
+    '''
+    if jsonl_file is None:
+        return subprocess.call(args, stdout=stdout, stderr=stderr, cwd=cwd, env=env, pass_fds=pass_fds)
+
+    log_start = log_size(stdout)
+    start = time.time()
+    p = subprocess.Popen(args, stdout=stdout, stderr=stderr, cwd=cwd, env=env, pass_fds=pass_fds)
+    fields = {'args': list(args), 'cwd': cwd}
+    if hasattr(os, 'wait4'):
+        try:
+            _, status, usage = os.wait4(p.pid, 0)
+        except BaseException:
+            p.kill()
+            p.wait()
+            raise
+        p.returncode = exit_code(status)
+        # Linux reports KB, macOS bytes
+        maxrss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+        fields.update(user=usage.ru_utime, system=usage.ru_stime, cpu=usage.ru_utime + usage.ru_stime, maxrss_kb=maxrss)
+    else:
+        p.wait()
+    end = time.time()
+    fields['exit_code'] = p.returncode
+    log_end = log_size(stdout)
+    if log_start is not None and log_end is not None:
+        fields['log_bytes'] = log_end - log_start
+    record(step_name(args), 'process', start, end, fields)
+    return p.returncode
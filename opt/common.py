@@ -1,6 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
 import sys
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 class bcolors:
     HEADER = '\033[95m'
@@ -21,32 +33,174 @@ class bcolors:
     LCYAN='\033[1;36m'
     WHITE='\033[1;37m'
 
+colors = {
+    'GREEN': bcolors.OKGREEN,
+    'LGREEN': bcolors.LGREEN,
+    'LYELLOW': bcolors.LYELLOW,
+    'LMAGENTA': bcolors.LMAGENTA,
+    'LCYAN': bcolors.LCYAN,
+    'LRED': bcolors.LRED,
+    'LBLUE': bcolors.LBLUE,
+    'DGRAY': bcolors.DGRAY,
+    'OKGRAY': bcolors.OKGRAY,
+}
+log_formats = ('auto', 'color', 'plain', 'json')
+
+logger = logging.getLogger('borsch')
+logger.propagate = False
+logger.setLevel(logging.INFO)
+local = threading.local()
+setup_lock = threading.Lock()
+listener = None
+log_queue = None
+
+
+class ColorFormatter(logging.Formatter):
+    def format(self, record):
+        text = record.getMessage()
+        if record.task:
+            text = '[{}] {}'.format(record.task, text)
+        if record.color is None:
+            return text
+        return (bcolors.BOLD if record.bold else '') + colors.get(record.color, bcolors.OKGRAY) + text + bcolors.ENDC
+
+
+class PlainFormatter(logging.Formatter):
+    def format(self, record):
+        text = record.getMessage()
+        if record.task:
+            text = '[{}] {}'.format(record.task, text)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                'level': record.levelname.lower(), 'message': record.getMessage()}
+        if record.task:
+            data['task'] = record.task
+        if record.color is not None:
+            data['color'] = record.color
+        return json.dumps(data)
+
+
+class BlockHandler(logging.StreamHandler):
+    '''Write a record or a buffered block of records with one write'''
+
+    def emit(self, record):
+        try:
+            records = getattr(record, 'block', None) or [record]
+            self.stream.write(''.join(self.format(item) + self.terminator for item in records))
+            self.flush()
+        except BrokenPipeError:
+            pass
+        except Exception:
+            self.handleError(record)
+
+
+class TaskFilter(logging.Filter):
+    '''Add task prefix of the current thread, keep buffered records back'''
+
+    def filter(self, record):
+        if not hasattr(record, 'color'):
+            record.color = None
+            record.bold = False
+        if not hasattr(record, 'task'):
+            record.task = getattr(local, 'task', None)
+        buffer = getattr(local, 'buffer', None)
+        if buffer is not None:
+            buffer.append(record)
+            return False
+        return True
+
+
+def get_formatter(log_format):
+    if log_format == 'auto':
+        log_format = os.environ.get('BORSCH_LOG_FORMAT', 'auto')
+    if log_format not in log_formats or log_format == 'auto':
+        is_tty = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
+        log_format = 'color' if is_tty and sys.platform != 'win32' else 'plain'
+    return {'color': ColorFormatter, 'plain': PlainFormatter, 'json': JsonFormatter}[log_format]()
+
+
+def setup(log_format='auto', stream=None):
+    '''
+    Output log records from a background thread, so workers do not block
+    on the terminal. Format is color for a terminal and plain text otherwise
+    unless set by the argument or BORSCH_LOG_FORMAT (color, plain, json).
+    '''
+    global listener, log_queue
+    with setup_lock:
+        if listener is not None:
+            listener.stop()
+        handler = BlockHandler(stream if stream is not None else sys.stdout)
+        handler.setFormatter(get_formatter(log_format))
+        log_queue = queue.Queue()
+        for item in list(logger.handlers):
+            logger.removeHandler(item)
+        for item in list(logger.filters):
+            logger.removeFilter(item)
+        logger.addFilter(TaskFilter())
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        listener.start()
+
+def flush():
+    '''Wait until queued records are written, i.e. before a child process writes to the same terminal'''
+    if log_queue is not None:
+        log_queue.join()
+
+def exit(code=None):
+    '''sys.exit() after the queued records, the message of code is written to stderr at once'''
+    flush()
+    sys.exit(code)
+
+def shutdown():
+    global listener
+    with setup_lock:
+        if listener is not None:
+            listener.stop()
+            listener = None
+
+atexit.register(shutdown)
+
+def emit(text, level=logging.INFO, **extra):
+    if listener is None:
+        setup()
+    logger.log(level, text, extra=extra)
+
 def color_print(text, bold, color):
-    if sys.platform == 'win32':
-        print(text)
-    else:
-        out_text = ''
-        if bold:
-            out_text += bcolors.BOLD
-        if color == 'GREEN':
-            out_text += bcolors.OKGREEN
-        elif color == 'LGREEN':
-            out_text += bcolors.LGREEN
-        elif color == 'LYELLOW':
-            out_text += bcolors.LYELLOW
-        elif color == 'LMAGENTA':
-            out_text += bcolors.LMAGENTA
-        elif color == 'LCYAN':
-            out_text += bcolors.LCYAN
-        elif color == 'LRED':
-            out_text += bcolors.LRED
-        elif color == 'LBLUE':
-            out_text += bcolors.LBLUE
-        elif color == 'DGRAY':
-            out_text += bcolors.DGRAY
-        elif color == 'OKGRAY':
-            out_text += bcolors.OKGRAY
-        else:
-            out_text += bcolors.OKGRAY
-        out_text += text + bcolors.ENDC
-        print(out_text)
\ No newline at end of file
+    emit(text, color=color, bold=bold)
+
+def log(text):
+    '''Output text without color'''
+    emit(text)
+
+@contextlib.contextmanager
+def task(name, buffered=False):
+    '''
+    Prefix records of the current thread with the task name. Buffered
+    records are written as one block at the end, so the output of
+    concurrent workers does not interleave.
+    '''
+    old_task = getattr(local, 'task', None)
+    old_buffer = getattr(local, 'buffer', None)
+    local.task = name
+    if buffered:
+        local.buffer = []
+    try:
+        yield
+    finally:
+        buffer = local.buffer if buffered else None
+        local.task = old_task
+        local.buffer = old_buffer
+        if buffer:
+            if old_buffer is not None:
+                old_buffer.extend(buffer)
+            else:
+                block = logging.LogRecord(logger.name, logging.INFO, __file__, 0, '', None, None)
+                block.block = buffer
+                block.task = None
+                block.color = None
+                block.bold = False
+                logger.handle(block)
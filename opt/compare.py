@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: In-process file comparison with optional persistent hash cache
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+block_size = 1024 * 1024
+
+
+def file_digest(path):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_file(src, dst):
+    '''Copy file content, return its digest computed on the way'''
+    h = hashlib.blake2b()
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(block_size), b''):
+            h.update(chunk)
+            fdst.write(chunk)
+    return h.hexdigest()
+
+
+def blocks_equal(path1, path2, size):
+    '''Compare content of two files of the same size block by block'''
+    if size == 0:
+        return True
+    with open(path1, 'rb') as f1, open(path2, 'rb') as f2:
+        if size <= block_size:
+            return f1.read() == f2.read()
+        with mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as m1, \
+                mmap.mmap(f2.fileno(), 0, access=mmap.ACCESS_READ) as m2:
+            for offset in range(0, size, block_size):
+                if m1[offset:offset + block_size] != m2[offset:offset + block_size]:
+                    return False
+    return True
+
+
+class HashCache:
+    '''File digests keyed by path and checked against size and mtime_ns'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.changed = False
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.data = json.load(f)
+            except ValueError:
+                self.data = {}
+
+    def digest(self, path, stat):
+        key = os.path.abspath(path)
+        with self.lock:
+            item = self.data.get(key)
+        if item is not None and item[0] == stat.st_size and item[1] == stat.st_mtime_ns:
+            return item[2]
+        digest = file_digest(path)
+        with self.lock:
+            self.data[key] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.changed = True
+        return digest
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+def files_equal(path1, path2, cache=None):
+    '''
+    Size mismatch means different files, equal size and mtime means equal.
+    Otherwise compare cached digests or the content itself.
+    '''
+    try:
+        stat1 = os.stat(path1)
+        stat2 = os.stat(path2)
+    except OSError:
+        return False
+    if stat1.st_size != stat2.st_size:
+        return False
+    if stat1.st_mtime_ns == stat2.st_mtime_ns:
+        return True
+    if cache is not None:
+        return cache.digest(path1, stat1) == cache.digest(path2, stat2)
+    return blocks_equal(path1, path2, stat1.st_size)
+
+
+def compare_files(pairs, jobs=None, cache=None):
+    '''Return list of (path1, path2) pairs with different content'''
+    def is_different(pair):
+        return not files_equal(pair[0], pair[1], cache)
+
+    pairs = list(pairs)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        different = list(executor.map(is_different, pairs))
+    if cache is not None:
+        cache.save()
+    return [pair for pair, is_diff in zip(pairs, different) if is_diff]
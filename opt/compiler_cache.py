@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Compiler cache (ccache, sccache) launcher and statistics
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import zlib
+import common
+
+cache_tools = ('ccache', 'sccache')
+default_max_size = '20G'
+languages = ('C', 'CXX')
+stats_log_name = 'ccache-stats.log'
+
+
+def default_cache_dir():
+    path = os.environ.get('BORSCH_COMPILER_CACHE')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.cache', 'borsch', 'compiler')
+
+
+def find_tool(name='off'):
+    '''Return path of the cache executable, None if disabled or not found in auto mode'''
+    if name in (None, '', 'off', 'none'):
+        return None
+    if name == 'auto':
+        for tool in cache_tools:
+            path = shutil.which(tool)
+            if path is not None:
+                return path
+        return None
+    path = shutil.which(name)
+    if path is None:
+        raise ValueError('Compiler cache {} not found'.format(name))
+    return path
+
+
+def launcher_args(cache):
+    '''CMake arguments setting the launcher, empty values reset one left in a reused build dir'''
+    path = cache.tool if cache is not None else ''
+    return ['-DCMAKE_{}_COMPILER_LAUNCHER={}'.format(language, path) for language in languages]
+
+
+def parse_stats_log(path):
+    '''Return (hits, misses, uncacheable) counted in a CCACHE_STATSLOG file'''
+    hits = misses = other = 0
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.endswith('cache_hit'):
+                    hits += 1
+                elif line == 'cache_miss':
+                    misses += 1
+                else:
+                    other += 1
+    except (IOError, OSError):
+        pass
+    return hits, misses, other
+
+
+class CompilerCache:
+    '''
+    Compiler launcher with a cache directory per key (platform or Android ABI),
+    so builds for different targets do not evict each other. Size limit is
+    applied to every key directory. Hits and misses are collected per package.
+    '''
+
+    def __init__(self, tool, cache_dir=None, max_size=default_max_size, base_dir=None):
+        self.tool = tool
+        self.kind = 'sccache' if 'sccache' in os.path.basename(tool).lower() else 'ccache'
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size
+        self.base_dir = base_dir
+        self.lock = threading.Lock()
+        self.stats = []
+
+    def get_dir(self, key):
+        return os.path.join(self.cache_dir, self.kind, key)
+
+    def environ(self, key, build_dir):
+        env = dict(os.environ)
+        cache_dir = self.get_dir(key)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        if self.kind == 'ccache':
+            env['CCACHE_DIR'] = cache_dir
+            env['CCACHE_MAXSIZE'] = self.max_size
+            env['CCACHE_STATSLOG'] = os.path.join(build_dir, stats_log_name)
+            if self.base_dir is not None:
+                # Hit across build dirs of different names
+                env['CCACHE_BASEDIR'] = self.base_dir
+                env['CCACHE_NOHASHDIR'] = '1'
+        else:
+            # sccache server reads the settings at start, one server per key
+            env['SCCACHE_DIR'] = cache_dir
+            env['SCCACHE_CACHE_SIZE'] = self.max_size
+            env['SCCACHE_SERVER_PORT'] = str(4227 + zlib.crc32(key.encode()) % 1000)
+        return env
+
+    def sccache_counters(self, env):
+        try:
+            output = subprocess.check_output([self.tool, '--show-stats', '--stats-format=json'], env=env, stderr=subprocess.DEVNULL)
+            stats = json.loads(output.decode()).get('stats', {})
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            return None
+        def count(name):
+            value = stats.get(name, 0)
+            return sum(value.get('counts', {}).values()) if isinstance(value, dict) else value
+        return count('cache_hits'), count('cache_misses'), count('requests_not_compile') + count('requests_not_cacheable')
+
+    def begin(self, key, build_dir):
+        '''Return (environment, state) for the build of one package'''
+        env = self.environ(key, build_dir)
+        if self.kind == 'ccache':
+            stats_log = env['CCACHE_STATSLOG']
+            if os.path.exists(stats_log):
+                os.remove(stats_log)
+            return env, None
+        return env, self.sccache_counters(env)
+
+    def end(self, name, key, env, state):
+        if self.kind == 'ccache':
+            counters = parse_stats_log(env['CCACHE_STATSLOG'])
+        else:
+            # Server totals, packages built at the same time for one key are mixed
+            after = self.sccache_counters(env)
+            if after is None or state is None:
+                return
+            counters = tuple(a - b for a, b in zip(after, state))
+        with self.lock:
+            self.stats.append((name, key) + counters)
+
+    def report(self):
+        if not self.stats:
+            return
+        common.color_print('Compiler cache ({}) statistics:'.format(self.kind), True, 'LCYAN')
+        common.log('{:<24} {:<16} {:>8} {:>8} {:>8} {:>7}'.format('package', 'key', 'hits', 'misses', 'other', 'rate'))
+        # Packages built several times in one run are summed
+        rows = {}
+        for item in self.stats:
+            rows[item[:2]] = [a + b for a, b in zip(rows.get(item[:2], [0, 0, 0]), item[2:])]
+        total_hits = total_misses = 0
+        for (name, key), (hits, misses, other) in sorted(rows.items()):
+            total_hits += hits
+            total_misses += misses
+            rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+            common.log('{:<24} {:<16} {:>8} {:>8} {:>8} {:>6.1f}%'.format(name, key, hits, misses, other, rate))
+        total = total_hits + total_misses
+        common.color_print('Total: {} hits, {} misses, {:.1f}% hit rate'.format(
+            total_hits, total_misses, 100.0 * total_hits / total if total else 0.0), True, 'LCYAN')
+
+
+def create(name='off', cache_dir=None, max_size=default_max_size, base_dir=None):
+    '''Return CompilerCache or None if disabled or nothing is found in auto mode'''
+    tool = find_tool(name)
+    if tool is None:
+        return None
+    cache = CompilerCache(tool, cache_dir, max_size, base_dir)
+    common.color_print('Compile through {}, cache in {}'.format(tool, cache.cache_dir), False, 'LCYAN')
+    return cache
+
+
+def add_arguments(parser):
+    parser.add_argument('--compiler_cache', dest='compiler_cache', default='off', help='compiler launcher: off (default), auto (ccache or sccache if found), ccache, sccache or executable path')
+    parser.add_argument('--compiler_cache_dir', dest='compiler_cache_dir', default=None, help='cache root, default $BORSCH_COMPILER_CACHE or ~/.cache/borsch/compiler')
+    parser.add_argument('--compiler_cache_size', dest='compiler_cache_size', default=default_max_size, help='size limit of every platform or ABI cache directory, i.e. 10G')
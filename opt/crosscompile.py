@@ -12,87 +12,296 @@
 ################################################################################
 
 import argparse
+import atexit
+import build_trace
+import common
+import compiler_cache
+import fingerprint
+import jobserver
+import json
+import multiprocessing
 import os
-import time
+import registry
 import repka_release
 import shutil
-import subprocess
+import threading
+import workspace
+from concurrent.futures import ThreadPoolExecutor
 
 ndk_path = '/android-ndk'
+# Set from command line, None builds without compiler cache
+cache = None
+# Set from --jobs, shared by all builds of the run
+job_server = None
+# Set from --clean, build directories are created again
+clean = False
+# Set from --stage_dir, finished packages are installed into <stage_dir>/<abi>/<name>
+stage_dir = None
+# Set in main, {abi: {name: fingerprint}} of all packages, staged ones must match
+fingerprints = {}
+# Set in main, {abi: {name: {dependency: fingerprint}}} the packages are built with
+built_deps = {}
+stage_mark = '.borsch-stage'
 abis = ['x86_64', 'x86', 'arm64-v8a', 'armeabi-v7a']
 base_opts = ['-DANDROID_TOOLCHAIN=clang', '-DANDROID_STL=c++_static', '-DANDROID_CPP_FEATURES=rtti', '-G', 'Unix Makefiles', '-DCMAKE_MAKE_PROGRAM=make', '-DBUILD_SHARED_LIBS=OFF', '-DBUILD_STATIC_LIBS=ON', '-DBUILD_TARGET_PLATFORM=ANDROID', '-DSUPPRESS_VERBOSE_OUTPUT=ON', '-DCMAKE_BUILD_TYPE=Release', '-DSKIP_DEFAULTS=ON', '-DCMAKE_TOOLCHAIN_FILE=' + ndk_path + '/build/cmake/android.toolchain.cmake', '-DANDROID_NDK=' + ndk_path]
-repositories = [
-    {"name": "lib_z", "args" : []},
-    {"name": "lib_sqlite", "args" : ['-DBUILD_APP=OFF']},
-    {"name": "lib_iconv", "args" : []},
-    {"name": "lib_jsonc", "args" : []},
-    {"name": "lib_jbig", "args" : []},
-    {"name": "lib_expat", "args" : ['-DBUILD_tools=OFF', '-DBUILD_examples=OFF', '-DBUILD_tests=OFF', '-DBUILD_doc=OFF']},
-    {"name": "lib_geos", "args" : ['-DBUILD_TESTING=OFF', '-DGEOS_ENABLE_INLINE=OFF',]},
-    {"name": "lib_openssl", "args" : ['-DOPENSSL_NO_AFALGENG=ON', '-DOPENSSL_NO_ASM=ON', '-DOPENSSL_NO_DYNAMIC_ENGINE=ON', '-DOPENSSL_NO_STATIC_ENGINE=OFF', '-DOPENSSL_NO_DEPRECATED=ON', '-DOPENSSL_NO_UNIT_TEST=ON']},
-    {"name": "lib_lzma", "args" : ['-DBUILD_APPS=OFF', '-DWITH_ICONV=ON', '-DWITH_ICONV_EXTERNAL=ON']},
-    {"name": "lib_jpeg", "args" : ['-DBUILD_APP=OFF']},
-    {"name": "lib_curl", "args" : ['-DWITH_OpenSSL_EXTERNAL=ON', '-DBUILD_CURL_EXE=OFF', '-DHTTP_ONLY=ON', '-DENABLE_MANUAL=OFF','-DWITH_ZLIB=ON','-DWITH_ZLIB_EXTERNAL=ON', '-DCMAKE_USE_LIBSSH2=OFF', '-DCMAKE_USE_GSSAPI=OFF']},
-    {"name": "lib_xml2", "args" : ['-DWITH_ZLIB=ON','-DWITH_ZLIB_EXTERNAL=ON', '-DWITH_LibLZMA=ON', '-DWITH_LibLZMA_EXTERNAL=ON', '-DWITH_ICONV=ON', '-DWITH_ICONV_EXTERNAL=ON', '-DLIBXML2_WITH_TESTS=OFF']},
-    {"name": "lib_png", "args" : ['-DWITH_ZLIB=ON','-DWITH_ZLIB_EXTERNAL=ON']},
-    {"name": "lib_tiff", "args" : ['-DWITH_ZLIB=ON','-DWITH_ZLIB_EXTERNAL=ON', '-DWITH_JPEG_EXTERNAL=ON', '-DWITH_JBIG_EXTERNAL=ON', '-DWITH_LibLZMA_EXTERNAL=ON', '-DWITH_JPEG=ON', '-DWITH_JBIG=ON', '-DWITH_LibLZMA=ON', '-DBUILD_TOOLS=ON', '-DSKIP_BUILD_DOCS=ON', '-DBUILD_TESTING=OFF']},
-    {"name": "lib_proj", "args" : ['-DBUILD_CCT=OFF', '-DBUILD_CS2CS=OFF', '-DBUILD_GEOD=OFF', '-DBUILD_GIE=OFF', '-DBUILD_PROJ=OFF', '-DBUILD_PROJINFO=OFF', '-DBUILD_PROJSYNC=OFF','-DWITH_SQLite3=ON', '-DWITH_SQLite3_EXTERNAL=ON', '-DBUILD_TESTING=OFF', '-DGENERATE_PROJ_DB=OFF', '-DWITH_TIFF=ON', '-DWITH_TIFF_EXTERNAL=ON', '-DWITH_CURL=ON', '-DWITH_CURL_EXTERNAL=ON', ]},
-    {"name": "lib_geotiff", "args" : ['-DWITH_JPEG=ON', '-DWITH_JPEG_EXTERNAL=ON', '-DWITH_PROJ=ON', '-DWITH_PROJ_EXTERNAL=ON', '-DWITH_ZLIB=ON','-DWITH_ZLIB_EXTERNAL=ON', '-DWITH_TIFF=ON', '-DWITH_TIFF_EXTERNAL=ON', '-DWITH_UTILITIES=OFF']},
-    {"name": "lib_gdal", "args" : ['-DWITH_EXPAT=ON', '-DWITH_EXPAT_EXTERNAL=ON', '-DWITH_GeoTIFF=ON', '-DWITH_GeoTIFF_EXTERNAL=ON', '-DWITH_GEOS=ON', '-DWITH_GEOS_EXTERNAL=ON', '-DWITH_CURL=ON', '-DWITH_CURL_EXTERNAL=ON', '-DWITH_ICONV=ON', '-DWITH_ICONV_EXTERNAL=ON', '-DWITH_JBIG=ON', '-DWITH_JBIG_EXTERNAL=ON', '-DWITH_JPEG=ON', '-DWITH_JPEG_EXTERNAL=ON', '-DWITH_JPEG12=ON', '-DWITH_JPEG12_EXTERNAL=ON', '-DWITH_JSONC=ON', '-DWITH_JSONC_EXTERNAL=ON', '-DWITH_LibLZMA=ON', '-DWITH_LibLZMA_EXTERNAL=ON', '-DWITH_LibXml2=ON', '-DWITH_LibXml2_EXTERNAL=ON', '-DWITH_OpenSSL=ON', '-DWITH_OpenSSL_EXTERNAL=ON', '-DWITH_PNG=ON', '-DWITH_PNG_EXTERNAL=ON', '-DWITH_PROJ=ON', '-DWITH_PROJ_EXTERNAL=ON', '-DWITH_SQLite3=ON', '-DWITH_SQLite3_EXTERNAL=ON', '-DWITH_TIFF=ON', '-DWITH_TIFF_EXTERNAL=ON', '-DWITH_ZLIB=ON', '-DENABLE_MRF=OFF', '-DENABLE_PLSCENES=OFF', '-DENABLE_AAIGRID_GRASSASCIIGRID=OFF', '-DENABLE_ADRG_SRP=OFF', '-DENABLE_AIG=OFF', '-DENABLE_AIRSAR=OFF', '-DENABLE_ARG=OFF', '-DENABLE_BLX=OFF', '-DENABLE_BMP=OFF', '-DENABLE_BSB=OFF', '-DENABLE_CALS=OFF', '-DENABLE_CEOS=OFF', '-DENABLE_CEOS2=OFF', '-DENABLE_COASP=OFF', '-DENABLE_COSAR=OFF', '-DENABLE_CTG=OFF', '-DENABLE_DIMAP=OFF', '-DENABLE_DTED=OFF', '-DENABLE_E00GRID=OFF', '-DENABLE_EEDA=OFF', '-DENABLE_ELAS=OFF', '-DENABLE_ENVISAT=OFF', '-DENABLE_ERS=OFF', '-DENABLE_FIT=OFF', '-DENABLE_GFF=OFF', '-DENABLE_GIF=OFF', '-DENABLE_GRIB=OFF', '-DENABLE_GSAG_GSBG_GS7BG=OFF', '-DENABLE_GXF=OFF', '-DENABLE_HF2=OFF', '-DENABLE_IDRISI_RASTER=OFF', '-DENABLE_IGNFHeightASCIIGrid=OFF', '-DENABLE_ILWIS=OFF', '-DENABLE_INGR=OFF', '-DENABLE_IRIS=OFF', '-DENABLE_JAXAPALSAR=OFF', '-DENABLE_JDEM=OFF', '-DENABLE_KMLSUPEROVERLAY=OFF', '-DENABLE_L1B=OFF', '-DENABLE_LEVELLER=OFF', '-DENABLE_MAP=OFF', '-DENABLE_MBTILES=OFF', '-DENABLE_MSGN=OFF', '-DENABLE_NGSGEOID=OFF', '-DENABLE_NITF_RPFTOC_ECRGTOC=OFF', '-DENABLE_NWT=OFF', '-DENABLE_OZI=OFF', '-DENABLE_PCIDSK=OFF', '-DENABLE_PDS_ISIS2_ISIS3_VICAR=OFF', '-DENABLE_PLMOSAIC=OFF', '-DENABLE_POSTGISRASTER=OFF', '-DENABLE_PRF=OFF', '-DENABLE_R=OFF', '-DENABLE_RASTERLITE=OFF', '-DENABLE_RIK=OFF', '-DENABLE_RMF=OFF', '-DENABLE_RDA=OFF', '-DENABLE_RS2=OFF', '-DENABLE_SAFE=OFF', '-DENABLE_SAGA=OFF', '-DENABLE_SENTINEL2=OFF', '-DENABLE_SIGDEM=OFF', '-DENABLE_SDTS_RASTER=OFF', '-DENABLE_SGI=OFF', '-DENABLE_SRTMHGT=OFF', '-DENABLE_TERRAGEN=OFF', '-DENABLE_TIL=OFF', '-DENABLE_TSX=OFF', '-DENABLE_USGSDEM=OFF', '-DENABLE_WCS=OFF', '-DENABLE_WMTS=OFF', '-DENABLE_XPM=OFF', '-DENABLE_XYZ=OFF', '-DENABLE_ZMAP=OFF', '-DENABLE_AERONAVFAA=OFF', '-DENABLE_ARCGEN=OFF', '-DENABLE_AVC=OFF', '-DENABLE_BNA=OFF', '-DENABLE_CARTO=OFF', '-DENABLE_CLOUDANT=OFF', '-DENABLE_COUCHDB=OFF', '-DENABLE_CSV=OFF', '-DENABLE_CSW=OFF', '-DENABLE_DGN=OFF', '-DENABLE_DXF=OFF', '-DENABLE_EDIGEO=OFF', '-DENABLE_ELASTIC=OFF', '-DENABLE_GEOCONCEPT=OFF', '-DENABLE_GEORSS=OFF', '-DENABLE_GFT=OFF', '-DENABLE_GML=ON', '-DENABLE_GMT=OFF', '-DENABLE_GPSBABEL=OFF', '-DENABLE_GTM=OFF', '-DENABLE_HTF=OFF', '-DENABLE_IDRISI_VECTOR=OFF', '-DENABLE_JML=OFF', '-DENABLE_NTF=OFF', '-DENABLE_ODS=OFF', '-DENABLE_OPENAIR=OFF', '-DENABLE_OPENFILEGDB=OFF', '-DENABLE_OSM=OFF', '-DENABLE_PDS_VECTOR=OFF', '-DENABLE_PG=OFF', '-DENABLE_PGDUMP=OFF', '-DENABLE_REC=OFF', '-DENABLE_S57=OFF', '-DENABLE_SDTS_VECTOR=OFF', '-DENABLE_SEGUKOOA=OFF', '-DENABLE_SEGY=OFF', '-DENABLE_SELAFIN=OFF', '-DENABLE_SUA=OFF', '-DENABLE_SVG=OFF', '-DENABLE_SXF=OFF', '-DENABLE_TIGER=OFF', '-DENABLE_VDV=OFF', '-DENABLE_VFK=OFF', '-DENABLE_WASP=OFF', '-DENABLE_WFS=OFF', '-DENABLE_XLSX=OFF', '-DENABLE_CAD=OFF', '-DGDAL_BUILD_APPS=OFF', '-DGDAL_BUILD_DOCS=OFF', '-DENABLE_NULL=OFF', '-DENABLE_NGW=ON', '-DENABLE_GNMFILE=OFF', '-DENABLE_ECW=OFF', '-DENABLE_GEORASTER=OFF', '-DENABLE_HDF4=OFF', '-DENABLE_MRSID=OFF', '-DENABLE_OPENJPEG=OFF', '-DENABLE_WEBP=OFF', '-DENABLE_LIBKML=OFF', '-DENABLE_MVT=OFF', '-DENABLE_OCI=OFF', '-DENABLE_RAW=OFF','-DWITH_ZLIB_EXTERNAL=ON']},
-]
-
-def get_packages(package_list):
-    out = []
-    if package_list is not None:
-        packagesList = package_list.split(';')
-        for package in packagesList:
-            for repo in repositories:
-                if repo['name'] == package:
-                    out.append(repo)
-                    break
-    else:
-        out.extend(repositories)
-
-    return out
 
-def run(args):
-    print('calling ' + ' '.join(args))
+def run(args, cwd=None, log=None, env=None, pass_fds=()):
+    common.log('calling ' + ' '.join(args))
+    if log is None:
+        common.flush()
     try:
-        output_code = subprocess.call(args, stderr=subprocess.STDOUT)
+        output_code = build_trace.call(args, cwd=cwd, stdout=log, env=env, pass_fds=pass_fds)
         return output_code == 0
-    except subprocess.CalledProcessError(e):
+    except OSError:
         return False
-    
-def make_package(repo, root_dir, abi, login, password):
-    print('Process {} [{}]...'.format(repo['name'], abi))
-    # Create build dir
-    repo_dir = os.path.join(root_dir, repo['name'] + '_code')
-    build_dir = os.path.join(repo_dir, 'build_' + repo['name'] + '_' + str(int(time.time())))
-    os.mkdir(build_dir)
-    os.chdir(build_dir)
 
-    # Configure
+def build_package(repo, root_dir, abi, use_log=False):
+    with common.task('{} [{}]'.format(repo['name'], abi)), build_trace.task(repo['name'], abi=abi), jobserver.hold(job_server):
+        return build_package_traced(repo, root_dir, abi, use_log)
+
+def build_package_traced(repo, root_dir, abi, use_log):
+    common.log('Process {} [{}]...'.format(repo['name'], abi))
+    repo_dir = os.path.join(root_dir, repo['name'] + '_code')
     run_args = ['cmake']
     run_args.extend(base_opts)
     run_args.append('-DANDROID_ABI=' + abi)
-    run_args.extend(repo['args'])
+    run_args.extend(compiler_cache.launcher_args(cache))
+    run_args.extend(repo['android_args'])
+    if stage_dir is not None:
+        run_args.append('-DBORSCH_STAGING_PREFIX=' + os.path.join(stage_dir, abi))
     run_args.append(repo_dir)
-    if run((run_args)) == False:
-        exit('Failed to configure')
+    # Build dir is kept between runs and locked until the upload
+    build_dir, reconfigure = workspace.acquire(repo_dir, abi, base_opts, run_args, clean)
+    for file_name in os.listdir(build_dir):
+        if file_name.endswith('.zip'):
+            os.remove(os.path.join(build_dir, file_name))
+
+    log = None
+    if use_log:
+        log = open(os.path.join(build_dir, 'make.log'), 'w')
+    cache_key = 'android-' + abi
+    env, cache_state = cache.begin(cache_key, build_dir) if cache is not None else (None, None)
+    result = None
+    try:
+        # Configure
+        if not reconfigure:
+            common.log('Workspace {} is configured'.format(build_dir))
+        elif run(run_args, build_dir, log, env) == False:
+            common.color_print('Failed to configure {} [{}]'.format(repo['name'], abi), False, 'LRED')
+            return None
+        else:
+            workspace.configured(build_dir, run_args)
+
+        # Make, make reads the number of jobs from the jobserver in MAKEFLAGS
+        make_env = job_server.environ(env) if job_server is not None else env
+        pass_fds = job_server.pass_fds if job_server is not None else ()
+        if run(('cmake', '--build', '.', '--config', 'Release'), build_dir, log, make_env, pass_fds) == False:
+            common.color_print('Failed to make {} [{}]'.format(repo['name'], abi), False, 'LRED')
+            return None
 
-    # Make
-    if run(('cmake', '--build', '.', '--config', 'Release', '--', '-j8')) == False:
-        exit('Failed to make')
+        # Stage for the next packages of the run
+        if stage_dir is not None and not stage_package(repo, abi, build_dir, log, env):
+            common.color_print('Failed to stage {} [{}]'.format(repo['name'], abi), False, 'LRED')
+            return None
 
-    # Pack
-    if run(('cpack')) == False:
-        exit('Failed to pack')
+        # Pack
+        if run(('cpack',), build_dir, log, env) == False:
+            common.color_print('Failed to pack {} [{}]'.format(repo['name'], abi), False, 'LRED')
+            return None
+        result = build_dir
+    finally:
+        if log is not None:
+            log.close()
+        if cache is not None:
+            cache.end(repo['name'], cache_key, env, cache_state)
+        if result is None:
+            workspace.release(build_dir)
+
+    return result
+
+def get_stage_prefix(name, abi):
+    return os.path.join(stage_dir, abi, name)
+
+def stage_package(repo, abi, build_dir, log, env):
+    prefix = get_stage_prefix(repo['name'], abi)
+    # Install aside and swap, so a failed install does not leave a half staged package
+    if os.path.exists(prefix + '.tmp'):
+        shutil.rmtree(prefix + '.tmp')
+    os.makedirs(prefix + '.tmp')
+    if run(('cmake', '--install', '.', '--prefix', prefix + '.tmp'), build_dir, log, env) == False:
+        return False
+    with open(os.path.join(prefix + '.tmp', stage_mark), 'w') as f:
+        f.write(fingerprints.get(abi, {}).get(repo['name']) or '')
+    if os.path.exists(prefix):
+        shutil.rmtree(prefix)
+    os.rename(prefix + '.tmp', prefix)
+    return True
+
+def get_staged_fingerprint(name, abi):
+    try:
+        with open(os.path.join(get_stage_prefix(name, abi), stage_mark)) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+def is_staged(name, abi_list):
+    '''True if the package is staged from the sources and arguments of this run'''
+    if stage_dir is None:
+        return False
+    for abi in abi_list:
+        current = fingerprints.get(abi, {}).get(name)
+        if current in (None, fingerprint.external) or get_staged_fingerprint(name, abi) != current:
+            return False
+    return True
+
+def remove_stale_stages():
+    '''
+    Staged packages of earlier runs are used by find_extproject() only while
+    their fingerprint is actual, other ones are downloaded from repka again
+    '''
+    for abi in abis:
+        abi_dir = os.path.join(stage_dir, abi)
+        if not os.path.isdir(abi_dir):
+            continue
+        for name in sorted(os.listdir(abi_dir)):
+            if name.endswith('.tmp') or not is_staged(name, [abi]):
+                common.log('Remove stale staged {} [{}]'.format(name, abi))
+                shutil.rmtree(os.path.join(abi_dir, name), ignore_errors=True)
+
+def publish_package(repo, root_dir, build_dir, login, password):
+    repo_dir = os.path.join(root_dir, repo['name'] + '_code')
 
     # Send to repka
-    repka_release.do_work(repo_dir, build_dir, login, password)
+    with build_trace.span('upload', 'upload', package=repo['name'], builds=1):
+        repka_release.do_work(repo_dir, build_dir, login, password)
+    workspace.release(build_dir)
+
+def make_package(repo, root_dir, abi, login, password):
+    build_dir = build_package(repo, root_dir, abi)
+    if build_dir is None:
+        common.exit('Failed to build')
+    publish_package(repo, root_dir, build_dir, login, password)
 
-    # Delete dir
-    shutil.rmtree(build_dir)
+def build_package_abis(repo, root_dir, abi_list=abis):
+    '''Build all ABIs of one package at once, return build directories or None if any ABI failed'''
+    # Jobs are taken from the shared jobserver
+    with ThreadPoolExecutor(max_workers=len(abi_list)) as executor:
+        build_dirs = list(executor.map(lambda abi: build_package(repo, root_dir, abi, True), abi_list))
+
+    failed = [abi for abi, build_dir in zip(abi_list, build_dirs) if build_dir is None]
+    if failed:
+        for build_dir in build_dirs:
+            if build_dir is not None:
+                workspace.release(build_dir)
+        common.color_print('Failed to build {} [{}]'.format(repo['name'], ', '.join(failed)), False, 'LRED')
+        return None
+    return build_dirs
+
+def make_package_abis(repo, root_dir, login, password, abi_list=abis):
+    build_dirs = build_package_abis(repo, root_dir, abi_list)
+    if build_dirs is None:
+        common.exit('Failed to build')
+
+    # Upload all ABIs at once, the release is updated one time
+    repo_dir = os.path.join(root_dir, repo['name'] + '_code')
+    publisher = repka_release.ReleasePublisher(login, password, len(build_dirs))
+    with build_trace.span('upload', 'upload', package=repo['name'], builds=len(build_dirs)) as fields:
+        failed = publisher.publish([(repo_dir, build_dir) for build_dir in build_dirs])
+        fields['failed'] = len(failed)
+    for build_dir in build_dirs:
+        workspace.release(build_dir)
+    if failed:
+        common.exit('Failed to publish {}'.format(repo['name']))
+
+def get_packages_size(build_dir):
+    '''Size of the cpack archives waiting for upload'''
+    size = 0
+    for file_name in os.listdir(build_dir):
+        if file_name.endswith('.zip'):
+            size += os.path.getsize(os.path.join(build_dir, file_name))
+    return size
+
+class UploadPipeline:
+    '''
+    Publish finished builds in background while the next packages are built.
+    Packages waiting for upload are limited by total size. Failed uploads
+    are collected, every build directory is released after its upload.
+    '''
+
+    def __init__(self, login, password, jobs, max_pending_size):
+        # Every worker uploads one file at a time, so at most jobs uploads run
+        self.publisher = repka_release.ReleasePublisher(login, password, 1)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+        self.max_pending_size = max_pending_size
+        self.condition = threading.Condition()
+        self.pending_size = 0
+        self.pending = {}
+        self.failed = []
+
+    def submit(self, name, repo_dir, build_dirs, on_published=None):
+        size = sum(get_packages_size(build_dir) for build_dir in build_dirs)
+        with self.condition:
+            self.pending_size += size
+            self.pending[name] = self.pending.get(name, 0) + 1
+        self.executor.submit(self.publish, name, repo_dir, build_dirs, size, on_published)
+
+    def publish(self, name, repo_dir, build_dirs, size, on_published):
+        with build_trace.span('upload', 'upload', package=name, builds=len(build_dirs), bytes=size) as fields:
+            try:
+                failed = self.publisher.publish([(repo_dir, build_dir) for build_dir in build_dirs])
+            except Exception as e:
+                failed = [((repo_dir, build_dir), str(e)) for build_dir in build_dirs]
+            fields['failed'] = len(failed)
+        failed_dirs = set(build_dir for (_, build_dir), _ in failed)
+        published = [build_dir for build_dir in build_dirs if build_dir not in failed_dirs]
+        for build_dir in build_dirs:
+            workspace.release(build_dir)
+        if on_published is not None and published:
+            on_published(published)
+        with self.condition:
+            self.pending_size -= size
+            self.pending[name] -= 1
+            if self.pending[name] == 0:
+                del self.pending[name]
+            self.failed.extend(failed)
+            self.condition.notify_all()
+
+    def wait_for_space(self):
+        with self.condition:
+            while self.pending and self.pending_size > self.max_pending_size:
+                common.log('Wait for uploads, {} MB pending'.format(self.pending_size // (1024 * 1024)))
+                self.condition.wait()
+
+    def wait_for(self, names):
+        '''Dependencies must be published before they are downloaded by the next build'''
+        with self.condition:
+            while any(name in self.pending for name in names):
+                self.condition.wait()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        return self.failed
+
+def get_repo_dir(root_dir, name):
+    return os.path.join(root_dir, name + '_code')
+
+def get_fingerprints(package_registry, packages, root_dir, store):
+    '''Fingerprints of all android packages of the registry by ABI, fills built_deps'''
+    names = [repo['name'] for repo in package_registry.get_packages('android')]
+    deps = package_registry.dependencies('android')[0]
+    selected = set(repo['name'] for repo in packages)
+    states = {}
+    out = {}
+    for abi in abis:
+        built_deps[abi] = {}
+        out[abi] = fingerprint.get_fingerprints(names, deps,
+            lambda name: get_repo_dir(root_dir, name),
+            lambda name: base_opts + ['-DANDROID_ABI=' + abi] + package_registry.get(name)['android_args'],
+            lambda name: store.get(name + ':' + abi), states, selected, built_deps[abi])
+    return out
+
+def set_built(store, name, abi):
+    store.set(name + ':' + abi, fingerprints[abi][name], built_deps[abi][name])
 
 
 if __name__ == "__main__":
@@ -101,11 +310,120 @@ if __name__ == "__main__":
     parser.add_argument('--login', dest='login', help='repka login')
     parser.add_argument('--password', dest='password', help='repka password')
     parser.add_argument('--packages', dest='packages', help='packages list separated by semicolon')
+    parser.add_argument('--with-deps', dest='with_deps', action='store_true', default=False, help='add packages the --packages ones depend on')
+    parser.add_argument('--with-dependents', dest='with_dependents', action='store_true', default=False, help='add packages which depend on the --packages ones')
+    parser.add_argument('--parallel_abis', dest='parallel_abis', action='store_true', default=False, help='build all ABIs of a package at the same time')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(), help='total build jobs budget shared by all builds through the jobserver')
+    parser.add_argument('--jobserver', dest='jobserver', choices=jobserver.styles, default='auto', help='jobserver type: fifo (make 4.4+, ninja 1.13+), pipe (older make) or auto')
+    parser.add_argument('--force', dest='force', action='store_true', default=False, help='rebuild packages even if sources and arguments did not change')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False, help='upload finished packages in background while building the next ones')
+    parser.add_argument('--upload_jobs', dest='upload_jobs', type=int, default=2, help='number of concurrent uploads in pipeline mode')
+    compiler_cache.add_arguments(parser)
+    workspace.add_arguments(parser)
+    parser.add_argument('--stage_dir', dest='stage_dir', default='stage', help='install finished packages into <stage_dir>/<abi>/<name>, the next packages use them instead of downloading from repka')
+    parser.add_argument('--no_stage', dest='no_stage', action='store_true', default=False, help='download dependencies from repka even if they were built in this run')
+    parser.add_argument('--trace', dest='trace', default=None, help='write steps timing and resource usage to <trace>.jsonl and <trace>.json (Chrome trace format)')
+    parser.add_argument('--max_pending_gb', dest='max_pending_gb', type=float, default=20, help='pause builds while packages waiting for upload exceed this size')
 
     args = parser.parse_args()
     
     root_dir = os.getcwd()
-    
-    for repo in get_packages(args.packages):
+    if args.trace:
+        build_trace.enable(os.path.abspath(args.trace))
+    try:
+        cache = compiler_cache.create(args.compiler_cache, args.compiler_cache_dir, args.compiler_cache_size, root_dir)
+    except ValueError as e:
+        common.exit(str(e))
+    clean = args.clean
+    if not args.no_stage:
+        stage_dir = os.path.abspath(args.stage_dir)
+    if args.prune is not None:
+        common.log('Removed {} workspaces'.format(workspace.prune(root_dir, args.prune)))
+    job_server = jobserver.create(max(1, args.jobs), args.jobserver)
+    if job_server is not None:
+        atexit.register(job_server.close)
+
+    package_registry = registry.load(get_repo_dir=lambda name: get_repo_dir(root_dir, name))
+    try:
+        packages = package_registry.select(registry.split_names(args.packages), 'android', args.with_deps, args.with_dependents)
+    except (KeyError, ValueError) as e:
+        common.exit(e.args[0])
+    store = fingerprint.FingerprintStore(os.path.join(root_dir, fingerprint.store_name))
+    fingerprints = get_fingerprints(package_registry, packages, root_dir, store)
+    if stage_dir is not None:
+        remove_stale_stages()
+
+    pipeline = None
+    if args.pipeline:
+        pipeline = UploadPipeline(args.login, args.password, args.upload_jobs, int(args.max_pending_gb * 1024 * 1024 * 1024))
+        deps = package_registry.dependencies('android')[0]
+
+    # Pipeline mode stops building on a failure and reports the uploads
+    failed_build = None
+    for repo in packages:
+        abi_list = []
         for abi in abis:
-            make_package(repo, root_dir, abi, args.login, args.password)
\ No newline at end of file
+            if args.force or not store.is_actual(repo['name'] + ':' + abi, fingerprints[abi][repo['name']]):
+                abi_list.append(abi)
+                changed = store.changed_deps(repo['name'] + ':' + abi, built_deps[abi][repo['name']])
+                if changed:
+                    common.log('Rebuild {} [{}], dependencies are built again: {}'.format(repo['name'], abi, ', '.join(changed)))
+            else:
+                common.log('Skip {} [{}], already published'.format(repo['name'], abi))
+        if not abi_list:
+            continue
+
+        if pipeline is not None:
+            repo_dir = os.path.join(root_dir, repo['name'] + '_code')
+            build_abis = dict()
+
+            def on_published(build_dirs, repo=repo, build_abis=build_abis):
+                for build_dir in build_dirs:
+                    abi = build_abis[build_dir]
+                    set_built(store, repo['name'], abi)
+
+            # Staged dependencies are taken from disk, others are downloaded
+            pipeline.wait_for([name for name in deps[repo['name']] if not is_staged(name, abi_list)])
+            if args.parallel_abis:
+                pipeline.wait_for_space()
+                build_dirs = build_package_abis(repo, root_dir, abi_list)
+                if build_dirs is None:
+                    failed_build = repo['name']
+                    break
+                build_abis.update(zip(build_dirs, abi_list))
+                pipeline.submit(repo['name'], repo_dir, build_dirs, on_published)
+                continue
+            for abi in abi_list:
+                pipeline.wait_for_space()
+                build_dir = build_package(repo, root_dir, abi)
+                if build_dir is None:
+                    failed_build = '{} [{}]'.format(repo['name'], abi)
+                    break
+                build_abis[build_dir] = abi
+                pipeline.submit(repo['name'], repo_dir, [build_dir], on_published)
+            if failed_build is not None:
+                break
+            continue
+
+        if args.parallel_abis:
+            make_package_abis(repo, root_dir, args.login, args.password, abi_list)
+            for abi in abi_list:
+                set_built(store, repo['name'], abi)
+            continue
+        for abi in abi_list:
+            make_package(repo, root_dir, abi, args.login, args.password)
+            set_built(store, repo['name'], abi)
+
+    if cache is not None:
+        cache.report()
+    failed = pipeline.close() if pipeline is not None else []
+    for (repo_dir, build_dir), error in failed:
+        common.color_print('Failed to publish {}: {}'.format(build_dir, error), False, 'LRED')
+    if failed:
+        # Retry with repka_release.py --manifest failed_uploads.json
+        with open(os.path.join(root_dir, 'failed_uploads.json'), 'w') as f:
+            json.dump([{'repo_path': repo_dir, 'build_path': build_dir} for (repo_dir, build_dir), _ in failed], f, indent=2)
+    if failed_build is not None:
+        common.exit('Failed to build ' + failed_build)
+    if failed:
+        common.exit('{} uploads failed'.format(len(failed)))
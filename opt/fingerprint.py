@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Package fingerprints to skip rebuilding of unchanged packages
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import scheduler
+
+store_name = '.borsch_fingerprints.json'
+external = 'external'
+# Build and install directories live inside the repositories
+exclude_pathspec = [':(exclude,glob)build*/**', ':(exclude,glob)inst/**']
+
+
+def git_output(args, cwd):
+    try:
+        return subprocess.check_output(['git'] + args, cwd=cwd, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def source_state(repo_dir):
+    '''Return git HEAD and the hash of uncommitted changes or (None, None)'''
+    head = git_output(['rev-parse', 'HEAD'], repo_dir)
+    if head is None:
+        return None, None
+    pathspec = ['--', '.'] + exclude_pathspec
+    dirty = hashlib.sha256()
+    dirty.update(git_output(['diff', 'HEAD', '--binary'] + pathspec, repo_dir) or b'')
+    untracked = git_output(['ls-files', '--others', '--exclude-standard', '-z'] + pathspec, repo_dir) or b''
+    for path in sorted(untracked.split(b'\0')):
+        if not path:
+            continue
+        dirty.update(path + b'\0')
+        try:
+            with open(os.path.join(repo_dir, path.decode('utf-8', 'surrogateescape')), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    dirty.update(chunk)
+        except (IOError, OSError):
+            pass
+    return head.strip().decode(), dirty.hexdigest()
+
+
+def package_fingerprint(state, args, dep_fingerprints):
+    head, dirty = state
+    if head is None:
+        return None
+    data = {'head': head, 'dirty': dirty, 'args': list(args), 'deps': dep_fingerprints}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def get_fingerprints(names, deps, get_repo_dir, get_args, get_built, states=None, selected=None, used=None):
+    '''
+    Fingerprint every package in dependency order. A package fingerprint
+    includes the fingerprints of its dependencies as they are built: the
+    new ones for selected packages, which are built in this run, and the
+    last built ones (get_built(name), None if never built) for the others.
+    So a changed dependency invalidates the packages depending on it only
+    when it is built. None means "always rebuild". names and deps should
+    be the whole registry graph of the platform, so a fingerprint does not
+    depend on the selection. Packages out of selected without sources come
+    as binaries and get the constant 'external'. used is filled with
+    {name: dependency fingerprints} to be stored with the build.
+    '''
+    if states is None:
+        states = {}
+    if used is None:
+        used = {}
+    out = {}
+    for name in scheduler.topological_order(names, deps):
+        repo_dir = get_repo_dir(name)
+        if repo_dir not in states:
+            states[repo_dir] = source_state(repo_dir)
+        if selected is not None and name not in selected and states[repo_dir][0] is None:
+            out[name] = external
+            continue
+        dep_fingerprints = {}
+        for dep in deps[name]:
+            if selected is None or dep in selected or out[dep] == external:
+                dep_fingerprints[dep] = out[dep]
+            else:
+                dep_fingerprints[dep] = get_built(dep)
+        used[name] = dep_fingerprints
+        if any(dep_fingerprints[dep] is None for dep in deps[name] if selected is None or dep in selected):
+            out[name] = None
+            continue
+        out[name] = package_fingerprint(states[repo_dir], get_args(name), dep_fingerprints)
+    return out
+
+
+class FingerprintStore:
+    '''
+    Fingerprints of the last successful builds keyed by package[:abi] with
+    the dependency fingerprints the package was built with
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.data = json.load(f)
+            except ValueError:
+                self.data = {}
+        # Stores before dependencies were recorded keep plain fingerprints
+        for key, value in self.data.items():
+            if not isinstance(value, dict):
+                self.data[key] = {'fingerprint': value, 'deps': {}}
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key, {}).get('fingerprint')
+
+    def is_actual(self, key, fingerprint):
+        return fingerprint is not None and self.get(key) == fingerprint
+
+    def changed_deps(self, key, dep_fingerprints):
+        '''Dependencies built again since the last build of key'''
+        with self.lock:
+            built = self.data.get(key, {}).get('deps', {})
+        return sorted(dep for dep in dep_fingerprints if dep in built and built[dep] != dep_fingerprints[dep])
+
+    def set(self, key, fingerprint, dep_fingerprints=None):
+        with self.lock:
+            if fingerprint is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = {'fingerprint': fingerprint, 'deps': dep_fingerprints or {}}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
@@ -12,65 +12,24 @@
 
 import os
 import subprocess, shlex
-import sys
 import argparse
-import urllib2, json
+import json
 import base64
+import common
+import uploader
+try:
+    import urllib.request as urllib2
+except ImportError:
+    import urllib2
 
 github_endpoint = 'https://api.github.com'
 
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    OKGRAY = '\033[0;37m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    DGRAY='\033[1;30m'
-    LRED='\033[1;31m'
-    LGREEN='\033[1;32m'
-    LYELLOW='\033[1;33m'
-    LBLUE='\033[1;34m'
-    LMAGENTA='\033[1;35m'
-    LCYAN='\033[1;36m'
-    WHITE='\033[1;37m'
-
-def color_print(text, bold, color):
-    if sys.platform == 'win32':
-        print text
-    else:
-        out_text = ''
-        if bold:
-            out_text += bcolors.BOLD
-        if color == 'GREEN':
-            out_text += bcolors.OKGREEN
-        elif color == 'LGREEN':
-            out_text += bcolors.LGREEN
-        elif color == 'LYELLOW':
-            out_text += bcolors.LYELLOW
-        elif color == 'LMAGENTA':
-            out_text += bcolors.LMAGENTA
-        elif color == 'LCYAN':
-            out_text += bcolors.LCYAN
-        elif color == 'LRED':
-            out_text += bcolors.LRED
-        elif color == 'LBLUE':
-            out_text += bcolors.LBLUE
-        elif color == 'DGRAY':
-            out_text += bcolors.DGRAY
-        elif color == 'OKGRAY':
-            out_text += bcolors.OKGRAY
-        else:
-            out_text += bcolors.OKGRAY
-        out_text += text + bcolors.ENDC
-        print out_text
+def get_auth(username, password):
+    return "Basic " + base64.b64encode(('%s:%s' % (username, password)).encode()).decode()
 
 def check_tag_exist(tag, repo):
     subprocess.check_output(['git', 'fetch', '--tags'], cwd=repo)
-    p = subprocess.check_output(['git', 'tag', '-l', 'v*'], cwd=repo)
+    p = subprocess.check_output(['git', 'tag', '-l', 'v*'], cwd=repo, universal_newlines=True)
     return tag in p.splitlines()
 
 def get_repository(remote_url):
@@ -82,28 +41,27 @@ def get_repository(remote_url):
     return org
 
 def check_release(tag, repo, release_file, username, password):
-    color_print('Check release ' + tag, True, 'OKGRAY')
-    remote_url = subprocess.check_output(['git', 'config', '--get', 'remote.origin.url'], cwd=repo)
+    common.color_print('Check release ' + tag, True, 'OKGRAY')
+    remote_url = subprocess.check_output(['git', 'config', '--get', 'remote.origin.url'], cwd=repo, universal_newlines=True)
 
     org = get_repository(remote_url)
 
     url =  github_endpoint + '/repos/' + org + '/releases'
-    color_print('Check release url: ' + url, False, 'OKGRAY')
+    common.color_print('Check release url: ' + url, False, 'OKGRAY')
     request = urllib2.Request(url)
     response = urllib2.urlopen(request)
     releases = json.loads(response.read())
     for release in releases:
         if release['tag_name'] == tag:
-            color_print('Release ' + tag + ' found', False, 'LCYAN')
+            common.color_print('Release ' + tag + ' found', False, 'LCYAN')
             assets_url = release['upload_url']
             assets = release['assets']
             release_file_name = os.path.basename(release_file)
             for asset in assets:
                 if asset['name'] == release_file_name:
                     # Delete asset
-                    base64string = base64.b64encode('%s:%s' % (username, password))
-                    auth = "Basic " + base64string
-                    color_print('Delete asset ' + release_file_name + ' [' + asset['url'] + ']', False, 'LRED')
+                    auth = get_auth(username, password)
+                    common.color_print('Delete asset ' + release_file_name + ' [' + asset['url'] + ']', False, 'LRED')
                     request = urllib2.Request(asset['url'], headers={'Authorization' : auth})
                     request.get_method = lambda: 'DELETE'
                     response = urllib2.urlopen(request)
@@ -112,13 +70,13 @@ def check_release(tag, repo, release_file, username, password):
     return None
 
 def create_release(tag, repo, username, password):
-    color_print('Create release ' + tag, False, 'LGREEN')
-    remote_url = subprocess.check_output(['git', 'config', '--get', 'remote.origin.url'], cwd=repo)
+    common.color_print('Create release ' + tag, False, 'LGREEN')
+    remote_url = subprocess.check_output(['git', 'config', '--get', 'remote.origin.url'], cwd=repo, universal_newlines=True)
 
     org = get_repository(remote_url)
 
     url =  github_endpoint + '/repos/' + org + '/releases'
-    color_print('Create release url: ' + url, False, 'OKGRAY')
+    common.color_print('Create release url: ' + url, False, 'OKGRAY')
     data = json.dumps({
         "tag_name": tag,
         "target_commitish": "master",
@@ -126,10 +84,10 @@ def create_release(tag, repo, username, password):
         "body": "Version " + tag,
         "draft": False,
         "prerelease": False})
-    clen = len(data)
 
-    base64string = base64.b64encode('%s:%s' % (username, password))
-    auth = "Basic " + base64string
+    data = data.encode()
+    clen = len(data)
+    auth = get_auth(username, password)
     request = urllib2.Request(url, data=data, headers={'Content-Type': 'application/json', 'Content-Length': clen, 'Authorization' : auth})
     response = urllib2.urlopen(request)
     releases = json.loads(response.read())
@@ -137,19 +95,17 @@ def create_release(tag, repo, username, password):
     return releases['upload_url']
 
 def upload_release(url, release_file, username, password):
-    color_print('Upload release file ' + release_file, True, 'LGREEN')
+    common.color_print('Upload release file ' + release_file, True, 'LGREEN')
     file_name = os.path.basename(release_file)
     post_url = url.replace('{?name,label}', '?name=') + file_name
-    args = ['curl', '-u', username + ':' + password, '-H', 'Content-Type: application/zip', '--data-binary', '@' + release_file, post_url]
-
-    load_response = subprocess.check_output(args)
+    load_response, checksum = uploader.send_file(post_url, release_file, {'Content-Type': 'application/zip', 'Authorization': get_auth(username, password)})
 
     # For debug
-    print load_response
+    common.log('{}'.format(load_response))
 
     response = json.loads(load_response)
 
-    color_print('Uploaded. Get it: ' + response['browser_download_url'], True, 'LGREEN')
+    common.color_print('Uploaded. Get it: ' + response['browser_download_url'] + ', sha256: ' + checksum, True, 'LGREEN')
 
 
 if __name__ == "__main__":
@@ -171,7 +127,7 @@ if __name__ == "__main__":
         repo_path = os.getcwd()
         build_path = os.path.join(repo_path, args.build)
 
-    color_print('Repo: ' + repo_path + ', Build dir: ' + build_path, True, 'OKGRAY')
+    common.color_print('Repo: ' + repo_path + ', Build dir: ' + build_path, True, 'OKGRAY')
 
     with open(os.path.join(build_path, 'version.str')) as f:
         content = f.readlines()
@@ -184,8 +140,8 @@ if __name__ == "__main__":
 # 1. Check if tag created in repo
     if(not check_tag_exist(tag, repo_path)):
 # 2. If not create - exit with error
-        color_print('Tag {} is not created in repository'.format(tag), True, 'LRED')
-        exit(1)
+        common.color_print('Tag {} is not created in repository'.format(tag), True, 'LRED')
+        common.exit(1)
 # 3. Check if release created from tag
     upload_url = check_release(tag, repo_path, release_file, login, key)
     if upload_url is None:
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Incremental install of package trees into one destination
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import errno
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import compare
+
+manifest_dir = '.borsch'
+manifest_name = 'manifest.db'
+tmp_suffix = '.borsch-tmp'
+link_modes = ('auto', 'copy', 'hardlink', 'reflink')
+FICLONE = 0x40049409
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def scan_tree(root):
+    '''Return {relative path: (size, mtime_ns, symlink target or None)} of files under root'''
+    out = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_symlink():
+                    out[rel_path] = (0, 0, os.readlink(entry.path))
+                elif entry.is_dir():
+                    stack.append(rel_path)
+                else:
+                    st = entry.stat()
+                    out[rel_path] = (st.st_size, st.st_mtime_ns, None)
+    return out
+
+
+def reflink(src, dst):
+    '''Clone file extents (FICLONE) or let the kernel copy them (copy_file_range)'''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None and sys.platform.startswith('linux'):
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except (IOError, OSError):
+                pass
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError(errno.EOPNOTSUPP, 'reflink is not supported')
+        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30) > 0:
+            pass
+
+
+class Installer:
+    '''
+    Merge package install trees into dst. Every installed file is recorded
+    in dst/.borsch/manifest.db with its owner package, size, mtime and hash.
+    Files are only copied if they changed since the previous install, files
+    a package no longer ships are removed. Paths shipped by more than one
+    package with different content are reported as conflicts before copying.
+    '''
+
+    def __init__(self, dst, mode='auto', jobs=None):
+        self.dst = dst
+        self.mode = mode
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.errors = []
+        self.failed = set()
+        self.conflicts = []
+        self.copied = 0
+        self.copied_size = 0
+        self.linked = 0
+        self.skipped = 0
+        self.removed = 0
+        # Reflink support is checked by the first copy
+        self.can_reflink = mode in ('auto', 'reflink')
+        if not os.path.exists(os.path.join(dst, manifest_dir)):
+            os.makedirs(os.path.join(dst, manifest_dir))
+        self.db = sqlite3.connect(os.path.join(dst, manifest_dir, manifest_name))
+        self.db.execute('''CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, package TEXT NOT NULL,
+            size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, link TEXT, hash TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_package ON files (package)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def read_manifest(self):
+        '''Return {path: (package, size, mtime_ns, link, hash)}'''
+        return dict((row[0], row[1:]) for row in self.db.execute('SELECT path, package, size, mtime_ns, link, hash FROM files'))
+
+    def owner(self, path):
+        row = self.db.execute('SELECT package FROM files WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def packages(self):
+        return [row for row in self.db.execute('SELECT package, COUNT(*), SUM(size) FROM files GROUP BY package ORDER BY package')]
+
+    def add_error(self, message):
+        with self.lock:
+            self.errors.append(message)
+
+    def copy_data(self, src, tmp):
+        '''Return how src is put to tmp and its digest if the content was read'''
+        if self.mode == 'hardlink':
+            try:
+                os.link(src, tmp)
+                return 'link', None
+            except OSError as e:
+                # Different file systems, fall back to copy
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        if self.can_reflink:
+            try:
+                reflink(src, tmp)
+                shutil.copystat(src, tmp)
+                return 'reflink', None
+            except OSError:
+                if self.mode == 'reflink':
+                    raise
+                self.can_reflink = False
+        digest = compare.copy_file(src, tmp)
+        shutil.copystat(src, tmp)
+        return 'copy', digest
+
+    def install_file(self, item):
+        '''Put one file into dst, return its hash or None if it is not known yet'''
+        rel_path, src, info, digest = item
+        dst = os.path.join(self.dst, rel_path)
+        tmp = dst + tmp_suffix
+        try:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if info[2] is not None:
+                os.symlink(info[2], tmp)
+                result = 'link'
+            else:
+                result, copy_digest = self.copy_data(src, tmp)
+                if digest is None:
+                    digest = copy_digest
+            os.replace(tmp, dst)
+        except (IOError, OSError) as e:
+            self.add_error('Copy {} failed: {}'.format(src, e))
+            with self.lock:
+                self.failed.add(rel_path)
+            return None
+        with self.lock:
+            if result == 'link':
+                self.linked += 1
+            else:
+                self.copied += 1
+                self.copied_size += info[0]
+        return digest
+
+    def is_actual(self, rel_path, name, info, old):
+        if old is None or old[0] != name or old[1:4] != info:
+            return False
+        try:
+            st = os.lstat(os.path.join(self.dst, rel_path))
+        except OSError:
+            return False
+        if info[2] is not None:
+            return stat.S_ISLNK(st.st_mode)
+        return stat.S_ISREG(st.st_mode) and st.st_size == info[0]
+
+    def remove_file(self, rel_path):
+        path = os.path.join(self.dst, rel_path)
+        try:
+            if os.path.lexists(path):
+                os.remove(path)
+                self.removed += 1
+        except OSError as e:
+            self.add_error('Remove {} failed: {}'.format(path, e))
+            return False
+        # Drop directories left empty
+        parent = os.path.dirname(rel_path)
+        while parent:
+            try:
+                os.rmdir(os.path.join(self.dst, parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def find_conflicts(self, packages, trees, manifest):
+        '''
+        Return {path: [packages]} of paths shipped by several packages with
+        different content and the digests computed on the way.
+        '''
+        names = set(name for name, _ in packages)
+        shipped = {}
+        for (name, inst_dir), tree in zip(packages, trees):
+            for rel_path, info in tree.items():
+                shipped.setdefault(rel_path, []).append((name, inst_dir, info))
+        # Paths owned by packages which are not installed now
+        for rel_path, old in manifest.items():
+            if old[0] not in names and rel_path in shipped:
+                shipped[rel_path].insert(0, (old[0], None, old[1:4]))
+
+        digests = {}
+        candidates = [(rel_path, items) for rel_path, items in shipped.items() if len(items) > 1]
+
+        def get_digest(rel_path, item):
+            name, inst_dir, info = item
+            if info[2] is not None:
+                return 'link:' + info[2]
+            if inst_dir is None:
+                # Hardlinked and reflinked files are hashed only when a check needs it
+                if manifest[rel_path][4] is None:
+                    try:
+                        return compare.file_digest(os.path.join(self.dst, rel_path))
+                    except (IOError, OSError):
+                        return None
+                return manifest[rel_path][4]
+            digest = compare.file_digest(os.path.join(inst_dir, rel_path))
+            with self.lock:
+                digests[(name, rel_path)] = digest
+            return digest
+
+        def check(candidate):
+            rel_path, items = candidate
+            if len(set(item[2][0] for item in items)) == 1 and \
+                    len(set(get_digest(rel_path, item) for item in items)) == 1:
+                return None
+            return rel_path, [item[0] for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            conflicts = dict(result for result in executor.map(check, candidates) if result is not None)
+        return conflicts, digests
+
+    def install(self, packages, fail_on_conflict=False):
+        '''
+        Install [(name, inst dir)], later packages win on the same path.
+        Packages which are not listed keep their files. Return True on success.
+        '''
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            trees = list(executor.map(lambda package: scan_tree(package[1]), packages))
+        manifest = self.read_manifest()
+
+        conflicts, digests = self.find_conflicts(packages, trees, manifest)
+        self.conflicts = sorted(conflicts.items())
+        if conflicts and fail_on_conflict:
+            return False
+
+        owners = {}
+        for (name, inst_dir), tree in zip(packages, trees):
+            for rel_path, info in tree.items():
+                owners[rel_path] = (name, inst_dir, info)
+
+        names = set(name for name, _ in packages)
+        stale = [rel_path for rel_path, old in manifest.items() if old[0] in names and rel_path not in owners]
+        for rel_path in sorted(stale, reverse=True):
+            if self.remove_file(rel_path):
+                self.db.execute('DELETE FROM files WHERE path = ?', (rel_path,))
+        self.db.commit()
+
+        plan = []
+        for rel_path, (name, inst_dir, info) in owners.items():
+            if self.is_actual(rel_path, name, info, manifest.get(rel_path)):
+                self.skipped += 1
+                continue
+            plan.append((rel_path, os.path.join(inst_dir, rel_path), info, digests.get((name, rel_path))))
+
+        dirs = set(os.path.dirname(rel_path) for rel_path, _, _, _ in plan)
+        for rel_dir in sorted(dirs):
+            path = os.path.join(self.dst, rel_dir)
+            if os.path.lexists(path) and not os.path.isdir(path):
+                os.remove(path)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            hashes = list(executor.map(self.install_file, plan))
+
+        # Failed files are not recorded and copied again next time
+        rows = [(rel_path, owners[rel_path][0], info[0], info[1], info[2], digest)
+                for (rel_path, _, info, _), digest in zip(plan, hashes) if rel_path not in self.failed]
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+        return not self.errors
+
+    def uninstall(self, names):
+        '''
+        Remove files of the packages using the manifest only. Conflicting
+        paths belong to the last installed package, so packages which
+        shipped them too need to be installed again.
+        '''
+        for name in names:
+            paths = [row[0] for row in self.db.execute('SELECT path FROM files WHERE package = ?', (name,))]
+            for rel_path in sorted(paths, reverse=True):
+                if self.remove_file(rel_path):
+                    self.db.execute('DELETE FROM files WHERE path = ?', (rel_path,))
+            self.db.commit()
+        return not self.errors
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: GNU make compatible jobserver shared by all child builds
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import contextlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+token_byte = b'+'
+auth_re = re.compile(r'--jobserver-(?:auth|fds)=(\S+)')
+styles = ('auto', 'fifo', 'pipe')
+
+
+def make_version():
+    '''Return GNU make version as tuple or None'''
+    try:
+        output = subprocess.check_output(['make', '--version'], stderr=subprocess.DEVNULL, universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = re.search(r'GNU Make (\d+)\.(\d+)', output)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def is_supported():
+    return sys.platform != 'win32'
+
+
+class JobServer:
+    '''
+    Pool of job tokens passed to child builds through MAKEFLAGS. GNU make
+    4.4+ and Ninja 1.13+ take the fifo:PATH form, older make needs the
+    inherited pipe descriptors (named --jobserver-fds before make 4.2, i.e.
+    3.81 of macOS). The driver takes one token per started
+    build, the build runs its first job on it and reads more from the pool,
+    so all builds together never run more than jobs processes. If the
+    driver itself runs under a jobserver (MAKEFLAGS of the parent), the
+    parent pool is used instead.
+    '''
+
+    def __init__(self, jobs, style='auto'):
+        self.jobs = jobs
+        self.fifo_path = None
+        self.tmp_dir = None
+        self.owner = True
+        self.read_fd = self.write_fd = None
+        self.make_version = None
+        if not self.join(os.environ.get('MAKEFLAGS', '')):
+            self.make_version = make_version()
+            if style == 'auto':
+                style = 'fifo' if self.make_version is None or self.make_version >= (4, 4) else 'pipe'
+            self.create(style)
+            os.write(self.write_fd, token_byte * jobs)
+
+    def join(self, makeflags):
+        match = auth_re.search(makeflags)
+        if match is None:
+            return False
+        auth = match.group(1)
+        try:
+            if auth.startswith('fifo:'):
+                self.fifo_path = auth[len('fifo:'):]
+                self.open_fifo()
+            else:
+                read_fd, write_fd = (int(fd) for fd in auth.split(','))
+                os.fstat(read_fd)
+                os.fstat(write_fd)
+                self.read_fd, self.write_fd = read_fd, write_fd
+        except (OSError, ValueError):
+            self.fifo_path = None
+            return False
+        self.owner = False
+        return True
+
+    def open_fifo(self):
+        # Open the read end without blocking as there is no writer yet
+        self.read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.write_fd = os.open(self.fifo_path, os.O_WRONLY)
+        os.set_blocking(self.read_fd, True)
+
+    def create(self, style):
+        if style == 'fifo':
+            self.tmp_dir = tempfile.mkdtemp(prefix='borsch-jobserver-')
+            self.fifo_path = os.path.join(self.tmp_dir, 'fifo')
+            os.mkfifo(self.fifo_path, 0o600)
+            self.open_fifo()
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_inheritable(self.read_fd, True)
+            os.set_inheritable(self.write_fd, True)
+
+    @property
+    def pass_fds(self):
+        '''Descriptors child processes must inherit'''
+        return () if self.fifo_path is not None else (self.read_fd, self.write_fd)
+
+    def makeflags(self):
+        if self.fifo_path is not None:
+            return '-j{} --jobserver-auth=fifo:{}'.format(self.jobs, self.fifo_path)
+        fds = '{},{}'.format(self.read_fd, self.write_fd)
+        if self.make_version is not None and self.make_version < (4, 2):
+            # Old make takes -jN next to the descriptors as forced by user and drops the jobserver
+            return '-j --jobserver-fds={0} --jobserver-auth={0}'.format(fds)
+        return '-j{} --jobserver-auth={}'.format(self.jobs, fds)
+
+    def environ(self, env=None):
+        '''Copy of env (os.environ by default) with the jobserver in MAKEFLAGS'''
+        env = dict(os.environ if env is None else env)
+        flags = auth_re.sub('', env.get('MAKEFLAGS', ''))
+        flags = re.sub(r'(^|\s)-j\d*(?=\s|$)', ' ', flags).strip()
+        env['MAKEFLAGS'] = (flags + ' ' + self.makeflags()).strip()
+        return env
+
+    def acquire(self):
+        while not os.read(self.read_fd, 1):
+            pass
+
+    def release(self):
+        os.write(self.write_fd, token_byte)
+
+    @contextlib.contextmanager
+    def slot(self):
+        '''Hold one token while a build runs'''
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            if fd is not None and (self.owner or self.fifo_path is not None):
+                os.close(fd)
+        self.read_fd = self.write_fd = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+
+def hold(server):
+    '''Token of the server or nothing if it is None'''
+    return server.slot() if server is not None else contextlib.nullcontext()
+
+
+def create(jobs, style='auto'):
+    '''Return JobServer or None where make jobserver is not available (Windows)'''
+    if not is_supported():
+        return None
+    return JobServer(jobs, style)
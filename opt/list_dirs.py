@@ -13,31 +13,200 @@
 import os
 import argparse
 import csv
+import fnmatch
+import heapq
+import tempfile
+import common
+from collections import deque
+
+
+def match_any(path, patterns):
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def walk(rootdir, include=None, exclude=None, max_depth=None):
+    '''
+    Yield (relative path, files count, files size) for rootdir and its
+    subdirectories depth first, children of every directory sorted by name.
+    Excluded directories are not entered, include only filters the output.
+    '''
+    # Every entry keeps the chain of its parents ids to stop symlink loops
+    stack = deque([('', rootdir, 0, None, False)])
+    while stack:
+        rel_path, path, depth, parents, is_link = stack.pop()
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        dir_id = (st.st_dev, st.st_ino)
+        if is_link:
+            chain = parents
+            while chain is not None and chain[0] != dir_id:
+                chain = chain[1]
+            if chain is not None:
+                continue
+        parents = (dir_id, parents)
+
+        files = 0
+        size = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append((entry.name, entry.is_symlink()))
+                        else:
+                            files += 1
+                            size += entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+        if not include or match_any(rel_path, include):
+            yield rel_path, files, size
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+        for name, is_link in sorted(subdirs, reverse=True):
+            sub_path = os.path.join(rel_path, name) if rel_path else name
+            if exclude and match_any(sub_path, exclude):
+                continue
+            stack.append((sub_path, os.path.join(path, name), depth + 1, parents, is_link))
+
+
+def path_key(path):
+    '''Sort key matching the walk order: path components, root first'''
+    return tuple(path.replace('\\', '/').split('/')) if path else ()
+
+
+def row_key(row):
+    return path_key(row[0] if row else '')
+
+
+def is_sorted(csv_path):
+    last = None
+    with open(csv_path) as f:
+        for row in csv.reader(f):
+            key = row_key(row)
+            if last is not None and key < last:
+                return False
+            last = key
+    return True
+
+
+def read_sorted(csv_path, chunk_rows, tmp_dir):
+    '''
+    Yield rows of csv_path ordered by path. Unordered files are sorted in
+    chunks of chunk_rows rows which are merged afterwards, so only one chunk
+    is kept in memory.
+    '''
+    if is_sorted(csv_path):
+        with open(csv_path) as f:
+            for row in csv.reader(f):
+                if row:
+                    yield row
+        return
+
+    chunks = []
+    with open(csv_path) as f:
+        reader = csv.reader(f)
+        while True:
+            rows = [row for _, row in zip(range(chunk_rows), reader)]
+            if not rows:
+                break
+            rows = [row for row in rows if row]
+            # Sort is stable, rows of the same path keep their order
+            rows.sort(key=row_key)
+            chunk = tempfile.TemporaryFile('w+', dir=tmp_dir, newline='')
+            csv.writer(chunk).writerows(rows)
+            chunk.seek(0)
+            chunks.append(chunk)
+    try:
+        for row in heapq.merge(*[csv.reader(chunk) for chunk in chunks], key=row_key):
+            yield row
+    finally:
+        for chunk in chunks:
+            chunk.close()
+
+
+def merge(rootdir, existing_path, writer, walk_args, chunk_rows=100000):
+    '''
+    Write rows of existing_path in their order, later rows win in organize,
+    then new directories of rootdir in path order. Existing rows keep their
+    decisions, rows of directories which do not exist anymore get missing
+    in the fifth column. Return (kept, new, missing).
+    '''
+    tmp_dir = os.path.dirname(os.path.abspath(existing_path))
+    kept = new = missing = 0
+    with tempfile.TemporaryFile('w+', dir=tmp_dir, newline='') as new_rows:
+        # New directories are found by walking along the rows ordered by path
+        new_writer = csv.writer(new_rows)
+        rows = read_sorted(existing_path, chunk_rows, tmp_dir)
+        try:
+            row = next(rows, None)
+            for current in walk(rootdir, *walk_args):
+                key = path_key(current[0])
+                while row is not None and row_key(row) < key:
+                    row = next(rows, None)
+                if row is None or row_key(row) != key:
+                    new_writer.writerow([current[0], current[0], 'skip', '*'])
+                    new += 1
+        finally:
+            rows.close()
+
+        with open(existing_path) as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                row = row[:4] if len(row) > 4 and row[4] == 'missing' else row
+                # Directory may be just filtered out by include, exclude or depth
+                if os.path.isdir(os.path.join(rootdir, row[0])):
+                    kept += 1
+                else:
+                    row = (row + [''] * 4)[:4] + ['missing']
+                    missing += 1
+                writer.writerow(row)
+        new_rows.seek(0)
+        for row in csv.reader(new_rows):
+            writer.writerow(row)
+    return kept, new, missing
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='List subdirectories')
     parser.add_argument('--in_path', help='root directory path', required=True)
     parser.add_argument('--out_path', help='output csv file path', required=True)
-    parser.add_argument('--version', action='version', version='%(prog)s 0.1')
+    parser.add_argument('--include', action='append', default=[], help='output only directories matching the glob pattern, i.e. src/*')
+    parser.add_argument('--exclude', action='append', default=[], help='skip directories matching the glob pattern with their content, i.e. */.git')
+    parser.add_argument('--max_depth', type=int, default=None, help='do not list directories deeper than this, root is 0')
+    parser.add_argument('--stats', action='store_true', help='add files count and size of every directory (not recursive)')
+    parser.add_argument('--merge', default=None, help='existing csv file to keep rows from, only new directories are added and disappeared ones are marked as missing')
+    parser.add_argument('--chunk_rows', type=int, default=100000, help='rows sorted in memory at once if the merged file is not ordered')
+    parser.add_argument('--version', action='version', version='%(prog)s 0.2')
     args = parser.parse_args()
 
-    rootdir = args.in_path
-    queue = [rootdir]
-    lst = []
-    while queue:
-        file = queue.pop(0)
-        if os.path.isdir(file):
-            # Skip root path
-            file_in = file.replace(rootdir, '')
-            if file_in.startswith('/'):
-                file_in = file_in[1:]
-            lst.append(file_in)
-            queue.extend(os.path.join(file,x) for x in os.listdir(file))
-
-    lst = sorted(lst)
+    if args.merge is not None:
+        if args.stats:
+            parser.error('--stats can not be used with --merge')
+        # Output may replace the merged file
+        tmp_path = args.out_path + '.tmp'
+        with open(tmp_path, 'w', newline='') as csvfile:
+            kept, new, missing = merge(args.in_path, args.merge, csv.writer(csvfile),
+                                       (args.include, args.exclude, args.max_depth), args.chunk_rows)
+        os.replace(tmp_path, args.out_path)
+        common.log('{} rows kept, {} new, {} missing'.format(kept, new, missing))
+        common.exit(0)
+
     with open(args.out_path, 'w') as csvfile:
         fieldnames = ['in_path', 'out_path', 'skip', 'ext']
+        if args.stats:
+            fieldnames += ['files', 'bytes']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        for path in lst:
-            writer.writerow({'in_path': path, 'out_path': path, 'skip': 'skip', 'ext': '*'})
-            # print(path)
+        for path, files, size in walk(args.in_path, args.include, args.exclude, args.max_depth):
+            row = {'in_path': path, 'out_path': path, 'skip': 'skip', 'ext': '*'}
+            if args.stats:
+                row['files'] = files
+                row['bytes'] = size
+            writer.writerow(row)
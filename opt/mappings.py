@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Compiled index of organize mappings (folders.csv)
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import csv
+import fnmatch
+import hashlib
+import json
+import os
+import re
+
+fieldnames = ('old', 'new', 'action', 'ext2keep')
+cache_version = 2
+range_re = re.compile(r'\[(\d+)-(\d+)\]')
+
+
+class Mapping:
+    '''
+    One folders.csv row. ext2keep items are matched against the file name
+    and the extension with one set lookup. name[a-b] items are expanded to
+    a..b-1, items with * or ? (besides the single *) are glob masks.
+    '''
+
+    __slots__ = ('line', 'old', 'new', 'action', 'items', 'any', 'names', 'mask')
+
+    def __init__(self, line, old, new, action, items):
+        self.line = line
+        self.old = old or ''
+        self.new = new or ''
+        self.action = action or ''
+        self.items = items
+        self.any = '*' in items
+        names = set()
+        masks = []
+        for item in items:
+            match = range_re.search(item)
+            if match is not None:
+                names.add(item)
+                for i in range(int(match.group(1)), int(match.group(2))):
+                    names.add(item[:match.start()] + str(i) + item[match.end():])
+            elif item != '*' and ('*' in item or '?' in item):
+                masks.append(fnmatch.translate(item))
+            elif item:
+                names.add(item)
+        self.names = frozenset(names)
+        self.mask = re.compile('|'.join(masks)) if masks else None
+
+    def match(self, file_name):
+        if self.any or file_name in self.names:
+            return True
+        file_extension = os.path.splitext(file_name)[1].replace('.', '')
+        if file_extension != '' and file_extension in self.names:
+            return True
+        return self.mask is not None and self.mask.match(file_name) is not None
+
+    def is_empty(self):
+        return not self.any and not self.names and self.mask is None
+
+    def intersects(self, other):
+        '''True if some file name may be selected by both rows'''
+        if self.is_empty() or other.is_empty():
+            return False
+        if self.any or other.any or self.names & other.names:
+            return True
+        if self.mask is not None or other.mask is not None:
+            return any(self.match(name) for name in other.names) or \
+                any(other.match(name) for name in self.names) or \
+                (self.mask is not None and other.mask is not None)
+        return False
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'borsch', 'mappings')
+
+
+def parse(csv_path):
+    out = []
+    with open(csv_path) as f:
+        for line, row in enumerate(csv.DictReader(f, fieldnames=fieldnames), 1):
+            items = row['ext2keep'].split(',') if row['ext2keep'] else []
+            out.append(Mapping(line, row['old'], row['new'], row['action'], items))
+    return out
+
+
+def load(csv_path, cache_path=None):
+    '''
+    Return compiled mappings. Parsed rows are kept in a JSON file of the user
+    cache directory and reused while the CSV is not changed.
+    '''
+    csv_path = os.path.abspath(csv_path)
+    if cache_path is None:
+        name = hashlib.sha1(csv_path.encode('utf-8')).hexdigest() + '.json'
+        cache_path = os.path.join(default_cache_dir(), name)
+    stat = os.stat(csv_path)
+    key = [cache_version, stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+        if data['key'] == key:
+            return [Mapping(*row) for row in data['rows']]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    mappings = parse(csv_path)
+    try:
+        if not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'rows': [[item.line, item.old, item.new, item.action, item.items] for item in mappings]}, f)
+        os.replace(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
+    return mappings
+
+
+def list_files(folder):
+    with os.scandir(folder) as it:
+        return [entry.name for entry in it if not entry.name.startswith('.') and not entry.is_dir()]
+
+
+def validate(mappings, sources_dir=None):
+    '''
+    Return list of (line, message) for overlapping and dead rows. With
+    sources_dir the rows are checked against the real files, otherwise
+    only by their ext2keep items.
+    '''
+    out = []
+    by_old = {}
+    by_new = {}
+    folders = {}
+    selected = {}
+    for mapping in mappings:
+        if mapping.action == 'skip':
+            continue
+        if mapping.is_empty():
+            out.append((mapping.line, 'dead: ext2keep selects nothing'))
+            continue
+
+        files = None
+        if sources_dir is not None:
+            if mapping.old not in folders:
+                from_folder = os.path.join(sources_dir, mapping.old)
+                folders[mapping.old] = list_files(from_folder) if os.path.isdir(from_folder) else None
+            if folders[mapping.old] is None:
+                out.append((mapping.line, 'dead: source folder {} not exists'.format(mapping.old)))
+                continue
+            files = [name for name in folders[mapping.old] if mapping.match(name)]
+            if not files:
+                out.append((mapping.line, 'dead: no files matched in {}'.format(mapping.old or '.')))
+                continue
+            selected[mapping.line] = set(files)
+
+        def overlaps(other):
+            if files is None:
+                return mapping.intersects(other)
+            return not selected[mapping.line].isdisjoint(selected[other.line])
+
+        for other in by_old.get(mapping.old, []):
+            if overlaps(other):
+                out.append((mapping.line, 'overlaps line {}: same files of {}'.format(other.line, mapping.old or '.')))
+        for other in by_new.get(mapping.new, []):
+            if other.old != mapping.old and overlaps(other):
+                out.append((mapping.line, 'overlaps line {}: may overwrite files in {}'.format(other.line, mapping.new or '.')))
+        by_old.setdefault(mapping.old, []).append(mapping)
+        by_new.setdefault(mapping.new, []).append(mapping)
+    return sorted(out)
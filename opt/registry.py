@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Package registry loaded from packages.json
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import argparse
+import json
+import os
+import common
+import scheduler
+
+registry_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'packages.json')
+platforms = ('win', 'mac', 'nix', 'android')
+
+
+class Registry:
+    '''
+    Packages indexed by name and by build platform. Every package is a dict
+    with name, cmake_dir, build (platforms list), args and optional
+    android_args. Dependency edges are read from the WITH_<Name> arguments
+    of the platform and from the sources found by get_repo_dir(name), they
+    are cached.
+    '''
+
+    def __init__(self, packages, ext_modules=None, get_repo_dir=None):
+        self.packages = packages
+        self.ext_modules = ext_modules
+        self.get_repo_dir = get_repo_dir
+        self.by_name = {}
+        self.by_platform = dict((platform, []) for platform in platforms)
+        self.edges = {}
+        for package in packages:
+            if package['name'] in self.by_name:
+                raise ValueError('Package {} is registered twice'.format(package['name']))
+            self.by_name[package['name']] = package
+            for platform in package['build']:
+                self.by_platform.setdefault(platform, []).append(package)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def args_key(self, platform):
+        return 'android_args' if platform == 'android' else 'args'
+
+    def get_args(self, package, platform=None):
+        return package.get(self.args_key(platform), [])
+
+    def get_packages(self, platform=None):
+        return self.packages if platform is None else self.by_platform.get(platform, [])
+
+    def dependencies(self, platform=None):
+        '''Return ({name: [dependencies]}, {name: [dependents]}) of the platform packages'''
+        if platform not in self.edges:
+            if self.ext_modules is None:
+                self.ext_modules = scheduler.read_ext_modules()
+            deps = scheduler.get_dependencies(self.get_packages(platform), 'name', self.ext_modules, self.args_key(platform), self.get_repo_dir)
+            self.edges[platform] = (deps, scheduler.get_dependents(deps))
+        return self.edges[platform]
+
+    def closure(self, names, edges):
+        out = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            for other in edges.get(name, []):
+                if other not in out:
+                    out.add(other)
+                    stack.append(other)
+        return out
+
+    def select(self, names=None, platform=None, with_deps=False, with_dependents=False):
+        '''
+        Return packages of the platform in build order: dependencies first,
+        otherwise in the registry order. names limits the selection,
+        with_dependents adds every package which depends on them (directly
+        or not), with_deps adds everything they need. Dependents of the
+        dependencies are not added.
+        '''
+        available = self.get_packages(platform)
+        if names is None:
+            selected = set(package['name'] for package in available)
+        else:
+            unknown = [name for name in names if name not in self.by_name]
+            if unknown:
+                raise KeyError('Unknown packages: ' + ', '.join(unknown))
+            deps, dependents = self.dependencies(platform)
+            selected = set(names)
+            if with_dependents:
+                selected |= self.closure(names, dependents)
+            if with_deps:
+                selected |= self.closure(selected, deps)
+        ordered = [package['name'] for package in available if package['name'] in selected]
+        deps = self.dependencies(platform)[0]
+        sub_deps = dict((name, [dep for dep in deps[name] if dep in selected]) for name in ordered)
+        return [self.by_name[name] for name in scheduler.topological_order(ordered, sub_deps)]
+
+
+def load(path=registry_path, ext_modules=None, get_repo_dir=None):
+    with open(path) as f:
+        return Registry(json.load(f), ext_modules, get_repo_dir)
+
+
+def split_names(value):
+    '''Package names separated by comma or semicolon'''
+    if value is None:
+        return None
+    return [name for name in value.replace(';', ',').split(',') if name]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NextGIS Borsch tools. List registered packages in build order')
+    parser.add_argument('-v', '--version', action='version', version='NextGIS Borsch registry version 1.0')
+    parser.add_argument('--platform', dest='platform', choices=platforms, default=None, help='only packages built for the platform')
+    parser.add_argument('--only', dest='only', default=None, help='the names of the packages separated by comma')
+    parser.add_argument('--with-deps', dest='with_deps', action='store_true', default=False, help='add packages the selected ones depend on')
+    parser.add_argument('--with-dependents', dest='with_dependents', action='store_true', default=False, help='add packages which depend on the selected ones')
+    args = parser.parse_args()
+
+    registry = load()
+    try:
+        packages = registry.select(split_names(args.only), args.platform, args.with_deps, args.with_dependents)
+    except (KeyError, ValueError) as e:
+        common.exit(e.args[0])
+    deps = registry.dependencies(args.platform)[0]
+    for package in packages:
+        common.log('{:<24} {}'.format(package['name'], ', '.join(deps[package['name']])))
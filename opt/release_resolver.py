@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Resolve binary package assets for all packages in one batch
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+# The output is included by get_binary_package() in cmake/FindExtProject.cmake
+# when BORSCH_RESOLVED_ASSETS variable or environment variable points to it:
+#   BORSCH_RESOLVED_<repo>_<version|latest>                   package is resolved
+#   BORSCH_RESOLVED_<repo>_<version|latest>_<suffix>_URL      asset download url
+#   BORSCH_RESOLVED_<repo>_<version|latest>_<suffix>_NAME     asset name without .zip
+# where suffix is [static-][android-<abi>-|ios-<arch>-]<compiler> as made by
+# get_prefix() and get_compiler_version() in cmake/helper.cmake.
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+import common
+import scheduler
+from repka_release import RepkaClient, RepkaError
+
+set_re = re.compile(r'^\s*set\s*\(\s*(repo\w*)\s+([^\s)]+)\s*\)', re.MULTILINE)
+next_link_re = re.compile(r'<([^>]+)>\s*;\s*rel="next"')
+asset_re = re.compile(r'^(?P<package>.+?)-(?P<version>\d[\w.+~]*)-(?P<suffix>(?P<static>static-)?'
+                      r'(?:(?P<platform>android|ios)-(?P<arch>.+?)-)?'
+                      r'(?P<compiler>[A-Za-z]+-\d+(?:\.\d+)?(?:-64bit)?))\.zip$')
+
+
+def read_modules(path=scheduler.modules_dir):
+    '''Return binary repository settings from FindExt<Name>.cmake files with the FindExtProject defaults'''
+    out = {}
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.startswith('FindExt') or not file_name.endswith('.cmake'):
+            continue
+        with open(os.path.join(path, file_name)) as f:
+            values = dict(set_re.findall(f.read()))
+        if 'repo' not in values:
+            continue
+        repo_type = values.get('repo_type')
+        bin_type = values.get('repo_bin_type', repo_type)
+        if bin_type == 'repka':
+            bin_url = values.get('repo_bin_url', 'https://rm.nextgis.com')
+        else:
+            bin_url = values.get('repo_bin_url', values.get('repo_url', 'https://github.com'))
+        repo_bin = values.get('repo_bin', values['repo'])
+        out[repo_bin] = {'type': bin_type, 'url': bin_url, 'id': values.get('repo_bin_id', '0')}
+    return out
+
+
+def parse_asset(name):
+    '''Return (package, version, compiler, linkage, platform, suffix) or None'''
+    match = asset_re.match(name)
+    if match is None:
+        return None
+    platform = ''
+    if match.group('platform'):
+        platform = '{}-{}'.format(match.group('platform'), match.group('arch'))
+    linkage = 'static' if match.group('static') else 'shared'
+    return (match.group('package'), match.group('version'), match.group('compiler'),
+            linkage, platform, match.group('suffix'))
+
+
+class Resolver:
+    '''Fetch release listings with one keep-alive client per server and index assets'''
+
+    def __init__(self, jobs=8):
+        self.jobs = jobs
+        self.clients = {}
+
+    def get_client(self, url):
+        if url not in self.clients:
+            client = RepkaClient(endpoint=url, pool_size=self.jobs)
+            client.headers['User-Agent'] = 'borsch-release-resolver'
+            client.headers['Accept'] = 'application/json'
+            self.clients[url] = client
+        return self.clients[url]
+
+    def get_github(self, repo, settings, versions):
+        '''Return [(version key, [(asset name, url, asset id)])]'''
+        client = self.get_client(settings['url'])
+        releases = []
+        path = '/repos/{}/releases?per_page=100'.format(repo)
+        # Follow Link: <...>; rel="next" through all pages
+        while path is not None:
+            response, data = client.send('GET', path)
+            releases.extend(json.loads(data.decode('utf-8')))
+            match = next_link_re.search(response.getheader('Link') or '')
+            path = None
+            if match is not None:
+                url = urlsplit(match.group(1))
+                path = url.path[len(client.base_path):] + ('?' + url.query if url.query else '')
+        out = []
+        has_latest = False
+        for release in releases:
+            if release.get('draft'):
+                continue
+            assets = [(asset['name'], asset['browser_download_url'], asset['id']) for asset in release.get('assets', [])]
+            # Releases are listed newest first as /releases/latest picks them
+            if not has_latest and not release.get('prerelease'):
+                has_latest = True
+                out.append(('latest', assets))
+            else:
+                out.append((None, assets))
+        return out
+
+    def get_repka(self, repo, settings, versions):
+        client = self.get_client(settings['url'])
+        out = []
+        for version in ['latest'] + versions:
+            path = '/api/repo/{}/borsch?packet_name={}&release_tag={}'.format(settings['id'], repo, version)
+            try:
+                release = client.get_json(path)
+            except RepkaError as e:
+                if e.status == 404:
+                    continue
+                raise
+            assets = [(asset['name'], '{}/api/asset/{}/download'.format(settings['url'], asset['id']), asset['id'])
+                      for asset in release.get('files', [])]
+            out.append(('latest' if version == 'latest' else None, assets))
+        return out
+
+    def resolve_package(self, repo, settings, versions):
+        '''Return {version key: {suffix: (url, name, asset id)}}'''
+        if settings['type'] == 'repka':
+            releases = self.get_repka(repo, settings, versions)
+        else:
+            releases = self.get_github(repo, settings, versions)
+        out = {}
+        for version_key, assets in releases:
+            if version_key is not None:
+                out.setdefault(version_key, {})
+            for asset_name, url, asset_id in assets:
+                parsed = parse_asset(asset_name)
+                if parsed is None:
+                    continue
+                # Assets are indexed by their own version and the latest release
+                for key in set([parsed[1], version_key or parsed[1]]):
+                    index = out.setdefault(key, {})
+                    current = index.get(parsed[5])
+                    # Prefer the most recently uploaded asset
+                    if current is None or asset_id > current[2]:
+                        index[parsed[5]] = (url, asset_name[:-len('.zip')], asset_id)
+        return out
+
+    def resolve(self, modules, versions=None):
+        '''Return ({repo: index}, {repo: error})'''
+        if versions is None:
+            versions = {}
+
+        def resolve_one(repo):
+            try:
+                return repo, self.resolve_package(repo, modules[repo], versions.get(repo, [])), None
+            except Exception as e:
+                return repo, None, e
+
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            for repo, index, error in executor.map(resolve_one, sorted(modules)):
+                if error is None:
+                    results[repo] = index
+                else:
+                    errors[repo] = error
+        return results, errors
+
+
+def write_cmake(path, results):
+    lines = ['# Generated by opt/release_resolver.py at {}. Do not edit.'.format(time.strftime('%Y-%m-%d %H:%M:%S'))]
+    for repo in sorted(results):
+        for version in sorted(results[repo]):
+            key = 'BORSCH_RESOLVED_{}_{}'.format(repo, version)
+            lines.append('set({} TRUE)'.format(key))
+            for suffix, (url, name, _) in sorted(results[repo][version].items()):
+                lines.append('set({}_{}_URL "{}")'.format(key, suffix, url))
+                lines.append('set({}_{}_NAME "{}")'.format(key, suffix, name))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+def parse_versions(values):
+    out = {}
+    for value in values:
+        repo, _, version = value.partition('=')
+        out.setdefault(repo, []).append(version)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NextGIS Borsch tools. Resolve binary packages for CMake')
+    parser.add_argument('-v', '--version', action='version', version='NextGIS Borsch release_resolver version 1.0')
+    parser.add_argument('--output', dest='output', default='borsch_assets.cmake', help='output CMake file, pass it as -DBORSCH_RESOLVED_ASSETS=<path>')
+    parser.add_argument('--packages', dest='packages', nargs='*', help='binary repository names, default is all FindExt modules')
+    parser.add_argument('--versions', dest='versions', nargs='*', default=[], help='exact versions to resolve besides latest, i.e. lib_z=1.2.13')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=8, help='parallel requests')
+    parser.add_argument('--list', dest='list', action='store_true', help='print resolved assets')
+    args = parser.parse_args()
+
+    modules = read_modules()
+    if args.packages:
+        unknown = [name for name in args.packages if name not in modules]
+        if unknown:
+            common.exit('Unknown packages: ' + ', '.join(unknown))
+        modules = dict((name, modules[name]) for name in args.packages)
+
+    start = time.time()
+    results, errors = Resolver(args.jobs).resolve(modules, parse_versions(args.versions))
+    for repo in sorted(errors):
+        common.color_print('{}: {}'.format(repo, errors[repo]), False, 'LRED')
+    if args.list:
+        for repo in sorted(results):
+            for version in sorted(results[repo]):
+                for suffix, (url, name, _) in sorted(results[repo][version].items()):
+                    _, _, compiler, linkage, platform, _ = parse_asset(name + '.zip')
+                    common.log('{:<20} {:<10} {:<18} {:<7} {:<22} {}'.format(repo, version, compiler, linkage, platform, url))
+    write_cmake(args.output, results)
+    assets = sum(len(index) for package in results.values() for index in package.values())
+    common.color_print('Resolved {} assets of {} packages in {:.1f} sec to {}'.format(
+        assets, len(results), time.time() - start, args.output), True, 'LGREEN')
+    if errors:
+        common.exit(1)
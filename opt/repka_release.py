@@ -15,74 +15,228 @@ import sys
 import argparse
 import json
 import base64
+import socket
+import ssl
+import threading
+import time
+import uuid
 try:
-    import urllib.request as urllib2
+    import http.client as httplib
+    from urllib.parse import urlsplit
+    import queue
 except ImportError:
-    import urllib2
+    import httplib
+    from urlparse import urlsplit
+    import Queue as queue
+import common
+import uploader
+from concurrent.futures import ThreadPoolExecutor
 
 repka_endpoint = 'https://rm.nextgis.com'
 repo_id = 2
+resumable_path = '/api/upload/tus'
+idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+remote_disconnected = getattr(httplib, 'RemoteDisconnected', ())
 # Debug
 # repka_endpoint = 'http://localhost:8088'
 # repo_id = 1
 
-class PutRequest(urllib2.Request):
-    '''class to handling putting with urllib2'''
-
-    def __init__(self, *args, **kwargs):
-        return urllib2.Request.__init__(self, *args, **kwargs)
-
-    def get_method(self, *args, **kwargs):
-        return 'PUT'
-
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    OKGRAY = '\033[0;37m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    DGRAY='\033[1;30m'
-    LRED='\033[1;31m'
-    LGREEN='\033[1;32m'
-    LYELLOW='\033[1;33m'
-    LBLUE='\033[1;34m'
-    LMAGENTA='\033[1;35m'
-    LCYAN='\033[1;36m'
-    WHITE='\033[1;37m'
-
-def color_print(text, bold, color):
-    if sys.platform == 'win32':
-        print(text)
-    else:
-        out_text = ''
-        if bold:
-            out_text += bcolors.BOLD
-        if color == 'GREEN':
-            out_text += bcolors.OKGREEN
-        elif color == 'LGREEN':
-            out_text += bcolors.LGREEN
-        elif color == 'LYELLOW':
-            out_text += bcolors.LYELLOW
-        elif color == 'LMAGENTA':
-            out_text += bcolors.LMAGENTA
-        elif color == 'LCYAN':
-            out_text += bcolors.LCYAN
-        elif color == 'LRED':
-            out_text += bcolors.LRED
-        elif color == 'LBLUE':
-            out_text += bcolors.LBLUE
-        elif color == 'DGRAY':
-            out_text += bcolors.DGRAY
-        elif color == 'OKGRAY':
-            out_text += bcolors.OKGRAY
+class RepkaError(Exception):
+    def __init__(self, status, reason, body=None):
+        Exception.__init__(self, 'HTTP {} {}'.format(status, reason))
+        self.status = status
+        self.body = body
+
+class RepkaClient:
+    '''Repka API session with keep-alive connections and retries'''
+
+    def __init__(self, username=None, password=None, endpoint=None, pool_size=8, retries=3, backoff=1.0, timeout=300, verify=True):
+        url = urlsplit(endpoint or repka_endpoint)
+        self.is_https = url.scheme == 'https'
+        self.host = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.context = ssl.create_default_context() if verify else ssl._create_unverified_context()
+        self.headers = {}
+        if username is not None and password is not None:
+            auth = '{}:{}'.format(username, password)
+            self.headers['Authorization'] = 'Basic {}'.format(base64.b64encode(auth.encode()).decode())
+        self.pool = queue.LifoQueue(pool_size)
+
+    def _connect(self):
+        if self.is_https:
+            return httplib.HTTPSConnection(self.host, timeout=self.timeout, context=self.context)
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _get_connection(self):
+        try:
+            return self.pool.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release_connection(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def send(self, method, path, body=None, headers=None, retries=None):
+        '''
+        Send request and return the response and its body. Body may be bytes
+        or a function returning an iterable of bytes, so it can be sent again
+        on retry.
+        '''
+        if retries is None:
+            retries = self.retries
+        request_headers = dict(self.headers)
+        if headers is not None:
+            request_headers.update(headers)
+
+        attempt = 0
+        while True:
+            connection, is_reused = self._get_connection()
+            is_sent = False
+            try:
+                connection.request(method, self.base_path + path, body() if callable(body) else body, request_headers)
+                is_sent = True
+                response = connection.getresponse()
+                data = response.read()
+            except (socket.error, httplib.HTTPException) as e:
+                connection.close()
+                # Server may drop the idle keep-alive connection, reconnect without
+                # counting the attempt only if the request surely was not processed
+                if is_reused and (not is_sent or (isinstance(e, remote_disconnected) and method in idempotent_methods)):
+                    continue
+                if attempt >= retries:
+                    raise
+                error = e
+            else:
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._release_connection(connection)
+                if response.status < 400:
+                    return response, data
+                if response.status < 500 or attempt >= retries:
+                    raise RepkaError(response.status, response.reason, data)
+                error = RepkaError(response.status, response.reason, data)
+
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            common.color_print('{} {} failed: {}. Retry in {} sec'.format(method, path, error, delay), False, 'LYELLOW')
+            time.sleep(delay)
+
+    def request(self, method, path, body=None, headers=None, retries=None):
+        return self.send(method, path, body, headers, retries)[1]
+
+    def get_json(self, path):
+        return json.loads(self.request('GET', path).decode('utf-8'))
+
+    def send_json(self, method, path, data, retries=None):
+        data = json.dumps(data).encode()
+        headers = {'Content-Type': 'application/json', 'Content-Length': str(len(data))}
+        return json.loads(self.request(method, path, data, headers, retries).decode('utf-8'))
+
+    def upload(self, file_path, chunk_size=uploader.default_chunk_size):
+        '''Stream file as multipart/form-data, return the response and file SHA-256'''
+        boundary = uuid.uuid4().hex
+        head = ('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').format(boundary, os.path.basename(file_path)).encode()
+        tail = '\r\n--{}--\r\n'.format(boundary).encode()
+        stream = uploader.FileStream(file_path, chunk_size)
+
+        def body():
+            yield head
+            for chunk in stream:
+                yield chunk
+            yield tail
+
+        headers = {
+            'Content-Type': 'multipart/form-data; boundary=' + boundary,
+            'Content-Length': str(len(head) + len(stream) + len(tail)),
+        }
+        response = json.loads(self.request('POST', '/api/upload', body, headers).decode('utf-8'))
+        return response, stream.hexdigest()
+
+    def upload_resumable(self, file_path, chunk_size=8 * 1024 * 1024):
+        '''
+        Upload file by chunks with the tus 1.0 protocol: POST creates upload
+        and returns Location, HEAD returns Upload-Offset, PATCH appends chunk.
+        Upload location is kept in <file>.upload, so an interrupted upload is
+        continued from the last offset confirmed by server, even by another
+        process. Return the response and file SHA-256.
+        '''
+        tus_headers = {'Tus-Resumable': '1.0.0'}
+        file_stat = os.stat(file_path)
+        state_path = file_path + '.upload'
+        state = None
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get('size') != file_stat.st_size or state.get('mtime') != file_stat.st_mtime:
+                state = None
+
+        attempt = 0
+        while True:
+            try:
+                if state is None:
+                    name = base64.b64encode(os.path.basename(file_path).encode()).decode()
+                    headers = dict(tus_headers, **{'Upload-Length': str(file_stat.st_size), 'Upload-Metadata': 'filename ' + name, 'Content-Length': '0'})
+                    response, _ = self.send('POST', resumable_path, b'', headers, retries=0)
+                    location = urlsplit(response.getheader('Location'))
+                    state = {'location': location.path[len(self.base_path):], 'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+                    with open(state_path, 'w') as f:
+                        json.dump(state, f)
+
+                response, _ = self.send('HEAD', state['location'], headers=tus_headers)
+                offset = int(response.getheader('Upload-Offset'))
+                stream = uploader.FileStream(file_path, chunk_size, offset)
+                data = b''
+                for chunk in stream:
+                    headers = dict(tus_headers, **{'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream', 'Content-Length': str(len(chunk))})
+                    response, data = self.send('PATCH', state['location'], chunk, headers, retries=0)
+                    offset = int(response.getheader('Upload-Offset', offset + len(chunk)))
+                break
+            except RepkaError as e:
+                # Upload is expired or unknown, start it again
+                if e.status in (404, 410):
+                    state = None
+                error = e
+            except (socket.error, httplib.HTTPException) as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            common.color_print('Upload {} failed: {}. Resume in {} sec'.format(file_path, error, delay), False, 'LYELLOW')
+            time.sleep(delay)
+
+        os.remove(state_path)
+        if data:
+            response = json.loads(data.decode('utf-8'))
         else:
-            out_text += bcolors.OKGRAY
-        out_text += text + bcolors.ENDC
-        print(out_text)
+            response = {'file': state['location'].rstrip('/').split('/')[-1], 'name': os.path.basename(file_path)}
+        return response, stream.hexdigest()
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(username, password):
+    '''Share one session for the same credentials'''
+    with clients_lock:
+        key = (repka_endpoint, username, password)
+        if key not in clients:
+            clients[key] = RepkaClient(username, password)
+        return clients[key]
 
 def get_repo_name(repo):
     p = subprocess.check_output(['git', 'config', '--get', 'remote.origin.url'], cwd=repo)
@@ -90,128 +244,96 @@ def get_repo_name(repo):
     return os.path.splitext(base)[0]
 
 def get_packet_id(packet_name, username, password):
-    url =  repka_endpoint + '/api/packet?repository={}&filter={}'.format(repo_id, packet_name)
-    color_print('Check packet url: ' + url, False, 'OKGRAY')
-    request = urllib2.Request(url)
-
-    add_auth_header(request, username, password) 
-
-    response = urllib2.urlopen(request)
-    packets = json.loads(response.read())
+    path = '/api/packet?repository={}&filter={}'.format(repo_id, packet_name)
+    common.color_print('Check packet url: ' + repka_endpoint + path, False, 'OKGRAY')
+    packets = get_client(username, password).get_json(path)
     for packet in packets:
         if packet['name'] == packet_name: 
             return packet['id']
     return -1
 
 def get_release(packet_id, tag, username, password):
-    url =  repka_endpoint + '/api/release?packet={}'.format(packet_id)
-    color_print('Check release url: ' + url, False, 'OKGRAY')
-    request = urllib2.Request(url)
-    
-    add_auth_header(request, username, password)
-
-    response = urllib2.urlopen(request)
-    releases = json.loads(response.read())
+    path = '/api/release?packet={}'.format(packet_id)
+    common.color_print('Check release url: ' + repka_endpoint + path, False, 'OKGRAY')
+    releases = get_client(username, password).get_json(path)
     if releases is None:
-        color_print('Release ID not found', False, 'LCYAN')
+        common.color_print('Release ID not found', False, 'LCYAN')
         return None
 
     for release in releases:
         if tag in release['tags']: 
-            color_print('Release ID {} found'.format(release['id']), False, 'LCYAN')
+            common.color_print('Release ID {} found'.format(release['id']), False, 'LCYAN')
             return release
 
-    color_print('Release ID not found', False, 'LCYAN')
+    common.color_print('Release ID not found', False, 'LCYAN')
     return None
 
-def upload_file(file_path, username, password):
-    post_url = repka_endpoint + '/api/upload'
-    args = ['curl', '-k', '-u', username + ':' + password, '-F', 
-        'file=@' + file_path, post_url
-    ]
-    load_response = subprocess.check_output(args)
-    response = json.loads(load_response)
+def upload_file(file_path, username, password, resumable=False):
+    client = get_client(username, password)
+    if resumable:
+        response, checksum = client.upload_resumable(file_path)
+    else:
+        response, checksum = client.upload(file_path)
 
-    print(response)
+    common.log('{}'.format(response))
 
     file_uid = response['file']
     file_name = response['name']
-    color_print('Uploaded: {} / {}'.format(file_uid, file_name), True, 'LGREEN')
+    common.color_print('Uploaded: {} / {}, sha256: {}'.format(file_uid, file_name, checksum), True, 'LGREEN')
 
     return file_uid, file_name
 
 def create_release(packet_id, name, description, tag, file_uid, file_name, username, password):
-    url = repka_endpoint + '/api/release'
+    return create_release_files(packet_id, name, description, tag, [(file_uid, file_name)], username, password)
 
-    data = json.dumps({
+def create_release_files(packet_id, name, description, tag, files, username, password):
+    data = {
         "name": name,
         "description": description,
         "tags": [tag, 'latest',],
         "packet": packet_id,
-        "files": [
-            {"upload_name": file_uid, "name": file_name},
-        ]
-    })
-    data = data.encode()
-    clen = len(data)
-
-    request = urllib2.Request(url, data=data, headers={'Content-Type': 'application/json', 'Content-Length': clen})
-    
-    add_auth_header(request, username, password)
+        "files": [{"upload_name": file_uid, "name": file_name} for file_uid, file_name in files]
+    }
 
-    response = urllib2.urlopen(request)
-    release = json.loads(response.read())
+    # Do not retry, the release may be created even if the response is lost
+    release = get_client(username, password).send_json('POST', '/api/release', data, retries=0)
 
-    color_print('Release with ID {} created'.format(release['id']), False, 'LCYAN')
+    common.color_print('Release with ID {} created'.format(release['id']), False, 'LCYAN')
 
     return release['id']
 
-def add_auth_header(request, username, password):
-    if username is not None and password is not None:
-        auth = '{}:{}'.format(username, password)
-        base64string = base64.b64encode(auth.encode())
-        request.add_header('Authorization', 'Basic {}'.format(base64string.decode()))
-
 def update_release(release, file_uid, file_name, username, password):
-    url = repka_endpoint + '/api/release/{}'.format(release['id'])
-    color_print('Update release url: ' + url, False, 'OKGRAY')
+    update_release_files(release, [(file_uid, file_name)], username, password)
+
+def update_release_files(release, files, username, password):
+    path = '/api/release/{}'.format(release['id'])
+    common.color_print('Update release url: ' + repka_endpoint + path, False, 'OKGRAY')
 
-    # Check if file exists
-    is_exists = False
-    if release['files']:
+    if not release['files']:
+        release['files'] = []
+    for file_uid, file_name in files:
+        # Check if file exists
+        is_exists = False
         for file in release['files']:
             if file['name'] == file_name:
                 is_exists = True
                 file['id'] = None
                 file['upload_name'] = file_uid
                 file['name'] = file_name
-    if is_exists == False:
-        file = {
-            'name': file_name,
-            'upload_name': file_uid
-        }
-        if release['files']:
-            release['files'].append(file)
-        else:
-            release = [file]      
-
-    data = json.dumps(release)
-    print(data)
+        if is_exists == False:
+            release['files'].append({
+                'name': file_name,
+                'upload_name': file_uid
+            })
 
-    data = data.encode()
-    clen = len(data)
+    common.log(json.dumps(release))
 
-    request = PutRequest(url, data=data, headers={'Content-Type': 'application/json', 'Content-Length': clen})
-    add_auth_header(request, username, password)
+    release = get_client(username, password).send_json('PUT', path, release)
 
-    response = urllib2.urlopen(request)
-    release = json.loads(response.read())
-
-    color_print('Release updated. {}'.format(release['message']), True, 'LGREEN')
-
-def do_work(repo_path, build_path, login, password):
-    color_print('Repo: ' + repo_path + ', Build dir: ' + build_path, True, 'OKGRAY')
+    common.color_print('Release updated. {}'.format(release['message']), True, 'LGREEN')
 
+def read_build(repo_path, build_path):
+    '''Return packet name, release tag and archive path of the build'''
     with open(os.path.join(build_path, 'version.str')) as f:
         content = f.readlines()
     # you may also want to remove whitespace characters like `\n` at the end of each line
@@ -224,28 +346,123 @@ def do_work(repo_path, build_path, login, password):
         packet_name = str(get_repo_name(repo_path), 'utf-8')
     else:
         packet_name = get_repo_name(repo_path)
+    return packet_name, tag, release_file
+
+class ReleasePublisher:
+    '''
+    Publish many builds at once. Packet IDs and releases are looked up once
+    and cached, archives are uploaded concurrently and every release gets
+    one update with all its new files.
+    '''
+
+    def __init__(self, username, password, jobs=4, resumable=False):
+        self.username = username
+        self.password = password
+        self.jobs = jobs
+        self.resumable = resumable
+        self.client = get_client(username, password)
+        self.lock = threading.Lock()
+        self.packets = {}
+        self.releases = {}
+        self.packet_locks = {}
+
+    def resolve_packets(self, names):
+        names = [name for name in set(names) if name not in self.packets]
+        if len(names) == 1:
+            self.packets[names[0]] = get_packet_id(names[0], self.username, self.password)
+        elif names:
+            path = '/api/packet?repository={}'.format(repo_id)
+            common.color_print('List packets url: ' + repka_endpoint + path, False, 'OKGRAY')
+            for packet in self.client.get_json(path):
+                self.packets[packet['name']] = packet['id']
+            # Listing may be limited by server, ask for the rest one by one
+            for name in names:
+                if name not in self.packets:
+                    self.packets[name] = get_packet_id(name, self.username, self.password)
+        return self.packets
+
+    def get_release(self, packet_id, tag, refresh=False):
+        if refresh or packet_id not in self.releases:
+            path = '/api/release?packet={}'.format(packet_id)
+            common.color_print('Check release url: ' + repka_endpoint + path, False, 'OKGRAY')
+            self.releases[packet_id] = self.client.get_json(path) or []
+        for release in self.releases[packet_id]:
+            if tag in release['tags']:
+                return release
+        return None
 
-# 1. Get packet ID
-    packet_id = get_packet_id(packet_name, login, password)
-    if packet_id == -1:
-        color_print('Packet {} not found in repository'.format(packet_name), True, 'LRED')
-        exit(1)
-
-# 2. Upload file
-    file_uid,file_name = upload_file(release_file, login, password)
-
-# 3. Get release by tag
-    release = get_release(packet_id, tag, login, password)
-
-# 4. If no release - create it, else - update    
-    release_name = tag
-    release_desc = 'Version ' + tag
-    if release is None:
-        # Create new release
-        create_release(packet_id, release_name, release_desc, tag, file_uid, file_name, login, password)
-    else:
-        # Update current release
-        update_release(release, file_uid, file_name, login, password)
+    def get_packet_lock(self, packet_id):
+        with self.lock:
+            return self.packet_locks.setdefault(packet_id, threading.Lock())
+
+    def commit(self, packet_id, tag, files):
+        # Read the release again under lock, other threads may change it
+        with self.get_packet_lock(packet_id):
+            release = self.get_release(packet_id, tag, refresh=True)
+            if release is None:
+                create_release_files(packet_id, tag, 'Version ' + tag, tag, files, self.username, self.password)
+            else:
+                common.color_print('Release ID {} found'.format(release['id']), False, 'LCYAN')
+                update_release_files(release, files, self.username, self.password)
+            self.releases.pop(packet_id, None)
+
+    def publish(self, manifest):
+        '''
+        Publish (repo_path, build_path) pairs. Return list of pairs failed
+        to publish with error messages.
+        '''
+        failed = []
+        builds = []
+        for repo_path, build_path in manifest:
+            common.color_print('Repo: ' + repo_path + ', Build dir: ' + build_path, True, 'OKGRAY')
+            try:
+                builds.append(((repo_path, build_path),) + read_build(repo_path, build_path))
+            except (IOError, OSError, IndexError, subprocess.CalledProcessError) as e:
+                failed.append(((repo_path, build_path), str(e)))
+
+        with self.lock:
+            packets = self.resolve_packets([build[1] for build in builds])
+        ready = []
+        for build in builds:
+            if packets[build[1]] == -1:
+                common.color_print('Packet {} not found in repository'.format(build[1]), True, 'LRED')
+                failed.append((build[0], 'packet {} not found'.format(build[1])))
+            else:
+                ready.append(build)
+
+        def upload(build):
+            try:
+                with common.task(build[1]):
+                    return upload_file(build[3], self.username, self.password, self.resumable)
+            except Exception as e:
+                common.color_print('Upload {} failed: {}'.format(build[3], e), True, 'LRED')
+                failed.append((build[0], str(e)))
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            uploads = list(executor.map(upload, ready))
+
+        groups = {}
+        for build, uploaded in zip(ready, uploads):
+            if uploaded is not None:
+                groups.setdefault((packets[build[1]], build[2]), []).append((build, uploaded))
+        for (packet_id, tag), items in groups.items():
+            try:
+                self.commit(packet_id, tag, [uploaded for _, uploaded in items])
+            except Exception as e:
+                common.color_print('Release {} update failed: {}'.format(tag, e), True, 'LRED')
+                failed.extend((build[0], str(e)) for build, _ in items)
+        return failed
+
+def do_work(repo_path, build_path, login, password, resumable=False):
+    failed = ReleasePublisher(login, password, resumable=resumable).publish([(repo_path, build_path)])
+    if failed:
+        common.exit(1)
+
+def read_manifest(path):
+    '''JSON list of {"repo_path": ..., "build_path": ...} objects'''
+    with open(path) as f:
+        return [(item['repo_path'], item['build_path']) for item in json.load(f)]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='NextGIS Borsch tools. Utility to create or recreate release in repository')
@@ -254,9 +471,18 @@ if __name__ == "__main__":
     parser.add_argument('--password', dest='password', help='repka password')
     parser.add_argument('--repo_path', dest='repo', help='path to repository on disk')
     parser.add_argument('--build_path', dest='build', help='build directory to search version.str and upload zip files')
+    parser.add_argument('--resumable', dest='resumable', action='store_true', default=False, help='upload by chunks with resume support (tus protocol)')
+    parser.add_argument('--manifest', dest='manifest', help='JSON file with a list of repo_path and build_path pairs to publish at once')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=4, help='number of concurrent uploads for --manifest')
 
     args = parser.parse_args()
 
+    if args.manifest:
+        failed = ReleasePublisher(args.login, args.password, args.jobs, args.resumable).publish(read_manifest(args.manifest))
+        for (repo_path, build_path), error in failed:
+            common.color_print('Failed {} [{}]: {}'.format(repo_path, build_path, error), True, 'LRED')
+        common.exit(1 if failed else 0)
+
     if args.repo:
         repo_path = args.repo
         build_path = args.build
@@ -264,4 +490,4 @@ if __name__ == "__main__":
         repo_path = os.getcwd()
         build_path = os.path.join(repo_path, args.build)
 
-    do_work(repo_path, build_path, args.login, args.password)
+    do_work(repo_path, build_path, args.login, args.password, args.resumable)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Package dependency graph and parallel build scheduler
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import os
+import re
+import heapq
+import common
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+modules_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'cmake', 'modules')
+
+# -DWITH_ZLIB=ON and -DWITH_ZLIB_EXTERNAL=ON both point to FindExtZLIB.cmake
+with_arg_re = re.compile(r'^-DWITH_(\w+?)(?:_EXTERNAL)?=(?i:ON|TRUE|YES|1)$')
+repo_re = re.compile(r'^\s*set\s*\(\s*repo\s+[\w.-]+/([\w.-]+)\s*\)', re.MULTILINE)
+find_project_re = re.compile(r'\bfind_(?:ext|any)project\s*\(\s*(\w+)', re.IGNORECASE)
+
+
+def read_ext_modules(path=modules_dir):
+    '''Map lower case FindExt<Name>.cmake names to the repository names'''
+    out = {}
+    if not os.path.exists(path):
+        return out
+    for file_name in os.listdir(path):
+        if not file_name.startswith('FindExt') or not file_name.endswith('.cmake'):
+            continue
+        with open(os.path.join(path, file_name)) as f:
+            match = repo_re.search(f.read())
+        if match:
+            out[file_name[len('FindExt'):-len('.cmake')].lower()] = match.group(1)
+    return out
+
+
+def read_find_projects(repo_dir):
+    '''
+    Lower case names of find_extproject() and find_anyproject() calls in the
+    CMake files of the repository or None if there are no sources
+    '''
+    if not os.path.exists(os.path.join(repo_dir, 'CMakeLists.txt')):
+        return None
+    out = set()
+    for dir_path, dir_names, file_names in os.walk(repo_dir):
+        dir_names[:] = [name for name in dir_names if name not in ('.git', 'inst') and not name.startswith('build')]
+        for file_name in file_names:
+            if file_name != 'CMakeLists.txt' and not file_name.endswith('.cmake'):
+                continue
+            try:
+                with open(os.path.join(dir_path, file_name), errors='replace') as f:
+                    out.update(name.lower() for name in find_project_re.findall(f.read()))
+            except (IOError, OSError):
+                pass
+    return out
+
+
+def get_dependencies(repositories, key='name', ext_modules=None, args_key='args', get_repo_dir=None):
+    '''
+    Return {name: [dependency names]} restricted to the given repositories.
+    Dependencies are taken from -DWITH_<Name>=ON arguments and, if
+    get_repo_dir(name) is given, from find_extproject() calls in the sources.
+    Packages without sources have only the WITH_ edges. Raise ValueError if
+    the edges make a cycle.
+    '''
+    if ext_modules is None:
+        ext_modules = read_ext_modules()
+    names = [repo[key] for repo in repositories]
+    out = {}
+    for repo in repositories:
+        deps = []
+        for arg in repo.get(args_key, []):
+            match = with_arg_re.match(arg)
+            if match is None:
+                continue
+            dep = ext_modules.get(match.group(1).lower())
+            if dep is not None and dep in names and dep != repo[key] and dep not in deps:
+                deps.append(dep)
+        out[repo[key]] = deps
+    if get_repo_dir is None:
+        return out
+
+    for name in names:
+        found = read_find_projects(get_repo_dir(name))
+        for item in sorted(found or []):
+            dep = ext_modules.get(item)
+            if dep is not None and dep in names and dep != name and dep not in out[name]:
+                out[name].append(dep)
+    try:
+        topological_order(names, out)
+    except ValueError as e:
+        raise ValueError('{}. Check find_extproject() calls in their sources'.format(e.args[0]))
+    return out
+
+
+def get_dependents(deps):
+    out = dict((name, []) for name in deps)
+    for name, name_deps in deps.items():
+        for dep in name_deps:
+            out[dep].append(name)
+    return out
+
+
+def topological_order(names, deps):
+    '''Kahn's algorithm. Ties are broken by the position in names.'''
+    index = dict((name, i) for i, name in enumerate(names))
+    dependents = get_dependents(deps)
+    indegree = dict((name, len(deps[name])) for name in names)
+    ready = [index[name] for name in names if indegree[name] == 0]
+    heapq.heapify(ready)
+    out = []
+    while ready:
+        name = names[heapq.heappop(ready)]
+        out.append(name)
+        for dependent in dependents[name]:
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                heapq.heappush(ready, index[dependent])
+    if len(out) != len(names):
+        cycle = [name for name in names if indegree[name] > 0]
+        raise ValueError('Dependency cycle between: ' + ', '.join(cycle))
+    return out
+
+
+def critical_path(names, deps, weights=None):
+    '''Length of the longest chain from each package to the end of the build'''
+    dependents = get_dependents(deps)
+    out = {}
+    for name in reversed(topological_order(names, deps)):
+        weight = 1 if weights is None else weights.get(name, 1)
+        out[name] = weight + max([out[d] for d in dependents[name]] or [0])
+    return out
+
+
+def run_graph(names, deps, worker, max_workers=1, weights=None):
+    '''
+    Call worker(name) for each package once all its dependencies succeeded.
+    Ready packages with the longest critical path start first. After the first
+    failure no new packages are started, the running ones are allowed to finish.
+    Return {name: True/False} for every started package.
+    '''
+    index = dict((name, i) for i, name in enumerate(names))
+    priority = critical_path(names, deps, weights)
+    dependents = get_dependents(deps)
+    indegree = dict((name, len(deps[name])) for name in names)
+    ready = [(-priority[name], index[name], name) for name in names if indegree[name] == 0]
+    heapq.heapify(ready)
+
+    results = {}
+    running = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while True:
+            while ready and not failed and len(running) < max_workers:
+                name = heapq.heappop(ready)[2]
+                running[executor.submit(worker, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result() is not False
+                except Exception as e:
+                    common.color_print('{} failed: {}'.format(name, e), False, 'LRED')
+                    results[name] = False
+                if not results[name]:
+                    failed = True
+                    continue
+                for dependent in dependents[name]:
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        heapq.heappush(ready, (-priority[dependent], index[dependent], dependent))
+    return results
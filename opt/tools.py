@@ -18,100 +18,23 @@ import shutil
 import subprocess
 import sys
 import multiprocessing
-import glob
-import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+import build_trace
 import common
-
-repositories = [
-    {"url" : "borsch", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "googletest", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_boost", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "lib_cgal", "cmake_dir" : "cmake", "build" : ["mac"], "args" : ['-DBUILD_TESTING=OFF', '-DWITH_CPACK=OFF']},
-    {"url" : "lib_xml2", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_z", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_openssl", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DOPENSSL_NO_DYNAMIC_ENGINE=ON']},
-    {"url" : "lib_curl", "cmake_dir" : "CMake", "build" : ["mac", "win"], "args" : ['-DWITH_OpenSSL=ON', '-DWITH_ZLIB=ON', '-DENABLE_THREADED_RESOLVER=ON', '-DCMAKE_USE_GSSAPI=ON', '-DCMAKE_USE_LIBSSH2=OFF']},
-    {"url" : "lib_ecw", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_expat", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DBUILD_tools=ON']},
-    {"url" : "lib_iconv", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_gif", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "lib_qhull", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_freexl", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_geojsonvt", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_geos", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_tiff", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DWITH_ZLIB=ON', '-DWITH_JPEG=ON', '-DWITH_JPEG12=ON', '-DWITH_JBIG=ON', '-DWITH_LibLZMA=ON']},
-    {"url" : "lib_geotiff", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DWITH_ZLIB=ON', '-DWITH_JPEG=ON']},
-    {"url" : "lib_jpeg", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_szip", "cmake_dir" : "cmake", "build" : ["mac"], "args" : ['-DBUILD_TESTS=OFF']},
-    {"url" : "lib_hdf4", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DWITH_SZIP=ON']},
-    {"url" : "lib_hdfeos2", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_jbig", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_jpegturbo", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_jsonc", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_lzma", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_mrsid", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_nunicode", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_opencad", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_png", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_pq", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_sqlite", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_proj", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_gsl", "cmake_dir" : "cmake", "build" : ["mac","win"], "args" : ['-DBUILD_TESTS=OFF']},
-    {"url" : "lib_openjpeg", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_gdal", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DWITH_EXPAT=ON', '-DWITH_GeoTIFF=ON', '-DWITH_ICONV=ON', '-DWITH_JSONC=ON', '-DWITH_LibXml2=ON', '-DWITH_TIFF=ON', '-DWITH_ZLIB=ON', '-DWITH_JBIG=ON', '-DWITH_JPEG=ON', '-DWITH_JPEG12=ON', '-DWITH_LibLZMA=ON', '-DWITH_PYTHON=ON', '-DWITH_PYTHON3=OFF', '-DWITH_PNG=ON', '-DWITH_OpenSSL=ON', '-DENABLE_OZI=ON', '-DENABLE_NITF_RPFTOC_ECRGTOC=ON', '-DGDAL_ENABLE_GNM=ON', '-DWITH_SQLite3=ON', '-DWITH_PostgreSQL=ON', '-DGDAL_BUILD_APPS=ON', '-DENABLE_OPENJPEG=ON', '-DWITH_OpenJPEG=ON', '-DENABLE_HDF4=ON', '-DWITH_QHULL=ON']},
-    {"url" : "lib_rapidjson", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_spatialindex", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DBUILD_TESTS=OFF']},
-    {"url" : "lib_spatialite", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DOMIT_FREEXL=ON', '-DENABLE_LWGEOM=OFF', '-DGEOS_TRUNK=ON']},
-    {"url" : "lib_qt4", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_qt5", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_qca", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DBUILD_TESTS=OFF']},
-    {"url" : "lib_qwt", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DQT4_BUILD=ON', '-DWITH_QWTMATHML=OFF', '-DWITH_QWTDESIGNER=OFF', '-DWITH_QWTPLAYGROUND=OFF', '-DWITH_QWTEXAMPLES=OFF']},
-    {"url" : "lib_uv", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_variant", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    {"url" : "lib_zip", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_yaml", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_freetype", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "lib_opencv", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "lib_agg", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "lib_minichromium", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_crashpad", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_sentrynative", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_qtkeychain", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_xslt", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "lib_exiv", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "python", "cmake_dir" : "cmake", "build" : ["win"], "args" : ["-DPYTHON_VERSION=2.7.12", "-DBUILD_LIBPYTHON_SHARED=ON"]},
-    {"url" : "py_setuptools", "cmake_dir" : "cmake", "build" : ["win"], "args" : []},
-    {"url" : "py_future", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_raven", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_contextlib", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "numpy", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_sip", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_qt4", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "lib_qscintilla", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : ['-DQT4_BUILD=ON', '-DWITH_BINDINGS=ON']},
-    {"url" : "py_psycopg", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_dateutil", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_pygments", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_ows", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_httplib", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_yaml", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_jinja", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_markupsafe", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_nose", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_pytz", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_six", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_requests", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_spatialite", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_exifread", "cmake_dir" : "cmake", "build" : ["mac", "win"], "args" : []},
-    {"url" : "py_matplotlib", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_parsing", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_cycler", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_subprocess32", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_functools_lru_cache", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "py_kiwisolver", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "postgis", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-    {"url" : "tests", "cmake_dir" : "cmake", "build" : [], "args" : []},
-    # {"url" : "qgis", "cmake_dir" : "cmake", "build" : ["mac"], "args" : []},
-]
+import compare
+import compiler_cache
+import mappings
+import fingerprint
+import installer
+import jobserver
+import registry
+import scheduler
+import uploader
+
+# Sources are cloned next to borsch, the tools run from borsch/opt
+package_registry = registry.load(get_repo_dir=lambda name: os.path.join(os.getcwd(), os.pardir, os.pardir, name))
+repositories = package_registry.packages
 
 args = {}
 organize_file = 'folders.csv'
@@ -136,13 +59,23 @@ def parse_arguments():
     parser_git.add_argument('--status', dest='status', action='store_true', help='print status of repositories')
     parser_git.add_argument('--push', dest='push', action='store_true', help='send changes to server')
     parser_git.add_argument('--commit', dest='message', help='commit changes in repositories')
+    parser_git.add_argument('--jobs', dest='jobs', type=int, default=8, help='number of repositories processed at the same time')
+    parser_git.add_argument('--remote', dest='remote', default=None, help='clone url prefix, default is nextgis-borsch on github')
 
     parser_make = subparsers.add_parser('make')
     parser_make.add_argument('--generator', dest='generator_name', default=None, help='specify a build system generator')
     parser_make.add_argument('--toolset', dest='toolset_name', default=None, help='specify a toolset name if supported by generator')
     parser_make.add_argument('--only', dest='only_repos', default=None, help='the names of the packages separated by comma')
+    parser_make.add_argument('--with-deps', dest='with_deps', action='store_true', default=False, help='add packages the --only ones depend on')
+    parser_make.add_argument('--with-dependents', dest='with_dependents', action='store_true', default=False, help='add packages which depend on the --only ones')
     parser_make.add_argument('--versions', dest='versions', action='store_true', help='print libraries version')
     parser_make.add_argument('--clean', dest='clean', action='store_true', default=False, help='clean packages')
+    parser_make.add_argument('--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(), help='total build jobs budget shared by all packages')
+    parser_make.add_argument('--jobserver', dest='jobserver', choices=jobserver.styles, default='auto', help='jobserver type: fifo (make 4.4+, ninja 1.13+), pipe (older make) or auto')
+    parser_make.add_argument('--parallel', dest='parallel', type=int, default=1, help='maximum number of packages built at the same time')
+    parser_make.add_argument('--force', dest='force', action='store_true', default=False, help='rebuild packages even if sources and arguments did not change')
+    compiler_cache.add_arguments(parser_make)
+    parser_make.add_argument('--trace', dest='trace', default=None, help='write steps timing and resource usage to <trace>.jsonl and <trace>.json (Chrome trace format)')
 
     parser_organize = subparsers.add_parser('organize')
     parser_organize.add_argument('--list', dest='list', action='store_true', default=False, help='output copied file names')
@@ -151,9 +84,17 @@ def parse_arguments():
     parser_organize.add_argument('--src', dest='src', required=True, help='original sources folder')
     parser_organize.add_argument('--dst_name', dest='dst_name', required=False, help='destination folder name')
     parser_organize.add_argument('--dst_path', dest='dst_path', required=False, help='Specify destination folder path')
+    parser_organize.add_argument('--jobs', dest='jobs', type=int, default=None, help='parallel copy and compare threads')
+    parser_organize.add_argument('--validate', dest='validate', action='store_true', default=False, help='report overlapping and dead rows of the organize file')
+    parser_organize.add_argument('--hash_cache', dest='hash_cache', default=None, help='file to keep content hashes between --compare runs')
 
     parser_install_all = subparsers.add_parser('install_all')
     parser_install_all.add_argument(dest='install_dst', default=None, help='the names of the packages separated by comma')
+    parser_install_all.add_argument('--link', dest='link', choices=installer.link_modes, default='auto', help='how to put files: auto tries reflink and falls back to copy, hardlink shares files with inst folders')
+    parser_install_all.add_argument('--jobs', dest='jobs', type=int, default=None, help='parallel copy threads')
+    parser_install_all.add_argument('--packages', dest='packages', default=None, help='install or upgrade only these packages separated by comma')
+    parser_install_all.add_argument('--uninstall', dest='uninstall', default=None, help='remove files of these packages separated by comma')
+    parser_install_all.add_argument('--strict', dest='strict', action='store_true', default=False, help='do not install anything if packages ship different files with the same path')
 
     parser_update = subparsers.add_parser('update')
     parser_update.add_argument('--script', dest='script', required=True, help='the name of updated script')
@@ -161,94 +102,98 @@ def parse_arguments():
     args = parser.parse_args()
 
 
-def run(args):
+def run(args, cwd=None, log=None, env=None, pass_fds=()):
     # print 'calling ' + string.join(args)
+    if log is None:
+        common.flush()
     try:
-        if args[0] == "git":
-            output = subprocess.check_output(args, stderr=subprocess.STDOUT)
-            if 'nothing to commit' in output or 'Already up-to-date' in output or 'Everything up-to-date' in output:
-                return True
-            else:
-                print(output)
-                return True
-        else:
-            output_code = subprocess.call(args, stderr=subprocess.STDOUT)
-            return output_code == 0
-    except:
+        output_code = build_trace.call(args, cwd=cwd, stdout=log, env=env, pass_fds=pass_fds)
+    except OSError:
         return False
+    return output_code == 0
 
-def git_clone():
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    for repository in repositories:
-        common.color_print('clone ' + repository['url'], True, 'LCYAN')
+git_quiet_messages = ('nothing to commit', 'Already up-to-date', 'Already up to date', 'Everything up-to-date')
+
+
+def run_git(args, cwd):
+    try:
+        p = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        output = p.communicate()[0]
+    except OSError as e:
+        return False, str(e)
+    if any(message in output for message in git_quiet_messages):
+        return True, ''
+    return p.returncode == 0, output.strip()
+
+
+def git_foreach(title, color, get_args, jobs, in_repo=True):
+    repo_root = os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir))
+
+    def worker(repository):
+        repo_dir = os.path.join(repo_root, repository['name'])
+        if in_repo and not os.path.exists(repo_dir):
+            result, output = False, repo_dir + ' not exists'
+        else:
+            result, output = run_git(get_args(repository), repo_dir if in_repo else repo_root)
+        # Print the whole repository output at once
+        with common.task(None, buffered=True):
+            common.color_print(title + ' ' + repository['name'], True, color)
+            if output:
+                common.log(output)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(worker, repositories))
+
+    name_width = max([len(repository['name']) for repository in repositories] + [10])
+    common.color_print('{} summary:'.format(title), True, color)
+    for repository, result in zip(repositories, results):
+        if result:
+            common.color_print(repository['name'].ljust(name_width) + ' OK', False, 'LGREEN')
+        else:
+            common.color_print(repository['name'].ljust(name_width) + ' FAILED', False, 'LRED')
+    common.color_print('Total: {}, succeeded: {}, failed: {}'.format(len(results), results.count(True), results.count(False)), True, color)
+    return all(results)
+
+
+def git_clone(jobs, remote=None):
+    if remote is None:
         if sys.platform == 'win32':
-            run(('git', 'clone', '--depth', '1', 'https://github.com/nextgis-borsch/' + repository['url'] + '.git'))
+            remote = 'https://github.com/nextgis-borsch/'
         else:
-            run(('git', 'clone', '--depth', '1', 'git@github.com:nextgis-borsch/' + repository['url'] + '.git'))
+            remote = 'git@github.com:nextgis-borsch/'
+    return git_foreach('clone', 'LCYAN', lambda repository: ('git', 'clone', '--depth', '1', remote + repository['name'] + '.git'), jobs, False)
 
 
-def git_status():
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    for repository in repositories:
-        common.color_print('status ' + repository['url'], True, 'LGREEN')
-        try:
-            os.chdir(repository['url'])
-            run(('git', 'status'))
-            os.chdir(os.path.join(os.getcwd(), os.pardir))
-        except:
-            pass
+def git_status(jobs):
+    return git_foreach('status', 'LGREEN', lambda repository: ('git', 'status'), jobs)
 
 
-def git_pull():
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    for repository in repositories:
-        common.color_print('pull ' + repository['url'], True, 'LYELLOW')
-        try:
-            os.chdir(repository['url'])
-            run(('git', 'pull'))
-            os.chdir(os.path.join(os.getcwd(), os.pardir))
-        except:
-            pass
+def git_pull(jobs):
+    return git_foreach('pull', 'LYELLOW', lambda repository: ('git', 'pull'), jobs)
 
 
-def git_push():
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    for repository in repositories:
-        common.color_print('push ' + repository['url'], True, 'LCYAN')
-        try:
-            os.chdir(repository['url'])
-            run(('git', 'push'))
-            os.chdir(os.path.join(os.getcwd(), os.pardir))
-        except:
-            pass
+def git_push(jobs):
+    return git_foreach('push', 'LCYAN', lambda repository: ('git', 'push'), jobs)
 
 
-def git_commit(message):
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    for repository in repositories:
-        common.color_print('commit to ' + repository['url'] + ' with message: ' + message, True, 'LCYAN')
-        try:
-            os.chdir(repository['url'])
-            if run(('git', 'commit', '-a', '-m', message)):
-                common.color_print('All is OK', True, 'LMAGENTA')
-            os.chdir(os.path.join(os.getcwd(), os.pardir))
-        except:
-            pass
+def git_commit(message, jobs):
+    return git_foreach('commit with message: ' + message + ' to', 'LCYAN', lambda repository: ('git', 'commit', '-a', '-m', message), jobs)
 
 
 def make_versions():
     os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
     root_dir = os.getcwd()
     for repository in repositories:
-        repo_build_dir = os.path.join(root_dir, repository['url'], 'build')
+        repo_build_dir = os.path.join(root_dir, repository['name'], 'build')
         version_file_path = os.path.join(repo_build_dir, 'version.str')
         if not os.path.exists(version_file_path):
-            common.color_print(repository['url'] + ' - unknown', False, 'LRED')
+            common.color_print(repository['name'] + ' - unknown', False, 'LRED')
         else:
             with open(version_file_path) as f:
                 content = f.readlines()
                 version_str = content[0].rstrip()
-                common.color_print(repository['url'] + ' - ' + version_str, False, 'LGREEN')
+                common.color_print(repository['name'] + ' - ' + version_str, False, 'LGREEN')
 
 
 def update_scripts(script):
@@ -257,10 +202,10 @@ def update_scripts(script):
     script_path = os.path.join(repo_root, 'borsch', 'cmake', script)
 
     for repository in repositories:
-        common.color_print('update ' + repository['url'], False, 'LYELLOW')
-        if repository['url'] == 'borsch':
+        common.color_print('update ' + repository['name'], False, 'LYELLOW')
+        if repository['name'] == 'borsch':
             continue
-        repo_cmake_path = os.path.join(repo_root, repository['url'], repository['cmake_dir'], script)
+        repo_cmake_path = os.path.join(repo_root, repository['name'], repository['cmake_dir'], script)
         if os.path.exists(repo_cmake_path):
             shutil.copyfile(script_path, repo_cmake_path)
             common.color_print('OK', True, 'LCYAN')
@@ -277,74 +222,150 @@ def get_os():
     return result
 
 
-def make_package(repositories, generator, toolset):
-    os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
-    repo_root = os.getcwd()
-
-    for repository in repositories:
-        run_args = ['cmake']
-        run_args.append('-DSUPPRESS_VERBOSE_OUTPUT=ON')
-        run_args.append('-DCMAKE_BUILD_TYPE=Release')
-        run_args.append('-DSKIP_DEFAULTS=ON')
-        build_args = ''
-        if sys.platform == 'darwin':
-            run_args.append('-DOSX_FRAMEWORK=ON')
-            run_args.append('-DREGISTER_PACKAGE=ON')
-            run_args.append('-DCMAKE_OSX_SYSROOT=' + mac_os_sdks_path + '/MacOSX.sdk')
-            run_args.append('-DCMAKE_OSX_DEPLOYMENT_TARGET=' + max_os_min_version)
-            build_args = '-j' + str(multiprocessing.cpu_count())
-        elif sys.platform == 'win32':
-            if generator is not None:
-                run_args.append('-G')
-                run_args.append(generator)
-                if toolset is not None:
-                    run_args.append('-T')
-                    run_args.append(toolset)
-            run_args.append('-DREGISTER_PACKAGE=ON')
-            run_args.append('-DBUILD_SHARED_LIBS=TRUE')
-            build_args = '/m:' + str(multiprocessing.cpu_count())
+def get_make_args(generator, toolset, jobs):
+    '''Return cmake configure and native build tool arguments. Build jobs come from the jobserver except on Windows.'''
+    run_args = ['cmake']
+    run_args.append('-DSUPPRESS_VERBOSE_OUTPUT=ON')
+    run_args.append('-DCMAKE_BUILD_TYPE=Release')
+    run_args.append('-DSKIP_DEFAULTS=ON')
+    build_args = []
+    if sys.platform == 'darwin':
+        run_args.append('-DOSX_FRAMEWORK=ON')
+        run_args.append('-DREGISTER_PACKAGE=ON')
+        run_args.append('-DCMAKE_OSX_SYSROOT=' + mac_os_sdks_path + '/MacOSX.sdk')
+        run_args.append('-DCMAKE_OSX_DEPLOYMENT_TARGET=' + max_os_min_version)
+    elif sys.platform == 'win32':
+        if generator is not None:
+            run_args.append('-G')
+            run_args.append(generator)
+            if toolset is not None:
+                run_args.append('-T')
+                run_args.append(toolset)
+        run_args.append('-DREGISTER_PACKAGE=ON')
+        run_args.append('-DBUILD_SHARED_LIBS=TRUE')
+        build_args = ['/m:' + str(jobs)]
+    return run_args, build_args
+
+
+def make_repository(repository, repo_root, run_args, build_args, use_log, cache=None, server=None):
+    common.color_print('make ' + repository['name'], True, 'LRED')
+    repo_dir = os.path.join(repo_root, repository['name'])
+    repo_build_dir = os.path.join(repo_dir, 'build')
+    repo_inst_dir = os.path.join(repo_dir, install_dir)
+    run_args = run_args + ['-DCMAKE_INSTALL_PREFIX=' + repo_inst_dir] + compiler_cache.launcher_args(cache)
+    if not os.path.exists(repo_build_dir):
+        os.makedirs(repo_build_dir)
+    if not os.path.exists(repo_inst_dir):
+        os.makedirs(repo_inst_dir)
+    run_args.extend(repository['args'])
+    run_args.append('..')
+
+    def build(build_dir, run_args, log, env):
+        common.color_print('configure ' + repository['name'], False, 'LBLUE')
+        if not run(run_args, cwd=build_dir, log=log, env=env):
+            common.color_print('Configure %s error!' % repository['name'], True, 'LRED')
+            return False
+        common.color_print('build ' + repository['name'], False, 'LBLUE')
+        build_command = ['cmake', '--build', '.', '--config', 'release']
+        if build_args:
+            build_command += ['--'] + build_args
+        # Only the build gets the jobserver, makes of try_compile and install would not inherit the pipe
+        make_env = server.environ(env) if server is not None else env
+        pass_fds = server.pass_fds if server is not None else ()
+        if not run(build_command, cwd=build_dir, log=log, env=make_env, pass_fds=pass_fds):
+            common.color_print('Build %s error!' % repository['name'], True, 'LRED')
+            return False
+        common.color_print('install ' + repository['name'], False, 'LBLUE')
+        run(('cmake', '--build', '.', '--config', 'release', '--target', 'install'), cwd=build_dir, log=log, env=env)
+        return True
+
+    def build_logged(build_dir, run_args, name):
+        env, state = cache.begin(get_os(), build_dir) if cache is not None else (None, None)
+        # Concurrent builds write to own log files to keep the console readable
+        if not use_log:
+            result = build(build_dir, run_args, None, env)
+        else:
+            log_path = os.path.join(build_dir, 'make.log')
+            with open(log_path, 'w') as log:
+                result = build(build_dir, run_args, log, env)
+            if not result:
+                common.color_print('See log ' + log_path, False, 'LRED')
+        if cache is not None:
+            cache.end(name, get_os(), env, state)
+        return result
+
+    if not build_logged(repo_build_dir, run_args, repository['name']):
+        return False
 
-        check_os = get_os()
-        if check_os in repository['build']:
-            common.color_print('make ' + repository['url'], True, 'LRED')
-            repo_dir = os.path.join(repo_root, repository['url'])
-            repo_build_dir = os.path.join(repo_dir, 'build')
-            repo_inst_dir = os.path.join(repo_dir, install_dir)
-            run_args.append('-DCMAKE_INSTALL_PREFIX=' + repo_inst_dir)
-            if not os.path.exists(repo_build_dir):
-                os.makedirs(repo_build_dir)
-            if not os.path.exists(repo_inst_dir):
-                os.makedirs(repo_inst_dir)
-            os.chdir(repo_build_dir)
-            for repo_build_arg in repository['args']:
-                run_args.append(repo_build_arg)
-            run_args.append('..')
-            common.color_print('configure ' + repository['url'], False, 'LBLUE')
-            if run((run_args)):
-                common.color_print('build ' + repository['url'], False, 'LBLUE')
-                if run(('cmake', '--build', '.', '--config', 'release', '--', build_args)):
-                    common.color_print('install ' + repository['url'], False, 'LBLUE')
-                    run(('cmake', '--build', '.', '--config', 'release', '--target', 'install'))
-                else:
-                    sys.exit("Build %s error!" % repository['url'])
-            else:
-                sys.exit("Configure %s error!" % repository['url'])
-            # Special case to build JPEG12 package
-            if  repository['url'] == 'lib_jpeg':
-                common.color_print('Special case for ' + repository['url'] + '12', False, 'LBLUE')
-                common.color_print('make ' + repository['url'] + '12', True, 'LRED')
-                repo_build_dir = os.path.join(repo_dir, 'build12')
-                if not os.path.exists(repo_build_dir):
-                    os.makedirs(repo_build_dir)
-                run_args.insert(4, '-DBUILD_JPEG_12=ON')
-                if not os.path.exists(repo_build_dir):
-                    os.makedirs(repo_build_dir)
-                os.chdir(repo_build_dir)
-                if run((run_args)):
-                    if run(('cmake', '--build', '.', '--config', 'release', '--', build_args)):
-                        run(('cmake', '--build', '.', '--config', 'release', '--target', 'install'))
+    # Special case to build JPEG12 package
+    if  repository['name'] == 'lib_jpeg':
+        common.color_print('Special case for ' + repository['name'] + '12', False, 'LBLUE')
+        common.color_print('make ' + repository['name'] + '12', True, 'LRED')
+        repo_build_dir = os.path.join(repo_dir, 'build12')
+        if not os.path.exists(repo_build_dir):
+            os.makedirs(repo_build_dir)
+        run_args.insert(4, '-DBUILD_JPEG_12=ON')
+        build_logged(repo_build_dir, run_args, repository['name'] + '12')
+    return True
+
+
+def make_package(repositories, generator, toolset, jobs=None, parallel=1, force=False, cache=None, jobserver_style='auto'):
+    repo_root = os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir))
+    check_os = get_os()
+    repositories = [repo for repo in repositories if check_os in repo['build']]
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    parallel = max(1, min(parallel, jobs))
+    # Builds share the jobs budget through the jobserver, MSBuild gets an equal share
+    run_args, build_args = get_make_args(generator, toolset, max(1, jobs // parallel))
+    server = jobserver.create(jobs, jobserver_style)
+
+    names = [repo['name'] for repo in repositories]
+    by_name = dict((repo['name'], repo) for repo in repositories)
+    all_deps = package_registry.dependencies(check_os)[0]
+    deps = dict((name, [dep for dep in all_deps[name] if dep in by_name]) for name in names)
+
+    store = fingerprint.FingerprintStore(os.path.join(repo_root, fingerprint.store_name))
+    # Fingerprints of the whole graph do not change with the selection
+    built_deps = {}
+    fingerprints = fingerprint.get_fingerprints(
+        [repo['name'] for repo in package_registry.get_packages(check_os)],
+        all_deps,
+        lambda name: os.path.join(repo_root, name),
+        lambda name: run_args + package_registry.get(name)['args'],
+        lambda name: store.get(name + ':' + check_os), selected=set(names), used=built_deps)
+
+    def worker(name):
+        key = name + ':' + check_os
+        if not force and os.path.exists(os.path.join(repo_root, name, 'build')) and store.is_actual(key, fingerprints[name]):
+            common.color_print('skip ' + name + ' (up to date)', False, 'LGREEN')
+            return True
+        changed = store.changed_deps(key, built_deps[name])
+        if changed:
+            common.log('Rebuild {}, dependencies are built again: {}'.format(name, ', '.join(changed)))
+        with common.task(name), build_trace.task(name, os=check_os), jobserver.hold(server):
+            result = make_repository(by_name[name], repo_root, run_args, build_args, parallel > 1, cache, server)
+        if not result:
+            store.set(key, None)
+            return False
+        store.set(key, fingerprints[name], built_deps[name])
+        return True
 
-        os.chdir(repo_root)
+    try:
+        results = scheduler.run_graph(names, deps, worker, parallel)
+    finally:
+        if server is not None:
+            server.close()
+    if cache is not None:
+        cache.report()
+    failed = [name for name in names if results.get(name) is False]
+    skipped = [name for name in names if name not in results]
+    if failed:
+        common.color_print('Failed: ' + ', '.join(failed), True, 'LRED')
+    if skipped:
+        common.color_print('Not built: ' + ', '.join(skipped), False, 'LYELLOW')
+    return not failed and not skipped
 
 
 def clean_all(repositories):
@@ -355,8 +376,8 @@ def clean_all(repositories):
         check_os = get_os()
 
         if check_os in repository['build']:
-            common.color_print('remove build for ' + repository['url'], True, 'LRED')
-            repo_dir = os.path.join(repo_root, repository['url'])
+            common.color_print('remove build for ' + repository['name'], True, 'LRED')
+            repo_dir = os.path.join(repo_root, repository['name'])
             repo_build_dir = os.path.join(repo_dir, 'build')
 
             shutil.rmtree(repo_build_dir)
@@ -364,59 +385,51 @@ def clean_all(repositories):
         os.chdir(repo_root)
 
 
-def read_mappings(csv_path):
-    fieldnames_data = ('old','new','action','ext2keep')
-    f_csv = open(csv_path)
-    csvreader = csv.DictReader(f_csv, fieldnames=fieldnames_data)
+def plan_dir(src, dest, mapping, plan):
+    '''
+    Add files of src (not recursive) selected by the mapping to plan as
+    {dest file: (src file, size)}. Rows processed later overwrite the same
+    destination file.
+    '''
+    with os.scandir(src) as it:
+        for entry in it:
+            # Hidden files are not matched by glob in the old organizer
+            if entry.name.startswith('.') or entry.is_dir():
+                continue
+            if mapping.match(entry.name):
+                plan[os.path.join(dest, entry.name)] = (entry.path, entry.stat().st_size)
 
-    return csvreader
 
+def copy_files(plan, jobs=None):
+    '''Copy planned files on a thread pool. Return (copied count, bytes, errors).'''
+    errors = []
 
-def copy_dir(src, dest, exts, fake=False):
-    global list_patches
-    def run_shell(cargs):
-        p = subprocess.Popen(cargs, shell=False, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        p.communicate()
-        return p
-    def copy_file(f_name, dest_name):
-        if not fake:
-            shutil.copy(f_name, dest_name)
-        else:
-            f_ext = os.path.splitext(f_name)[1]
-            if '*' in list_extensions or f_ext in list_extensions:
-                result_compare = True
-                if args.compare:
-                    # result = subprocess.run(diff_command, shell=True, capture_output=True, text=True)
-                    dst_f_name = f'{dest_name}/{os.path.basename(f_name)}'
-                    result = run_shell(("diff", "-q", f_name, dst_f_name))
-                    if result.returncode == 0:
-                        result_compare = False
-
-                if result_compare:
-                    # out_stream = sys.stdout
-                    # io.TextIOWrapper.write(out_stream, f"{f_name.replace(args.src+'/', '')}\n")
-                    list_patches.add(f_name)
-
-    if not os.path.exists(dest):
-        os.makedirs(dest)
-
-    # if src == '/home/user/develop/qgis/images/themes/default/algorithms' :
-    #     print('/home/user/develop/qgis/images/themes/default/algorithms')
-
-    files = glob.glob(src + "/*")
-    for f in files:
-        if not os.path.isdir(f):
-            file_name = os.path.basename(f)
-
-            # if file_name == 'mAlgorithmOffsetLines.svg' :
-            #     print('mAlgorithmOffsetLines.svg')
-
-            if '*' in exts or file_name in exts: # Check file name or if * mask
-                copy_file(f, dest)
-            else:
-                file_extension = os.path.splitext(f)[1].replace('.','') # Check extension
-                if file_extension != '' and file_extension in exts:
-                    copy_file(f, dest)
+    def copy_file(item):
+        dest_name, (src_name, size) = item
+        try:
+            shutil.copy(src_name, dest_name)
+            return size
+        except (IOError, OSError) as e:
+            errors.append('{}: {}'.format(src_name, e))
+            return None
+
+    copied = 0
+    copied_size = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for size in executor.map(copy_file, plan.items()):
+            if size is not None:
+                copied += 1
+                copied_size += size
+    return copied, copied_size, errors
+
+
+def list_changed(plan, exts, compare_files=False, jobs=None, hash_cache=None):
+    candidates = [(src_name, dest_name) for dest_name, (src_name, _) in plan.items()
+                  if '*' in exts or os.path.splitext(src_name)[1] in exts]
+    if compare_files:
+        cache = compare.HashCache(hash_cache) if hash_cache else None
+        candidates = compare.compare_files(candidates, jobs, cache)
+    return set(src_name for src_name, _ in candidates)
 
 
 def organize_sources(dst_name, dst_path=None):
@@ -429,47 +442,40 @@ def organize_sources(dst_name, dst_path=None):
         dst_path = os.path.join(repo_root, dst_name)
 
     if not os.path.exists(dst_path):
-        exit('Destination path ' + dst_path + ' not exists')
+        common.exit('Destination path ' + dst_path + ' not exists')
     organize_file_path = os.path.join(dst_path, 'opt', organize_file)
     if not os.path.exists(organize_file_path):
-        exit('Organize file ' + organize_file_path + ' not exists')
+        common.exit('Organize file ' + organize_file_path + ' not exists')
 
     sources_dir = args.src
     if not os.path.exists(sources_dir):
-        exit('Source path ' + sources_dir + ' not exists')
-
-    mappings = read_mappings(organize_file_path)
+        common.exit('Source path ' + sources_dir + ' not exists')
+
+    mappings_list = mappings.load(organize_file_path)
+    if args.validate:
+        problems = mappings.validate(mappings_list, sources_dir)
+        for line, message in problems:
+            common.color_print('{}:{}: {}'.format(organize_file, line, message), False, 'LYELLOW')
+        common.color_print('{} problems in {} rows'.format(len(problems), len(mappings_list)), True, 'LRED' if problems else 'LGREEN')
+        return
 
     list_extensions = args.list_exts.split(';')
+    plan = {}
+    dest_dirs = []
+    start = time.time()
+
+    for mapping in mappings_list:
+        action = mapping.action
 
-    for row in mappings:
-        action = row['action']
-        exts = row['ext2keep']
-        if exts is not None:
-            exts = exts.split(',')
-
-        # Process name with [a-c]
-        append_values = []
-        for i, val in enumerate(exts):
-            beg = val.find('[')
-            end = val.find(']')
-            if beg != -1 and end != -1:
-                name_range = val[beg + 1:end]
-                range_values = name_range.split('-')
-                for i in range(int(range_values[0]), int(range_values[1])):
-                    append_values.append(val[:beg] + str(i) + val[end + 1:])
-
-        exts.extend(append_values)
-
-        if row['old'] is None or row['old'] == '':
+        if mapping.old == '':
             from_folder = sources_dir
         else:
-            from_folder = os.path.join(sources_dir, row['old'])
+            from_folder = os.path.join(sources_dir, mapping.old)
 
-        if row['new'] is None or row['new'] == '':
+        if mapping.new == '':
             to_folder = dst_path
         else:
-            to_folder = os.path.join(dst_path, row['new'])
+            to_folder = os.path.join(dst_path, mapping.new)
 
         if os.path.exists(from_folder):
             if action == 'skip':
@@ -477,19 +483,32 @@ def organize_sources(dst_name, dst_path=None):
                     common.color_print(from_folder + f'... {action}', False, 'LBLUE' )
                 continue
             else:
-                copy_dir(from_folder, to_folder, exts, args.list)
+                dest_dirs.append(to_folder)
+                plan_dir(from_folder, to_folder, mapping, plan)
                 if not args.list:
                     common.color_print(from_folder + ' ... processed', False, 'LYELLOW' )
         else:
            common.color_print(from_folder + f'... {action}' + ' not exist!', False, 'LRED' )
 
     if args.list:
-        list_patches = sorted(list_patches)
+        list_patches = sorted(list_changed(plan, list_extensions, args.compare, args.jobs, args.hash_cache))
         out_stream = sys.stdout
         for f_path in list_patches:
             io.TextIOWrapper.write(out_stream, f"{f_path.replace(args.src+'/', '')}\n")
         return
 
+    for to_folder in dest_dirs:
+        if not os.path.exists(to_folder):
+            os.makedirs(to_folder)
+    copied, copied_size, errors = copy_files(plan, args.jobs)
+    for error in errors:
+        common.color_print(error, False, 'LRED')
+    elapsed = max(time.time() - start, 0.001)
+    common.color_print('Copied {} files, {} in {:.1f} sec ({:.0f} files/s, {}/s)'.format(copied,
+        uploader.format_size(copied_size), elapsed, copied / elapsed, uploader.format_size(copied_size / elapsed)), True, 'LGREEN')
+    if errors:
+        common.exit('Organize failed')
+
     #DEBUG
     return
 
@@ -499,64 +518,93 @@ def organize_sources(dst_name, dst_path=None):
         run((sys.executable, 'postprocess.py', sources_dir))
 
 
-def install_all(install_dst):
+def install_all(install_dst, mode='auto', jobs=None, only=None, uninstall=None, strict=False):
     os.chdir(os.path.join(os.getcwd(), os.pardir, os.pardir))
     repo_root = os.getcwd()
 
     if not os.path.exists(install_dst):
         os.mkdir(install_dst)
 
-    def copytree(src, dst):
-        if not os.path.exists(dst):
-            os.makedirs(dst)
-        for item in os.listdir(src):
-            s = os.path.join(src, item)
-            d = os.path.join(dst, item)
-            if os.path.isdir(s):
-                copytree(s, d)
-            else:
-                if not os.path.exists(d) or os.stat(s).st_mtime - os.stat(d).st_mtime > 1:
-                    try:
-                        shutil.copy2(s, d)
-                    except:
-                        print("Error with copy " + s)
-
-    for f in os.listdir('.'):
+    engine = installer.Installer(install_dst, mode, jobs)
+    if uninstall is not None:
+        result = engine.uninstall(uninstall)
+        for error in engine.errors:
+            common.color_print(error, False, 'LRED')
+        common.color_print('Removed {} files of {}'.format(engine.removed, ', '.join(uninstall)), True, 'LGREEN')
+        engine.close()
+        return result
+
+    packages = []
+    for f in sorted(os.listdir('.')):
+        if only is not None and f not in only:
+            continue
         for_copy = os.path.join(repo_root, f, "inst")
-        print('Copy {}'.format(for_copy))
-        if os.path.exists(for_copy):
-            copytree(for_copy, install_dst)
+        if os.path.isdir(for_copy):
+            common.log('Copy {}'.format(for_copy))
+            packages.append((f, for_copy))
+
+    start = time.time()
+    result = engine.install(packages, strict)
+    for path, owners in engine.conflicts:
+        common.color_print('Conflict {}: {}'.format(path, ', '.join(owners)), False, 'LRED' if strict else 'LYELLOW')
+    if engine.conflicts and strict:
+        common.color_print('{} conflicts, nothing is installed'.format(len(engine.conflicts)), True, 'LRED')
+        engine.close()
+        return False
+    for error in engine.errors:
+        common.color_print(error, False, 'LRED')
+    common.color_print('Installed {} packages in {:.1f} sec: {} files copied ({}), {} linked, {} unchanged, {} removed, {} conflicts'.format(
+        len(packages), time.time() - start, engine.copied, uploader.format_size(engine.copied_size),
+        engine.linked, engine.skipped, engine.removed, len(engine.conflicts)), True, 'LGREEN')
+    engine.close()
+    return result
 
 
 if __name__ == "__main__":
     parse_arguments()
     if args.command == 'git':
+        result = True
         if args.status:
-            git_status()
+            result = git_status(args.jobs) and result
         if args.pull:
-            git_pull()
+            result = git_pull(args.jobs) and result
         if args.push:
-            git_push()
+            result = git_push(args.jobs) and result
         if args.clone:
-            git_clone()
+            result = git_clone(args.jobs, args.remote) and result
         if args.message is not None and args.message != '':
-            git_commit(args.message)
+            result = git_commit(args.message, args.jobs) and result
+        if not result:
+            common.exit(1)
     elif args.command == 'make':
         if args.versions:
             make_versions()
-            exit(0)
-        if args.only_repos is not None:
-            repositories = [repo for repo in repositories if repo['url'] in args.only_repos.split(',')]
+            common.exit(0)
+        try:
+            repositories = package_registry.select(registry.split_names(args.only_repos), get_os(), args.with_deps, args.with_dependents)
+        except (KeyError, ValueError) as e:
+            common.exit(e.args[0])
 
         if not args.clean:
-            make_package(repositories, args.generator_name, args.toolset_name)
+            if args.trace:
+                build_trace.enable(os.path.abspath(args.trace))
+            try:
+                cache = compiler_cache.create(args.compiler_cache, args.compiler_cache_dir, args.compiler_cache_size,
+                                              os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir)))
+            except ValueError as e:
+                common.exit(str(e))
+            if not make_package(repositories, args.generator_name, args.toolset_name, args.jobs, args.parallel, args.force, cache, args.jobserver):
+                common.exit('Make failed')
         else:
             clean_all(repositories)
     elif args.command == 'organize':
         organize_sources(args.dst_name, args.dst_path)
     elif args.command == 'install_all':
-        install_all(args.install_dst)
+        only = args.packages.split(',') if args.packages else None
+        uninstall = args.uninstall.split(',') if args.uninstall else None
+        if not install_all(args.install_dst, args.link, args.jobs, only, uninstall, args.strict):
+            common.exit('Install failed')
     elif args.command == 'update':
         update_scripts(args.script)
     else:
-        exit('Unsupported command')
+        common.exit('Unsupported command')
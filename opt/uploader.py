@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Streaming file upload with progress and checksum
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import hashlib
+import os
+import ssl
+import time
+import common
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:
+    import httplib
+    from urlparse import urlsplit
+
+default_chunk_size = 1024 * 1024
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+
+
+class Progress:
+    '''Print transferred size and throughput not more often than interval'''
+
+    def __init__(self, name, total, done=0, interval=2.0):
+        self.name = name
+        self.total = total
+        self.done = done
+        self.sent = 0
+        self.interval = interval
+        self.start = time.time()
+        self.last = self.start
+
+    def restart(self, done):
+        '''Start counting again from done when the data is sent again'''
+        self.done = done
+        self.sent = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def speed(self):
+        return self.sent / max(time.time() - self.start, 0.001)
+
+    def update(self, size):
+        self.done += size
+        self.sent += size
+        now = time.time()
+        if now - self.last >= self.interval or self.done >= self.total:
+            self.last = now
+            self.report()
+
+    def report(self):
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        common.color_print('{}: {:.0f}% {} of {}, {}/s'.format(self.name, percent,
+            format_size(self.done), format_size(self.total), format_size(self.speed())), False, 'OKGRAY')
+
+
+class FileStream:
+    '''
+    Iterate over file chunks starting from offset. The SHA-256 of the whole
+    file is computed on the way, so the file is read only once. On resume
+    the already sent prefix is read to update the checksum but not sent.
+    '''
+
+    def __init__(self, path, chunk_size=default_chunk_size, offset=0, progress=True):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.size = os.path.getsize(path)
+        self.hash = hashlib.sha256()
+        self.progress = Progress(os.path.basename(path), self.size, offset) if progress else None
+
+    def __len__(self):
+        return self.size - self.offset
+
+    def __iter__(self):
+        # Request retries iterate again from the start
+        self.hash = hashlib.sha256()
+        if self.progress is not None:
+            self.progress.restart(self.offset)
+        with open(self.path, 'rb') as f:
+            left = self.offset
+            while left > 0:
+                chunk = f.read(min(self.chunk_size, left))
+                if not chunk:
+                    break
+                self.hash.update(chunk)
+                left -= len(chunk)
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                self.hash.update(chunk)
+                if self.progress is not None:
+                    self.progress.update(len(chunk))
+                yield chunk
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def send_file(url, path, headers=None, method='POST', chunk_size=default_chunk_size, timeout=300):
+    '''Stream file as request body. Return response body and file checksum.'''
+    url = urlsplit(url)
+    if url.scheme == 'https':
+        connection = httplib.HTTPSConnection(url.netloc, timeout=timeout, context=ssl.create_default_context())
+    else:
+        connection = httplib.HTTPConnection(url.netloc, timeout=timeout)
+    stream = FileStream(path, chunk_size)
+    request_headers = {'Content-Length': str(len(stream))}
+    if headers is not None:
+        request_headers.update(headers)
+    path_query = url.path + ('?' + url.query if url.query else '')
+    try:
+        connection.request(method, path_query, iter(stream), request_headers)
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    if response.status >= 400:
+        raise IOError('Upload {} failed: HTTP {} {}'.format(path, response.status, response.reason))
+    return data, stream.hexdigest()
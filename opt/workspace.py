@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: Persistent build directories of cross builds
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import common
+
+metadata_name = 'borsch-workspace.json'
+default_max_age = 30
+# Build dirs of the old layout, build_<name>_<unix time>
+legacy_re = re.compile(r'^build_.+_\d{9,}$')
+
+held_lock = threading.Lock()
+held = {}
+
+
+def get_path(repo_dir, abi, base_options):
+    key = hashlib.sha1('\0'.join(base_options).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(repo_dir, 'build_{}_{}'.format(abi, key))
+
+
+class Workspace:
+    '''
+    Build directory <repo>_code/build_<abi>_<hash> kept between runs. The hash
+    is taken from the options which can not change in a configured tree
+    (generator, toolchain), the full configure arguments are stored in the
+    metadata file and cmake runs again only when they differ. An exclusive
+    lock file next to the directory is held from configure until the
+    packages are uploaded, so concurrent runs do not build in the same tree.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = self.path + '.lock'
+        self.lock_file = None
+
+    def lock(self, wait=True):
+        '''Return False if the workspace is locked by other process and wait is False'''
+        while True:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except (IOError, OSError):
+                lock_file.close()
+                return False
+            # The lock file is removed by prune() while we wait, lock the new one
+            if self.is_lock_file(lock_file):
+                self.lock_file = lock_file
+                return True
+            lock_file.close()
+
+    def is_lock_file(self, lock_file):
+        '''True if lock_file is still the file at lock_path'''
+        try:
+            st = os.stat(self.lock_path)
+        except OSError:
+            return False
+        fst = os.fstat(lock_file.fileno())
+        return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+    def unlock(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def read_metadata(self):
+        try:
+            with open(os.path.join(self.path, metadata_name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_metadata(self, data):
+        path = os.path.join(self.path, metadata_name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def prepare(self, args, clean=False):
+        '''Create the directory, return True if it must be configured with args'''
+        if clean and os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        metadata = self.read_metadata()
+        metadata['last_used'] = time.time()
+        configured = metadata.get('args') == args and os.path.exists(os.path.join(self.path, 'CMakeCache.txt'))
+        if not configured:
+            # Options removed from args stay in the cache otherwise
+            if os.path.exists(os.path.join(self.path, 'CMakeCache.txt')):
+                os.remove(os.path.join(self.path, 'CMakeCache.txt'))
+            metadata['args'] = None
+        self.write_metadata(metadata)
+        return not configured
+
+    def remove(self):
+        '''Remove the directory and the lock file, the workspace must be locked'''
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.is_lock_file(self.lock_file):
+            os.remove(self.lock_path)
+
+    def configured(self, args):
+        metadata = self.read_metadata()
+        metadata['args'] = args
+        metadata['configured'] = time.time()
+        self.write_metadata(metadata)
+
+
+def acquire(repo_dir, abi, base_options, args, clean=False):
+    '''Lock the workspace, return (path, configure needed). Keep it locked until release(path)'''
+    item = Workspace(get_path(repo_dir, abi, base_options))
+    if not item.lock(False):
+        common.log('Wait for workspace {} used by other build'.format(item.path))
+        item.lock()
+    try:
+        reconfigure = item.prepare(args, clean)
+    except Exception:
+        item.unlock()
+        raise
+    with held_lock:
+        held[item.path] = item
+    return item.path, reconfigure
+
+
+def configured(path, args):
+    with held_lock:
+        item = held[path]
+    item.configured(args)
+
+
+def release(path):
+    with held_lock:
+        item = held.pop(path, None)
+    if item is not None:
+        item.unlock()
+
+
+def prune(root_dir, max_age=default_max_age):
+    '''
+    Remove build directories of <root_dir>/*_code not used for max_age days
+    and the timestamped ones of the old layout. Locked directories are kept.
+    '''
+    limit = time.time() - max_age * 24 * 3600
+    removed = 0
+    for code_dir in sorted(os.listdir(root_dir)):
+        code_path = os.path.join(root_dir, code_dir)
+        if not code_dir.endswith('_code') or not os.path.isdir(code_path):
+            continue
+        for name in sorted(os.listdir(code_path)):
+            path = os.path.join(code_path, name)
+            if not name.startswith('build_') or not os.path.isdir(path):
+                continue
+            item = Workspace(path)
+            metadata = item.read_metadata()
+            if not metadata and legacy_re.match(name) is None:
+                continue
+            if metadata and metadata.get('last_used', 0) > limit:
+                continue
+            if not item.lock(False):
+                continue
+            try:
+                # Other run could use it before we got the lock
+                metadata = item.read_metadata()
+                if metadata and metadata.get('last_used', 0) > limit:
+                    continue
+                common.log('Remove workspace ' + path)
+                item.remove()
+                removed += 1
+            finally:
+                item.unlock()
+    return removed
+
+
+def add_arguments(parser):
+    parser.add_argument('--clean', dest='clean', action='store_true', default=False, help='delete build directories of the selected packages before building')
+    parser.add_argument('--prune', dest='prune', type=int, default=None, metavar='DAYS', help='remove build directories not used for DAYS days (and the old timestamped ones) before building')
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: tools.py git fan-out tests against local bare repositories
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'opt'))
+import common
+import tools
+
+git_env = {
+    'GIT_AUTHOR_NAME': 'borsch', 'GIT_AUTHOR_EMAIL': 'borsch@localhost',
+    'GIT_COMMITTER_NAME': 'borsch', 'GIT_COMMITTER_EMAIL': 'borsch@localhost',
+    'GIT_CONFIG_NOSYSTEM': '1',
+}
+
+
+def git(*args, **kwargs):
+    subprocess.check_call(('git',) + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+
+class GitForeachTest(unittest.TestCase):
+    '''lib_a and lib_b have bare remotes, lib_c does not exist anywhere'''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        patcher = mock.patch.dict(os.environ, git_env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.remote_dir = os.path.join(self.tmp_dir, 'remote')
+        for name in ('lib_a', 'lib_b'):
+            git('init', '--bare', '-q', os.path.join(self.remote_dir, name + '.git'))
+            self.commit(name, 'README', name)
+
+        # The tools run from <root>/borsch/opt, repositories are in <root>
+        self.root_dir = os.path.join(self.tmp_dir, 'root')
+        os.makedirs(os.path.join(self.root_dir, 'borsch', 'opt'))
+        old_cwd = os.getcwd()
+        os.chdir(os.path.join(self.root_dir, 'borsch', 'opt'))
+        self.addCleanup(os.chdir, old_cwd)
+        patcher = mock.patch.object(tools, 'repositories', [{'name': 'lib_a'}, {'name': 'lib_b'}, {'name': 'lib_c'}])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.output = io.StringIO()
+        common.setup('plain', self.output)
+        self.addCleanup(common.setup)
+
+    def commit(self, name, file_name, content):
+        '''Push a commit to the remote of name through a temporary clone'''
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        git('clone', '-q', os.path.join(self.remote_dir, name + '.git'), work_dir)
+        with open(os.path.join(work_dir, file_name), 'w') as f:
+            f.write(content)
+        git('add', file_name, cwd=work_dir)
+        git('commit', '-q', '-m', 'Add ' + file_name, cwd=work_dir)
+        git('push', '-q', 'origin', 'HEAD', cwd=work_dir)
+        shutil.rmtree(work_dir)
+
+    def clone(self):
+        return tools.git_clone(2, 'file://' + self.remote_dir + '/')
+
+    def lines(self):
+        common.flush()
+        return self.output.getvalue().splitlines()
+
+    def block(self, title, name):
+        '''Output lines of one repository, they must not be interleaved with others'''
+        lines = self.lines()
+        start = lines.index('{} {}'.format(title, name)) + 1
+        end = start
+        while end < len(lines) and not lines[end].startswith(title + ' ') and lines[end] != title + ' summary:':
+            end += 1
+        return lines[start:end]
+
+    def assert_summary(self, title, results):
+        lines = self.lines()
+        summary = lines[lines.index(title + ' summary:') + 1:]
+        for name, result in results.items():
+            self.assertIn('{} {}'.format(name.ljust(10), 'OK' if result else 'FAILED'), summary)
+        self.assertEqual(summary[-1], 'Total: {}, succeeded: {}, failed: {}'.format(
+            len(results), list(results.values()).count(True), list(results.values()).count(False)))
+
+    def test_clone(self):
+        self.assertFalse(self.clone())
+        for name in ('lib_a', 'lib_b'):
+            with open(os.path.join(self.root_dir, name, 'README')) as f:
+                self.assertEqual(f.read(), name)
+        self.assertFalse(os.path.exists(os.path.join(self.root_dir, 'lib_c')))
+        self.assertTrue(any('lib_c.git' in line for line in self.block('clone', 'lib_c')))
+        self.assert_summary('clone', {'lib_a': True, 'lib_b': True, 'lib_c': False})
+
+    def test_pull(self):
+        self.clone()
+        self.commit('lib_a', 'NEWS', 'news')
+        shutil.rmtree(os.path.join(self.remote_dir, 'lib_b.git'))
+        self.assertFalse(tools.git_pull(3))
+        with open(os.path.join(self.root_dir, 'lib_a', 'NEWS')) as f:
+            self.assertEqual(f.read(), 'news')
+        self.assertTrue(self.block('pull', 'lib_b'))
+        self.assertEqual(self.block('pull', 'lib_c'), [os.path.join(self.root_dir, 'lib_c') + ' not exists'])
+        self.assert_summary('pull', {'lib_a': True, 'lib_b': False, 'lib_c': False})
+
+    def test_status(self):
+        self.clone()
+        with open(os.path.join(self.root_dir, 'lib_b', 'README'), 'w') as f:
+            f.write('changed')
+        tools.git_status(3)
+        # Clean repositories print nothing
+        self.assertEqual(self.block('status', 'lib_a'), [])
+        self.assertTrue(any('modified:' in line and 'README' in line for line in self.block('status', 'lib_b')))
+        self.assert_summary('status', {'lib_a': True, 'lib_b': True, 'lib_c': False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+################################################################################
+##
+## Project: NextGIS Borsch build system
+## Purpose: RepkaClient tests against a local stand-in HTTP server
+## Copyright (c) 2026 NextGIS <info@nextgis.com>
+## License: GPL v.2
+##
+################################################################################
+
+import base64
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'opt'))
+import repka_release
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Paths under /base: /ok answers 200, /flaky answers 503 until fail_count requests
+    are failed, /missing answers 404, /drop answers 200 and closes the
+    keep-alive connection without telling the client, /api/upload stores
+    the multipart file.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data=None):
+        body = json.dumps(data if data is not None else {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests.append((self.command, self.path, self.client_address, dict(self.headers)))
+        path = self.path[len('/base'):]
+        if path == '/ok':
+            self.reply(200, {'method': self.command, 'body': body.decode()})
+        elif path == '/flaky':
+            with server.lock:
+                server.fail_count -= 1
+                failed = server.fail_count >= 0
+            self.reply(503 if failed else 200)
+        elif path == '/missing':
+            self.reply(404)
+        elif path == '/drop':
+            self.reply(200)
+            self.close_connection = True
+        elif path == '/api/upload':
+            boundary = self.headers['Content-Type'].split('boundary=')[1].encode()
+            part = body.split(b'--' + boundary)[1]
+            head, content = part.split(b'\r\n\r\n', 1)
+            server.uploaded = content[:-2]
+            name = head.decode().split('filename="')[1].split('"')[0]
+            self.reply(200, {'file': 'upload-1', 'name': name})
+        else:
+            self.reply(500)
+
+    do_GET = do_POST = do_PUT = handle_request
+
+
+class RepkaClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.fail_count = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+        endpoint = 'http://127.0.0.1:{}/base'.format(self.server.server_address[1])
+        self.client = repka_release.RepkaClient('user', 'secret', endpoint, backoff=0.5)
+        patcher = mock.patch.object(repka_release.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def ports(self):
+        return [request[2][1] for request in self.server.requests]
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get_json('/ok')['method'], 'GET')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(set(self.ports())), 1)
+
+    def test_auth_header(self):
+        self.client.send_json('PUT', '/ok', {'a': 1})
+        _, path, _, headers = self.server.requests[0]
+        self.assertEqual(path, '/base/ok')
+        self.assertEqual(headers['Authorization'], 'Basic ' + base64.b64encode(b'user:secret').decode())
+        self.assertEqual(headers['Content-Type'], 'application/json')
+
+    def test_retry_with_backoff_on_5xx(self):
+        self.server.fail_count = 2
+        response, _ = self.client.send('GET', '/flaky')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual([call[0][0] for call in self.sleep.call_args_list], [0.5, 1.0])
+
+    def test_5xx_after_retries(self):
+        self.server.fail_count = 10
+        with self.assertRaises(repka_release.RepkaError) as error:
+            self.client.send('GET', '/flaky', retries=1)
+        self.assertEqual(error.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_no_retry_on_4xx(self):
+        with self.assertRaises(repka_release.RepkaError) as error:
+            self.client.send('GET', '/missing')
+        self.assertEqual(error.exception.status, 404)
+        self.assertEqual(len(self.server.requests), 1)
+        self.sleep.assert_not_called()
+
+    def test_reconnect_on_dropped_keep_alive(self):
+        self.client.send('GET', '/drop')
+        # The pooled connection is closed by the server, retries are not used
+        response, _ = self.client.send('GET', '/ok', retries=0)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(set(self.ports())), 2)
+        self.sleep.assert_not_called()
+
+    def test_upload_in_process(self):
+        content = os.urandom(300000)
+        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        response, checksum = self.client.upload(f.name, chunk_size=65536)
+        self.assertEqual(response, {'file': 'upload-1', 'name': os.path.basename(f.name)})
+        self.assertEqual(self.server.uploaded, content)
+        self.assertEqual(checksum, hashlib.sha256(content).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()